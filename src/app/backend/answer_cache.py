@@ -0,0 +1,104 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def instructions_hash(system_instructions):
+    return hashlib.sha256((system_instructions or "").encode("utf-8")).hexdigest()[:16]
+
+
+class SemanticAnswerCache:
+    """
+    Cache of /api/chat answers looked up by query embedding.
+
+    Entries are grouped by scope (product, version, model, hash of the
+    system instructions, retrieval options); a lookup only compares against its own scope and
+    hits when the best cosine similarity is >= `threshold`. At most
+    `max_entries` answers are kept overall, least recently used evicted
+    first, and entries older than `ttl` seconds are ignored.
+    """
+
+    def __init__(self, max_entries=1000, threshold=0.95, ttl=3600):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self._entries = OrderedDict()  # entry id -> (scope, query, unit vector, payload, stored_at)
+        self._scopes = {}  # scope -> {entry id, ...}
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def scope(product, version, model, system_instructions=None, retrieval=()):
+        return (product, version, model, instructions_hash(system_instructions), tuple(retrieval))
+
+    @staticmethod
+    def _unit(embedding):
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _remove(self, entry_id):
+        scope = self._entries.pop(entry_id)[0]
+        ids = self._scopes[scope]
+        ids.discard(entry_id)
+        if not ids:
+            del self._scopes[scope]
+
+    def lookup(self, scope, embedding):
+        """Returns (payload, matched_query, similarity) or None."""
+        query = self._unit(embedding)
+        now = time.time()
+        with self._lock:
+            ids = [i for i in self._scopes.get(scope, ()) if now - self._entries[i][4] <= self.ttl]
+            for expired in set(self._scopes.get(scope, ())) - set(ids):
+                self._remove(expired)
+            if ids:
+                matrix = np.stack([self._entries[i][2] for i in ids])
+                sims = matrix @ query
+                best = int(np.argmax(sims))
+                if sims[best] >= self.threshold:
+                    entry_id = ids[best]
+                    self._entries.move_to_end(entry_id)
+                    self.hits += 1
+                    _, matched_query, _, payload, _ = self._entries[entry_id]
+                    return payload, matched_query, round(float(sims[best]), 4)
+            self.misses += 1
+        return None
+
+    def store(self, scope, query, embedding, payload):
+        vec = self._unit(embedding)
+        with self._lock:
+            entry_id = self._next_id
+            self._next_id += 1
+            self._entries[entry_id] = (scope, query, vec, payload, time.time())
+            self._scopes.setdefault(scope, set()).add(entry_id)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "scopes": len(self._scopes),
+                "max_entries": self.max_entries,
+                "threshold": self.threshold,
+                "ttl_s": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
@@ -1,28 +1,50 @@
+import sys
 import os
 import re
 from openai import AzureOpenAI
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
-import requests
-from sentence_transformers import SentenceTransformer
 import psycopg2
-import numpy as np
 import json
 import time
-import numpy as np
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from db_pool import PgConnectionPool, PoolTimeout
+from embedding_cache import EmbeddingCache, cache_key
+from answer_cache import SemanticAnswerCache
+from chunk_similarity import max_similarity_to_other_versions
+from azure_client import AzureClient, CircuitOpenError
+from embedding_pipeline import embed_in_batches, estimate_tokens
+from context_packer import context_budget, pack_context
+from catalog import CollectionCatalog, start_notify_listener
+from vector_index import DEFAULT_SEARCH_PROFILE, EMBEDDING_DIM, apply_search_profile, embedding_expr, ensure_indexes, list_indexes
+from suggestions import SuggestionEngine, normalize_query
+from hybrid_search import RRF_K, Reranker, hybrid_sql, lexical_tsquery
+from local_embeddings import LocalEmbedder
+from version_retrieval import cross_version_sql, split_shared_chunks
+from ingest import ANN_METHODS, DEFAULT_INDEX_METHOD, chunk_document, html_to_markdown, ingest_collection
+from history_manager import HistoryManager, contextual_query, format_turns, looks_like_follow_up
+from job_queue import JobQueue
+from rate_limiter import Overloaded, RateLimiter, parse_limits, parse_overflow
+from metrics import current_timings, metrics, record_usage, stage, start_request_timings
+from flows import END, Call, Emit, Gather, Next, Stream, iter_sync, run_sync
 
 from dotenv import load_dotenv
 load_dotenv()
 
 
+# Chat deployments; AZURE_CHAT_ENDPOINT can point them at another resource
+# (e.g. the local mock server in benchmarks/mock_azure.py)
+AZURE_CHAT_ENDPOINT = os.environ.get("AZURE_CHAT_ENDPOINT", "https://pacsbot-standby-apis.openai.azure.com/")
 AZURE_MODEL_ENDPOINTS = {
-    "azure/gpt-4.1-mini": "https://pacsbot-standby-apis.openai.azure.com/openai/deployments/gpt-4.1-mini/chat/completions?api-version=2025-01-01-preview",
-    "azure/gpt-4o-mini": "https://pacsbot-standby-apis.openai.azure.com/openai/deployments/gpt-4o-mini/chat/completions?api-version=2025-01-01-preview",
-    "azure/gpt-4.1-nano": "https://pacsbot-standby-apis.openai.azure.com/openai/deployments/gpt-4.1-nano/chat/completions?api-version=2025-01-01-preview"
+    "azure/gpt-4.1-mini": f"{AZURE_CHAT_ENDPOINT}openai/deployments/gpt-4.1-mini/chat/completions?api-version=2025-01-01-preview",
+    "azure/gpt-4o-mini": f"{AZURE_CHAT_ENDPOINT}openai/deployments/gpt-4o-mini/chat/completions?api-version=2025-01-01-preview",
+    "azure/gpt-4.1-nano": f"{AZURE_CHAT_ENDPOINT}openai/deployments/gpt-4.1-nano/chat/completions?api-version=2025-01-01-preview"
 }
 
 
-def get_pg_connection():
+def _connect_pg():
     return psycopg2.connect(
         host=os.environ.get("POSTGRES_HOST"),
         port=os.environ.get("POSTGRES_PORT"),
@@ -32,6 +54,21 @@ def get_pg_connection():
     )
 
 
+pg_pool = PgConnectionPool(
+    _connect_pg,
+    max_size=int(os.environ.get("PG_POOL_MAX_SIZE", 10)),
+    max_lifetime=float(os.environ.get("PG_POOL_MAX_LIFETIME", 1800)),
+    health_check_after=float(os.environ.get("PG_POOL_HEALTH_CHECK_AFTER", 30)),
+    checkout_timeout=float(os.environ.get("PG_POOL_CHECKOUT_TIMEOUT", 5)),
+    checkout_timer=lambda: stage("db_connect"),
+)
+
+
+def get_pg_connection():
+    # Usage: `with get_pg_connection() as conn:` -- the connection goes back to the pool on exit
+    return pg_pool.connection()
+
+
 client = AzureOpenAI(
     api_key=os.environ["AZURE_OPENAI_API_KEY"],
     api_version=os.environ["AZURE_OPENAI_API_VERSION"],
@@ -70,6 +107,25 @@ def extract_product_and_version(collection_name):
 
     return None, None
 
+def _load_collections():
+    with get_pg_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT name, uuid::text FROM langchain_pg_collection")
+        rows = cur.fetchall()
+        cur.close()
+    return rows
+
+
+# product -> version -> collection UUID, so searches can filter on collection_id directly
+catalog = CollectionCatalog(
+    _load_collections,
+    extract_product_and_version,
+    ttl=float(os.environ.get("CATALOG_TTL", 300)),
+)
+if os.environ.get("CATALOG_NOTIFY_CHANNEL"):
+    start_notify_listener(catalog, _connect_pg, os.environ["CATALOG_NOTIFY_CHANNEL"])
+
+
 def replace_abbreviations(text):
     abbreviation_map = {
         "COB": "Close of Business",
@@ -91,24 +147,195 @@ def replace_abbreviations(text):
 
 
 ### ---- Embedding Function ---- ###
-def azure_openai_embed(texts):
-    api_key = os.environ["AZURE_OPENAI_API_KEY"]
+embedding_cache = EmbeddingCache(
+    max_bytes=int(os.environ.get("EMBEDDING_CACHE_MAX_MB", 64)) * 1024 * 1024,
+    ttl=float(os.environ.get("EMBEDDING_CACHE_TTL", 24 * 3600)),
+    sqlite_path=os.environ.get("EMBEDDING_CACHE_SQLITE_PATH") or None,
+    max_disk_rows=int(os.environ.get("EMBEDDING_CACHE_SQLITE_MAX_ROWS", 200_000)),
+)
+
+
+# Shared keep-alive sessions, retry policy and per-deployment circuit breakers
+azure = AzureClient(
+    pool_maxsize=int(os.environ.get("AZURE_HTTP_POOL_SIZE", 32)),
+    failure_threshold=int(os.environ.get("AZURE_BREAKER_FAILURES", 5)),
+    cooldown=float(os.environ.get("AZURE_BREAKER_COOLDOWN", 30)),
+)
+AZURE_EMBED_TIMEOUT = (10, float(os.environ.get("AZURE_EMBED_TIMEOUT", 20)))
+AZURE_CHAT_TIMEOUT = (10, float(os.environ.get("AZURE_CHAT_TIMEOUT", 30)))
+
+# Per-deployment RPM/TPM admission control; unset limits mean unlimited.
+# AZURE_RPM_LIMITS / AZURE_TPM_LIMITS: "azure/gpt-4.1-mini=300,azure/gpt-4o-mini=600"
+# AZURE_OVERFLOW: "azure/gpt-4.1-mini=azure/gpt-4o-mini" (used when the first is saturated)
+rate_limiter = RateLimiter(
+    rpm=parse_limits(os.environ.get("AZURE_RPM_LIMITS", "")),
+    tpm=parse_limits(os.environ.get("AZURE_TPM_LIMITS", "")),
+    overflow={k: v for k, v in parse_overflow(os.environ.get("AZURE_OVERFLOW", "")).items()
+              if v in AZURE_MODEL_ENDPOINTS},
+    max_wait=float(os.environ.get("ADMISSION_MAX_WAIT", 10)),
+    max_queue=int(os.environ.get("ADMISSION_MAX_QUEUE", 50)),
+)
+# Completion tokens reserved per call until the real usage comes back
+COMPLETION_TOKENS_ESTIMATE = int(os.environ.get("COMPLETION_TOKENS_ESTIMATE", 800))
+
+
+def reserve_chat(model, prompt, optional=False):
+    """
+    Admission for one chat call: returns a rate_limiter Ticket (possibly for
+    the overflow deployment) or raises Overloaded. Optional work doesn't queue.
+    """
+    try:
+        ticket = rate_limiter.admit(
+            model, estimate_tokens(prompt) + COMPLETION_TOKENS_ESTIMATE, max_wait=0 if optional else None
+        )
+    except Overloaded:
+        metrics.inc("llm_admissions_total", deployment=model, outcome="shed")
+        raise
+    outcome = "overflow" if ticket.overflow else "queued" if ticket.delay else "admitted"
+    metrics.inc("llm_admissions_total", deployment=model, outcome=outcome)
+    return ticket
+
+
+def admit_chat(model, prompt, optional=False):
+    ticket = reserve_chat(model, prompt, optional)
+    try:
+        if ticket.delay:
+            with stage("llm_queue"):
+                time.sleep(ticket.delay)
+    finally:
+        ticket.done_waiting()
+    return ticket
+
+
+def embeddings_url(deployment):
     endpoint = os.environ["AZURE_OPENAI_ENDPOINT"]
-    deployment = os.environ["AZURE_OPENAI_EMBEDDING_DEPLOYMENT"]
-    url = f"{endpoint}openai/deployments/{deployment}/embeddings?api-version=2024-02-15-preview"
+    return f"{endpoint}openai/deployments/{deployment}/embeddings?api-version=2024-02-15-preview"
 
-    headers = {
-        "api-key": api_key,
+
+def azure_headers():
+    return {
+        "api-key": os.environ.get("AZURE_OPENAI_API_KEY", ""),
         "Content-Type": "application/json"
     }
+
+
+def _azure_openai_embed_uncached(texts, deployment):
     data = {"input": texts}
-    response = requests.post(url, headers=headers, json=data)
-    response.raise_for_status()
-    return [item["embedding"] for item in response.json()["data"]]
+    response = azure.post(
+        embeddings_url(deployment), deployment, json=data,
+        headers=azure_headers(), timeout=AZURE_EMBED_TIMEOUT
+    )
+    body = response.json()
+    record_usage(deployment, body.get("usage"))
+    return [item["embedding"] for item in body["data"]]
+
+
+def lookup_cached_embeddings(texts, deployment):
+    """
+    Returns (keys, results, missing): results holds a cached vector or None per
+    text, and missing maps each uncached key to its text (each distinct text once).
+    """
+    keys = [cache_key(t, deployment) for t in texts]
+    results = [embedding_cache.get(k) for k in keys]
+    missing = {}
+    for i, vec in enumerate(results):
+        if vec is None:
+            missing.setdefault(keys[i], texts[i])
+    return keys, results, missing
+
+
+def merge_fresh_embeddings(keys, results, missing, fresh):
+    fresh_by_key = dict(zip(missing.keys(), fresh))
+    for k, vec in fresh_by_key.items():
+        embedding_cache.put(k, vec)
+    return [vec if vec is not None else fresh_by_key[k] for k, vec in zip(keys, results)]
+
 
+# Large inputs (e.g. every chunk of every answer in /api/semantic-llm-diff) are split
+# into token-budgeted batches that stay within the embeddings API's request limits
+EMBED_BATCH_MAX_TOKENS = int(os.environ.get("EMBED_BATCH_MAX_TOKENS", 8000))
+EMBED_BATCH_MAX_INPUTS = int(os.environ.get("EMBED_BATCH_MAX_INPUTS", 256))
+EMBED_MAX_INPUT_TOKENS = int(os.environ.get("EMBED_MAX_INPUT_TOKENS", 8000))
+EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", 4))
+embed_executor = ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY)
 
-def embed_text(text):
-    return azure_openai_embed([text])[0]
+
+def azure_openai_embed(texts):
+    deployment = os.environ["AZURE_OPENAI_EMBEDDING_DEPLOYMENT"]
+    keys, results, missing = lookup_cached_embeddings(texts, deployment)
+    # Only send texts we haven't embedded before, each distinct one once
+    if missing:
+        fresh = embed_in_batches(
+            list(missing.values()),
+            lambda batch: _azure_openai_embed_uncached(batch, deployment),
+            embed_executor,
+            max_batch_tokens=EMBED_BATCH_MAX_TOKENS,
+            max_batch_inputs=EMBED_BATCH_MAX_INPUTS,
+            max_input_tokens=EMBED_MAX_INPUT_TOKENS,
+        )
+        results = merge_fresh_embeddings(keys, results, missing, fresh)
+    return results
+
+
+# Embedding backend per use: "azure" or "local". Query and suggestion vectors are
+# compared with the stored document vectors, so they can only go local if the
+# collections were ingested with LOCAL_EMBEDDING_MODEL. semantic-llm-diff only
+# compares answers with each other, so any model will do there.
+EMBEDDING_BACKENDS = {
+    "query": os.environ.get("QUERY_EMBEDDING_BACKEND", "azure"),
+    "suggestions": os.environ.get("SUGGESTION_EMBEDDING_BACKEND", "azure"),
+    "diff": os.environ.get("DIFF_EMBEDDING_BACKEND", "azure"),
+}
+local_embedder = LocalEmbedder(
+    os.environ.get("LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2"),
+    batch_size=int(os.environ.get("LOCAL_EMBEDDING_BATCH_SIZE", 32)),
+    max_workers=int(os.environ.get("LOCAL_EMBEDDING_WORKERS", 2)),
+)
+# Cache entries are keyed by this instead of an Azure deployment name
+LOCAL_EMBEDDING_CACHE_KEY = f"local:{local_embedder.model_name}"
+
+
+def local_embed(texts):
+    keys, results, missing = lookup_cached_embeddings(texts, LOCAL_EMBEDDING_CACHE_KEY)
+    if missing:
+        fresh = local_embedder.embed(list(missing.values()))
+        results = merge_fresh_embeddings(keys, results, missing, fresh)
+    return results
+
+
+def embed_texts(texts, use="query"):
+    if EMBEDDING_BACKENDS.get(use) == "local":
+        return local_embed(texts)
+    return azure_openai_embed(texts)
+
+
+def embed_text(text, use="query"):
+    with stage("embed"):
+        return embed_texts([text], use)[0]
+
+
+def embed_documents(texts):
+    """
+    Vectors for ingestion (ingest.py): the query backend, so documents and
+    queries share a model, but not through the embedding cache, which is
+    for queries.
+    """
+    if EMBEDDING_BACKENDS["query"] == "local":
+        return local_embedder.embed(texts)
+    deployment = os.environ["AZURE_OPENAI_EMBEDDING_DEPLOYMENT"]
+    return embed_in_batches(
+        texts,
+        lambda batch: _azure_openai_embed_uncached(batch, deployment),
+        embed_executor,
+        max_batch_tokens=EMBED_BATCH_MAX_TOKENS,
+        max_batch_inputs=EMBED_BATCH_MAX_INPUTS,
+        max_input_tokens=EMBED_MAX_INPUT_TOKENS,
+    )
+
+
+# Load the local model at startup rather than on the first request that needs it
+if os.environ.get("LOCAL_EMBEDDING_WARMUP") == "1" and "local" in EMBEDDING_BACKENDS.values():
+    threading.Thread(target=local_embedder.warm_up, name="local-embed-warmup", daemon=True).start()
 
 
 def previous_version(version):
@@ -128,75 +355,362 @@ def previous_version(version):
     
     return None
 
-def search_postgres(query, product=None, version=None, history=None, top_k=20, max_tokens=3500):
-    conn = get_pg_connection()
-    cur = conn.cursor()
-    # Replace abbreviations in the query
-    expanded_query = replace_abbreviations(query)
-    print(f"Expanded query: {expanded_query}")
-    query_embedding = embed_text(expanded_query)
+# "vector" (cosine only) or "hybrid" (cosine + full-text, fused with RRF)
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "vector")
+# Candidates fetched by each side of a hybrid search before fusion
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", 40))
+# Cross-encoder re-ranking of the fused hits; off unless enabled here or per request
+RERANK_ENABLED = os.environ.get("RERANK_ENABLED", "0") == "1"
+RERANK_TOP_N = int(os.environ.get("RERANK_TOP_N", 8))
+reranker = Reranker(os.environ.get("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"))
 
+
+def search_by_embedding(query_embedding, product=None, version=None, top_k=20, profile=None,
+                        lexical_texts=None):
+    """
+    Top-k hits for the embedding, within the product/version collection when
+    both are given. With lexical_texts, runs the hybrid (vector + full-text)
+    query instead and orders hits by fused rank.
+    """
+    emb = embedding_expr()
+    collection_id = None
     if product and version:
-        collection_name = f"temenos_{product}_{version}"
-        cur.execute("""
-            SELECT e.document, c.name, e.embedding <=> %s::vector AS distance
-            FROM langchain_pg_embedding e
-            JOIN langchain_pg_collection c ON e.collection_id = c.uuid
-            WHERE c.name = %s
-            ORDER BY e.embedding <=> %s::vector
-            LIMIT %s
-        """, (query_embedding, collection_name, query_embedding, top_k))
-    else:
-        cur.execute("""
-            SELECT e.document, c.name, e.embedding <=> %s::vector AS distance
-            FROM langchain_pg_embedding e
-            JOIN langchain_pg_collection c ON e.collection_id = c.uuid
-            ORDER BY e.embedding <=> %s::vector
-            LIMIT %s
-        """, (query_embedding, query_embedding, top_k))
-    results = cur.fetchall()
-    cur.close()
-    conn.close()
+        collection_id = catalog.collection_id(f"temenos_{product}_{version}")
+        if collection_id is None:
+            return []
+    tsquery = lexical_tsquery(*lexical_texts) if lexical_texts else None
+    with get_pg_connection() as conn:
+        cur = conn.cursor()
+        with stage("vector_query"):
+            apply_search_profile(cur, profile, max(top_k, HYBRID_CANDIDATES if tsquery else 0))
+            if tsquery:
+                cur.execute(hybrid_sql(emb, collection_id is not None), {
+                    "embedding": query_embedding,
+                    "tsquery": tsquery,
+                    "candidates": max(top_k, HYBRID_CANDIDATES),
+                    "rrf_k": RRF_K,
+                    "top_k": top_k,
+                    "collection_id": collection_id,
+                })
+            elif collection_id:
+                cur.execute(f"""
+                    SELECT e.document, e.collection_id::text, {emb} <=> %s::vector AS distance
+                    FROM langchain_pg_embedding e
+                    WHERE e.collection_id = %s::uuid
+                    ORDER BY {emb} <=> %s::vector
+                    LIMIT %s
+                """, (query_embedding, collection_id, query_embedding, top_k))
+            else:
+                cur.execute(f"""
+                    SELECT e.document, e.collection_id::text, {emb} <=> %s::vector AS distance
+                    FROM langchain_pg_embedding e
+                    ORDER BY {emb} <=> %s::vector
+                    LIMIT %s
+                """, (query_embedding, query_embedding, top_k))
+            results = cur.fetchall()
+        cur.close()
+    return hits_to_context_files(results)
+
+
+def search_versions(query_embedding, product, versions, top_k=20, profile=None):
+    """
+    Top-k hits for each of several versions of a product in one query (see
+    version_retrieval.cross_version_sql). Returns {version: context_files}.
+    """
+    collection_ids = {}
+    for version in dict.fromkeys(versions):
+        collection_id = catalog.collection_id(f"temenos_{product}_{version}") if product and version else None
+        if collection_id:
+            collection_ids[version] = collection_id
+    hits = {version: [] for version in versions}
+    if not collection_ids:
+        return hits
+    with get_pg_connection() as conn:
+        cur = conn.cursor()
+        with stage("vector_query"):
+            apply_search_profile(cur, profile, top_k)
+            cur.execute(cross_version_sql(embedding_expr(), list(collection_ids.values())), {
+                "embedding": query_embedding,
+                "top_k": top_k,
+            })
+            rows = cur.fetchall()
+        cur.close()
+    arm_versions = list(collection_ids)
+    for arm, doc, collection_id, distance in rows:
+        hits[arm_versions[arm]].extend(hits_to_context_files([(doc, collection_id, distance)]))
+    return hits
+
+
+def compare_versions_for(version, count=3):
+    # The version itself, then its predecessors: r24 -> [r24, r23, r22]
+    versions = [version]
+    while len(versions) < count and previous_version(versions[-1]):
+        versions.append(previous_version(versions[-1]))
+    return versions
+
+
+def hits_to_context_files(results, refresh=True):
+    # results: (document, collection uuid as text, distance[, rrf score, full-text matched])
+    # rows; refresh=False only uses the loaded catalog (see catalog.CollectionCatalog).
+    # Fused rows are already cut to top_k by RRF rank, so the cosine threshold
+    # only drops vector-only hits: an exact identifier match can score low on it
     context_files = []
-    for doc, collection_name, distance in results:
+    for row in results:
+        doc, collection_id, distance = row[:3]
         similarity = round(1 - float(distance), 4)
-        if similarity > 0.3:
-            context_files.append({
+        lexical = len(row) > 4 and row[4]
+        if lexical or similarity > 0.3:
+            hit = {
                 "document": doc,
-                "collection_name": collection_name,
+                "collection_name": catalog.collection_name(collection_id, refresh) or collection_id,
                 "similarity": similarity
-            })
+            }
+            if len(row) > 3:
+                # Packing follows the fused order rather than raw similarity
+                hit["rank_score"] = round(float(row[3]), 6)
+            context_files.append(hit)
     return context_files
 
 
-def call_chat_api(prompt, model, retries=3):
+def retrieval_options(mode=None, rerank=None):
+    # Per-request overrides of RETRIEVAL_MODE / RERANK_ENABLED
+    return (mode or RETRIEVAL_MODE) == "hybrid", RERANK_ENABLED if rerank is None else bool(rerank)
+
+
+def rerank_hits(query, hits, rerank):
+    if not rerank or not hits:
+        return hits
+    with stage("rerank"):
+        return reranker.rerank(query, hits, RERANK_TOP_N)
+
+
+# Default token budget for the context section of a chat prompt
+CONTEXT_MAX_TOKENS = int(os.environ.get("CONTEXT_MAX_TOKENS", 3500))
+
+
+def search_candidates_flow(query, product=None, version=None, top_k=20, profile=None, mode=None, rerank=None,
+                           embedding_use="query"):
+    hybrid, rerank = retrieval_options(mode, rerank)
+    # Replace abbreviations in the query
+    with stage("expand_abbreviations"):
+        expanded_query = replace_abbreviations(query)
+    # Embed before checking out a connection so it isn't held during the Azure call
+    query_embedding = yield Call("embed_text", expanded_query, embedding_use)
+    # The lexical side matches both the raw identifiers and their expansions
+    lexical_texts = (query, expanded_query) if hybrid else None
+    hits = yield Call("search_by_embedding", query_embedding, product, version, top_k, profile, lexical_texts)
+    return (yield Call("rerank_hits", expanded_query, hits, rerank))
+
+
+def search_postgres_flow(query, product=None, version=None, history=None, top_k=20,
+                         max_tokens=CONTEXT_MAX_TOKENS, profile=None, embedding_use="query"):
+    # Top-k hits, de-duplicated and packed into max_tokens. A follow-up is
+    # searched together with the previous question (no LLM rewrite here)
+    query = contextual_query(query, history or [])
+    hits = yield from search_candidates_flow(query, product, version, top_k, profile, embedding_use=embedding_use)
+    context_files, _ = pack_context(hits, max_tokens)
+    return context_files
+
+
+# Answers to history-free questions, reused for near-identical rewordings
+answer_cache = SemanticAnswerCache(
+    max_entries=int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 1000)),
+    threshold=float(os.environ.get("ANSWER_CACHE_THRESHOLD", 0.95)),
+    ttl=float(os.environ.get("ANSWER_CACHE_TTL", 3600)),
+)
+ANSWER_CACHE_ENABLED = os.environ.get("ANSWER_CACHE_ENABLED", "1") != "0"
+
+
+def answer_cache_scope(data, history, model, product, version):
+    # Answers depend on the conversation, so only history-free requests are cached
+    if not ANSWER_CACHE_ENABLED or history or data.get('cache') is False:
+        return None
+    # So are the retrieval options, resolved to their effective values so an
+    # explicit default shares entries with an omitted one
+    hybrid, rerank = retrieval_options(data.get('retrieval_mode'), data.get('rerank'))
+    retrieval = (
+        data.get('top_k', 20),
+        data.get('max_context_tokens', CONTEXT_MAX_TOKENS),
+        hybrid,
+        rerank,
+        data.get('search_profile') or DEFAULT_SEARCH_PROFILE,
+    )
+    return SemanticAnswerCache.scope(product, version, model, data.get('system_instructions'), retrieval)
+
+
+def cache_hit_fields(matched_query, similarity):
+    return {"cache": "hit", "cache_match": {"query": matched_query, "similarity": similarity}}
+
+
+# Chat history: recent turns verbatim, older ones as a cached rolling summary
+history_manager = HistoryManager(
+    keep_turns=int(os.environ.get("HISTORY_KEEP_TURNS", 6)),
+    max_tokens=int(os.environ.get("HISTORY_MAX_TOKENS", 1500)),
+    summary_tokens=int(os.environ.get("HISTORY_SUMMARY_TOKENS", 400)),
+)
+HISTORY_SUMMARY_MODEL = os.environ.get("HISTORY_SUMMARY_MODEL", "azure/gpt-4.1-mini")
+# "auto": rewrite only queries that look like follow-ups; "always"; "off"
+QUERY_REWRITE = os.environ.get("QUERY_REWRITE", "auto")
+QUERY_REWRITE_MODEL = os.environ.get("QUERY_REWRITE_MODEL", "azure/gpt-4.1-mini")
+
+
+def needs_rewrite(user_query, history, mode=None):
+    mode = mode or QUERY_REWRITE
+    if not history or mode == "off":
+        return False
+    return mode == "always" or looks_like_follow_up(user_query)
+
+
+def compact_history_flow(history):
+    """
+    Prompt-ready history within HISTORY_MAX_TOKENS: a summary of the turns
+    before the last HISTORY_KEEP_TURNS (only the newly aged-out turns are
+    sent to the LLM), then the recent turns. Returns (history, stats).
+    """
+    older, recent = history_manager.split(history)
+    if not older:
+        return history_manager.fit(None, recent)
+    summary, covered = history_manager.cached_summary(older)
+    if covered < len(older):
+        with stage("history_summary"):
+            text = yield Call(
+                "call_chat_api", build_history_summary_prompt(summary, older[covered:]),
+                model=HISTORY_SUMMARY_MODEL, retries=1, optional=True
+            )
+        if text.startswith("[API Error]"):
+            # Keep what is cached; the unsummarized turns compete for the budget verbatim
+            return history_manager.fit(summary, older[covered:] + recent, len(history))
+        summary = text.strip()
+        history_manager.store_summary(older, summary)
+    return history_manager.fit(summary, recent, len(history))
+
+
+def standalone_query_flow(user_query, history, mode=None):
+    # Follow-ups ("and for r23?") rewritten into self-contained retrieval queries
+    if not needs_rewrite(user_query, history, mode):
+        return user_query
+    _, recent = history_manager.split(history)
+    cached = history_manager.cached_rewrite(user_query, recent)
+    if cached is not None:
+        return cached
+    with stage("query_rewrite"):
+        text = yield Call(
+            "call_chat_api", build_rewrite_prompt(user_query, recent),
+            model=QUERY_REWRITE_MODEL, retries=1, optional=True
+        )
+    rewrite = text.strip().strip('"')
+    if text.startswith("[API Error]") or not rewrite:
+        return contextual_query(user_query, history)
+    history_manager.store_rewrite(user_query, recent, rewrite)
+    return rewrite
+
+
+# Shared by fan-out requests for the concurrent retrieval and LLM calls
+fanout_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("FANOUT_MAX_WORKERS", 16)))
+
+
+# The *_flow functions are the request logic shared with asgi_app (see
+# flows.py); here their Calls go to this module's blocking functions
+def run_flow(flow):
+    return run_sync(flow, sys.modules[__name__], fanout_executor)
+
+
+def iter_flow(flow):
+    return iter_sync(flow, sys.modules[__name__], fanout_executor)
+
+
+def call_chat_api(prompt, model, retries=3, optional=False):
+    """
+    Raises Overloaded (-> 503) when the deployment and its overflow are at
+    their rate limits, and CircuitOpenError (-> 503) when its breaker is
+    open; optional calls return an "[API Error]" string instead.
+    """
     if model in AZURE_MODEL_ENDPOINTS:
+        try:
+            ticket = admit_chat(model, prompt, optional)
+        except Overloaded as e:
+            if optional:
+                return f"[API Error] {str(e)}"
+            raise
+        model = ticket.deployment
         url = AZURE_MODEL_ENDPOINTS[model]
-        headers = {
-            "api-key": os.environ.get("AZURE_OPENAI_API_KEY", ""),
-            "Content-Type": "application/json"
-        }
         data = {"messages": [{"role": "user", "content": prompt}]}
-        for attempt in range(retries):
-            try:
-                resp = requests.post(url, headers=headers, json=data, timeout=30)
-                resp.raise_for_status()
-                return resp.json()["choices"][0]["message"]["content"]
-            except Exception as e:
-                if attempt < retries - 1:
-                    time.sleep(2 ** attempt)
-                else:
-                    return f"[API Error] {str(e)}"
+        started = time.perf_counter()
+        try:
+            with stage("llm_call"):
+                resp = azure.post(
+                    url, model, json=data, headers=azure_headers(),
+                    timeout=AZURE_CHAT_TIMEOUT, retries=retries, on_retry=ticket.retry
+                )
+            body = resp.json()
+            record_usage(model, body.get("usage"))
+            ticket.settle(body.get("usage"))
+            return body["choices"][0]["message"]["content"]
+        except CircuitOpenError as e:
+            # An open breaker is a 503 (handle_circuit_open), not an answer
+            if optional:
+                return f"[API Error] {str(e)}"
+            raise
+        except Exception as e:
+            return f"[API Error] {str(e)}"
+        finally:
+            metrics.observe("llm_call_duration_seconds", time.perf_counter() - started, model=model)
     else:
         return "contact backend error"
-    
 
 
-def cosine_similarity(a, b):
-    a = np.array(a)
-    b = np.array(b)
-    denom = np.linalg.norm(a) * np.linalg.norm(b)
-    return float(np.dot(a, b) / denom) if denom else 0.0
+def parse_stream_line(line):
+    """
+    Turns one SSE line of an Azure chat completion stream into a list of
+    ("delta", text) / ("usage", {...}) events. Returns None at the [DONE] marker.
+    """
+    if not line or not line.startswith("data:"):
+        return []
+    payload = line[len("data:"):].strip()
+    if payload == "[DONE]":
+        return None
+    chunk = json.loads(payload)
+    events = []
+    for choice in chunk.get("choices") or []:
+        content = (choice.get("delta") or {}).get("content")
+        if content:
+            events.append(("delta", content))
+    if chunk.get("usage"):
+        events.append(("usage", chunk["usage"]))
+    return events
+
+
+def stream_chat_api(prompt, model):
+    """
+    Yields ("delta", text) for each completion chunk as Azure sends it,
+    then a single ("usage", {...}) if the service reports token usage.
+    The read timeout bounds the gap between chunks, not the whole answer.
+    """
+    if model not in AZURE_MODEL_ENDPOINTS:
+        yield "delta", "contact backend error"
+        return
+    ticket = admit_chat(model, prompt)
+    model = ticket.deployment
+    url = AZURE_MODEL_ENDPOINTS[model]
+    data = {
+        "messages": [{"role": "user", "content": prompt}],
+        "stream": True,
+        "stream_options": {"include_usage": True},
+    }
+    resp = azure.post(
+        url, model, json=data, headers=azure_headers(),
+        timeout=AZURE_CHAT_TIMEOUT, stream=True, on_retry=ticket.retry
+    )
+    with resp:
+        for line in resp.iter_lines(decode_unicode=True):
+            events = parse_stream_line(line)
+            if events is None:
+                break
+            for kind, value in events:
+                if kind == "usage":
+                    ticket.settle(value)
+                yield kind, value
+
 
 def split_into_sentences(text):
     blocks = re.split(r'\n\s*\n', text.strip())
@@ -214,28 +728,171 @@ def split_into_chunks(text):
     all_chunks.append(text.strip())
     return all_chunks
 
+def chunk_answers(answers):
+    # Split each answer into chunks and flatten them, keeping track of indices
+    flattened_chunks = []
+    chunk_map = []  # list of (version_idx, chunk_text)
+    for v_idx, ans in enumerate(answers):
+        for chunk in split_into_chunks(ans):
+            flattened_chunks.append(normalize_text(chunk))
+            chunk_map.append((v_idx, chunk))  # keep original text
+    return flattened_chunks, chunk_map
+
+
+def diff_highlights(versions, chunk_map, embeddings, threshold):
+    # Organize embeddings per version
+    per_version_embeddings = [[] for _ in versions]
+    per_version_chunks = [[] for _ in versions]
+    for i, (v_idx, chunk_text) in enumerate(chunk_map):
+        per_version_embeddings[v_idx].append(embeddings[i])
+        per_version_chunks[v_idx].append(chunk_text)
+
+    # Compare each chunk embedding to chunks in *other* versions to find uniqueness
+    # (batched matrix products over normalized embeddings, max taken row-wise)
+    max_sims = max_similarity_to_other_versions(per_version_embeddings)
+
+    highlights = []
+    for v_idx, chunks in enumerate(per_version_chunks):
+        # A chunk is unique if no chunk in another version is too similar
+        unique_chunks = [
+            {"text": chunk, "is_unique": True}
+            for chunk, max_sim in zip(chunks, max_sims[v_idx])
+            if max_sim < threshold
+        ]
+        highlights.append({
+            "version": versions[v_idx],
+            "chunks": unique_chunks,
+        })
+    return highlights
+
+
 def format_prompt(versions_with_text):
     return '\n\n'.join([f"Version {v['version']}:\n{v['content']}" for v in versions_with_text])
 
-app = Flask(__name__)
-CORS(app)
+def build_chat_prompt(user_query, history, context_blocks, product, version, system_instructions=None):
+    # Format conversation history (already compacted by compact_history)
+    history_str = format_turns(history)
 
+    context_str = "\n\n".join(
+        f"Collection: {block['collection_name']}\nDocument:\n{block['document']}"
+        for block in context_blocks
+    )
 
-@app.route("/api/suggestions", methods=['POST'])
-def get_suggestions():
-    data = request.json
-    input_query = data.get("query", "").strip()
-    context_chats = data.get("context", [])
-    product = data.get("product")
-    version = data.get("version")
-    history = data.get("history", [])  # List of {"role": "user"/"bot", "content": "..."}
+    # System prompt
+    default_system_instructions = f"""You are a highly knowledgeable assistant for Temenos banking products.
 
-    if not input_query:
-        return jsonify({"suggestions": []})
+You will be given:
+- A conversation history between the user and assistant, which may contain follow-up questions, references, or pronouns.
+- Context blocks from official documentation. Each block contains section headers marked as h1:, h2:, etc., followed by the content from that section.
+
+Instructions:
+- Carefully read the h1:, h2:, and other header markers to understand the topic and subtopic of each context block.
+- Use the information under these headers to answer the user's question as accurately as possible.
+- If the answer requires information from multiple sections, synthesize a complete answer using all relevant blocks.
+- When possible, cite the h1:/h2: section titles in your answer to help the user understand where the information comes from.
+- Look for the following abbreviations in the context:
+    -"COB" for "Close of Business"
+    -"AA" for "Arrangement Architecture"
+    -"MM" for "Money Market"
+    -"FX" for "Foreign Exchange"
+    -"SW" for "SWAP"
+    -"LC" for "Letter of Credit"
+    -"MD" for "Miscellaneous Deals"
+- If there are typos in the query provided to you try to provide the correct word and ask them for clarification before answering.
+- If the context does not contain enough information, reply: "Not enough context provided."
+- Do not speculate or use external information.
+- Provide clear, structured answers, using examples, pseudocode, or markdown if applicable.
+
+Always base your answer on the provided context.
+You are currently helping with product: {product} and version: {version}.
+Mention the product and version in your answer."""
+
+    # Override if user sent edited system_instructions
+    if system_instructions is None:
+        system_instructions = default_system_instructions
+ 
+    full_prompt = (
+        f"{system_instructions}\n\n"
+        f"--- CONVERSATION HISTORY ---\n{history_str}\n"
+        f"--- CONTEXT ---\n{context_str}\n\n"
+        f"--- QUESTION ---\n{user_query}"
+    )
+    return full_prompt
 
-    # Optional: also search most relevant documents
-    top_context_docs = search_postgres(input_query, history, product, version)[:3]
 
+def pack_chat_prompt(user_query, history, hits, product, version, model,
+                     system_instructions=None, max_context_tokens=CONTEXT_MAX_TOKENS):
+    """
+    Pack retrieved hits into the context section and build the prompt.
+    The context budget is max_context_tokens, capped so the whole prompt
+    still fits the model's window. Returns (context_blocks, context_stats, full_prompt).
+    """
+    with stage("prompt_assembly"):
+        overhead = estimate_tokens(
+            build_chat_prompt(user_query, history, [], product, version, system_instructions)
+        )
+        budget = context_budget(model, overhead, max_context_tokens)
+        context_blocks, context_stats = pack_context(hits, budget)
+        full_prompt = build_chat_prompt(
+            user_query, history, context_blocks, product, version, system_instructions
+        )
+        context_stats["prompt_tokens"] = estimate_tokens(full_prompt)
+    return context_blocks, context_stats, full_prompt
+
+
+def pack_versions_prompt(user_query, history, hits_by_version, product, versions, model,
+                         system_instructions=None, max_context_tokens=CONTEXT_MAX_TOKENS):
+    """
+    One prompt that answers for several versions at once. Chunks identical in
+    more than one version are packed once (labelled with every collection
+    they come from), then each version's own chunks fill what is left of its
+    budget, so no version sees more than max_context_tokens of context.
+    Returns (shared_blocks, blocks_by_version, context_stats, full_prompt).
+    """
+    question = (
+        f"{user_query}\n\nAnswer separately for each of these versions: {', '.join(versions)}. "
+        "Start each answer with a line '### Version <version>'. A context block listing "
+        "several collections is identical in all of those versions."
+    )
+    with stage("prompt_assembly"):
+        overhead = estimate_tokens(
+            build_chat_prompt(question, history, [], product, ", ".join(versions), system_instructions)
+        )
+        budget = context_budget(model, overhead, max_context_tokens)
+        shared, unique_by_version = split_shared_chunks({v: hits_by_version.get(v, []) for v in versions})
+        for block in shared:
+            block["collection_name"] = ", ".join(f"temenos_{product}_{v}" for v in block["versions"])
+        shared_blocks, context_stats = pack_context(shared, budget)
+        shared_tokens = context_stats["packed_tokens"]
+        blocks_by_version = {}
+        for version in versions:
+            blocks_by_version[version], version_stats = pack_context(
+                unique_by_version[version], max(0, budget - shared_tokens)
+            )
+            for k in ("packed_tokens", "packed_blocks", "dropped_tokens", "dropped_duplicates", "dropped_over_budget"):
+                context_stats[k] += version_stats[k]
+        context_stats["shared_blocks"] = len(shared_blocks)
+        all_blocks = shared_blocks + [b for v in versions for b in blocks_by_version[v]]
+        full_prompt = build_chat_prompt(
+            question, history, all_blocks, product, ", ".join(versions), system_instructions
+        )
+        context_stats["prompt_tokens"] = estimate_tokens(full_prompt)
+    return shared_blocks, blocks_by_version, context_stats, full_prompt
+
+
+def split_version_answers(text, versions):
+    # Split a pack_versions_prompt answer on its "### Version <v>" headings;
+    # a version the model skipped gets the whole answer
+    parts = re.split(r'^#{2,4}\s*Version\s+(\S+)\s*$', text, flags=re.MULTILINE | re.IGNORECASE)
+    answers = {v.lower(): body.strip() for v, body in zip(parts[1::2], parts[2::2])}
+    return {v: answers.get(str(v).lower(), text) for v in versions}
+
+
+# Suggestions only need a glimpse of the docs
+SUGGESTION_CONTEXT_TOKENS = int(os.environ.get("SUGGESTION_CONTEXT_TOKENS", 800))
+
+
+def build_suggestion_prompt(input_query, context_chats, top_context_docs):
     docs_context = "\n\n".join(f"- {doc['document']}" for doc in top_context_docs)
     chat_context = "\n".join([f"{c}" for c in context_chats[-3:]])
 
@@ -260,53 +917,308 @@ Your task:
 
 Suggestions (write one per line):
 """
+    return suggestion_prompt
+
+
+def parse_suggestions(suggestions_text):
+    if suggestions_text.startswith("[API Error]"):
+        return []
+    return [line.strip() for line in suggestions_text.strip().split("\n") if line.strip()][:5]
+
+
+def build_compare_prompt(question, models, answers):
+    return (
+        f"You are an impartial expert evaluator. Your task is to select the best answer to the following question, based solely on accuracy, completeness, and clarity.\n\n"
+        f"Question: \"{question}\"\n\n"
+        f"Here are three answers from different AI models:\n"
+        f"1. {models[0]}: {answers[0]}\n"
+        f"2. {models[1]}: {answers[1]}\n"
+        f"3. {models[2]}: {answers[2]}\n\n"
+        "Instructions:\n"
+        "- Do not be influenced by the model names or writing style.\n"
+        "- Compare the answers for semantic accuracy, factual correctness, and how well they address the question.\n"
+        "- Select the answer that is most accurate, complete, and helpful.\n"
+        "- Do not favor answers that simply repeat the question or are overly verbose.\n"
+        "- Do not provide any explanation or commentary—just output the best answer verbatim.\n\n"
+        "Best Answer:"
+    )
+
+
+def build_history_summary_prompt(previous_summary, turns):
+    return (
+        "Summarize this conversation between a user and an assistant about Temenos banking products "
+        "so it can replace the turns in later prompts.\n"
+        "- Keep the products, versions, modules, table and field names, decisions and open questions.\n"
+        "- Drop greetings and anything repeated.\n"
+        "- At most 200 words, plain prose, no preamble.\n\n"
+        + (f"Summary so far:\n{previous_summary}\n\n" if previous_summary else "")
+        + f"Conversation to add:\n{format_turns(turns)}\n"
+        "Summary:"
+    )
+
+
+def build_rewrite_prompt(user_query, turns):
+    return (
+        "Rewrite the user's last question as a standalone search query for Temenos documentation, "
+        "resolving pronouns and references from the conversation. Keep product, module and field names "
+        "exactly as written. If it is already standalone, return it unchanged. "
+        "Output only the query.\n\n"
+        f"Conversation:\n{format_turns(turns)}\n"
+        f"Last question: {user_query}\n\n"
+        "Standalone query:"
+    )
+
+
+def build_judge_prompt(question, labels, answers, answers_from):
+    return (
+        f"You are an impartial expert evaluator. Your task is to select the best answer to the following question, based solely on accuracy, completeness, and clarity.\n\n"
+        f"Question: \"{question}\"\n\n"
+        f"Here are answers for {answers_from}:\n"
+        + "\n".join([f"{i+1}. {labels[i]}: {answers[i]}" for i in range(len(answers))]) +
+        "\n\nInstructions:\n"
+        "- Compare the answers for semantic accuracy, factual correctness, and how well they address the question.\n"
+        "- Select the answer that is most accurate, complete, and helpful.\n"
+        "- Do not provide any explanation or commentary—just output the best answer verbatim.\n\n"
+        "Best Answer:"
+    )
+
+
+app = Flask(__name__)
+CORS(app)
+
+
+@app.before_request
+def start_timing():
+    g.request_started = time.perf_counter()
+    start_request_timings()
+
+
+@app.after_request
+def record_request_duration(response):
+    started = g.get("request_started")
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe(
+            "http_request_duration_seconds", time.perf_counter() - started,
+            method=request.method, endpoint=endpoint, status=response.status_code,
+        )
+    return response
+
+
+@app.errorhandler(PoolTimeout)
+def handle_pool_timeout(e):
+    return jsonify({"error": str(e)}), 503
+
+
+@app.errorhandler(CircuitOpenError)
+def handle_circuit_open(e):
+    return jsonify({"error": str(e)}), 503
 
-    suggestions_text = call_chat_api(suggestion_prompt, model="azure/gpt-4.1-nano")
-    suggestions = [line.strip() for line in suggestions_text.strip().split("\n") if line.strip()][:5]
 
-    return jsonify({"suggestions": suggestions})
+@app.errorhandler(Overloaded)
+def handle_overloaded(e):
+    return jsonify({"error": str(e)}), 503, {"Retry-After": str(int(e.retry_after + 0.999))}
 
 
+@app.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    # Prometheus text exposition format; latency histograms are in seconds
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/api/pool-stats', methods=['GET'])
+def pool_stats():
+    return jsonify(pg_pool.stats())
+
+
+@app.route('/api/azure-stats', methods=['GET'])
+def azure_stats():
+    return jsonify({**azure.stats(), "rate_limits": rate_limiter.stats()})
+
+
+@app.route('/api/vector-index', methods=['GET', 'POST'])
+def vector_index():
+    """
+    GET: list the ANN (and full-text) indexes on langchain_pg_embedding.
+    POST: { "method": "hnsw" | "ivfflat" | "fts", "per_collection": false, "m": 16,
+            "ef_construction": 64, "lists": 100 } creates missing indexes,
+    optionally one partial index per collection in the catalog. "fts" is
+    the GIN index used by the lexical side of hybrid retrieval.
+    """
+    if request.method == 'POST':
+        data = request.json or {}
+        method = data.get('method', 'hnsw')
+        if method not in ANN_METHODS + ("fts",):
+            return jsonify({"error": "method must be hnsw, ivfflat or fts"}), 400
+        if method in ANN_METHODS and not EMBEDDING_DIM:
+            return jsonify({"error": f"A {method} index needs EMBEDDING_DIM; set it and restart"}), 400
+        collection_ids = None
+        if data.get('per_collection'):
+            collection_ids = list(catalog.snapshot().by_name.values())
+        params = {k: data[k] for k in ('m', 'ef_construction', 'lists') if k in data}
+        try:
+            with get_pg_connection() as conn:
+                created = ensure_indexes(conn, method, collection_ids, **params)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+    else:
+        created = []
+    with get_pg_connection() as conn:
+        cur = conn.cursor()
+        indexes = list_indexes(cur)
+        cur.close()
+    return jsonify({"created": created, "indexes": indexes})
+
+
+@app.route('/api/catalog-stats', methods=['GET'])
+def catalog_stats():
+    return jsonify(catalog.stats())
+
+
+@app.route('/api/embedding-backends', methods=['GET'])
+def embedding_backends():
+    return jsonify({"backends": EMBEDDING_BACKENDS, "local": local_embedder.stats()})
+
+
+@app.route('/api/history-stats', methods=['GET'])
+def history_stats():
+    return jsonify(history_manager.stats())
+
+
+@app.route('/api/answer-cache-stats', methods=['GET', 'DELETE'])
+def answer_cache_stats():
+    # DELETE empties the cache, e.g. after re-ingesting documentation
+    if request.method == 'DELETE':
+        answer_cache.clear()
+    return jsonify(answer_cache.stats())
+
+
+@app.route('/api/embedding-cache-stats', methods=['GET'])
+def embedding_cache_stats():
+    return jsonify(embedding_cache.stats())
+
+
+# Per-keystroke suggestion state: retrieval/suggestion reuse, stale-request tracking
+suggestion_engine = SuggestionEngine(ttl=float(os.environ.get("SUGGESTION_CACHE_TTL", 600)))
+
+
+def suggest_with_llm(key, suggestion_prompt):
+    # Concurrent requests for the same key share one LLM call
+    def ask_llm():
+        # Single attempt: a throttled nano deployment shouldn't hold up typing
+        suggestions_text = call_chat_api(suggestion_prompt, model="azure/gpt-4.1-nano", retries=1, optional=True)
+        return parse_suggestions(suggestions_text)
+
+    return suggestion_engine.coalesce(key, ask_llm)
+
+
+def suggestion_phases_flow(data):
+    """
+    Emits successively better results for one /api/suggestions request:
+    a cached answer (and stop), else local candidates, then the LLM result.
+    """
+    raw_query = data.get("query", "")
+    input_query = raw_query.strip()
+    context_chats = data.get("context", [])
+    product = data.get("product")
+    version = data.get("version")
+    history = data.get("history", [])  # List of {"role": "user"/"bot", "content": "..."}
+    session_id, seq = data.get("session_id"), data.get("seq")
+
+    cached, source = suggestion_engine.cached_suggestions(product, version, raw_query)
+    if cached is not None:
+        yield Emit({"suggestions": cached, "source": source})
+        return
+
+    # Optional: also search most relevant documents (reused while the query only grows a little)
+    top_context_docs = suggestion_engine.cached_retrieval(product, version, input_query)
+    if top_context_docs is None:
+        top_context_docs = yield from search_postgres_flow(
+            input_query, product, version, history, top_k=3,
+            max_tokens=SUGGESTION_CONTEXT_TOKENS, profile="fast", embedding_use="suggestions"
+        )
+        suggestion_engine.store_retrieval(product, version, input_query, top_context_docs)
+
+    local = suggestion_engine.local_candidates(product, version, input_query, top_context_docs)
+    yield Emit({"suggestions": local, "source": "local"})
+    if data.get("local_only"):
+        return
+    if suggestion_engine.is_stale(session_id, seq):
+        # A newer keystroke from this session is already being served
+        yield Emit({"suggestions": local, "source": "local", "stale": True})
+        return
+
+    key = (product, version, normalize_query(input_query), tuple(context_chats[-3:]))
+    suggestions = yield Call(
+        "suggest_with_llm", key, build_suggestion_prompt(input_query, context_chats, top_context_docs)
+    )
+    suggestion_engine.store_suggestions(product, version, input_query, suggestions)
+    yield Emit({"suggestions": suggestions or local, "source": "llm" if suggestions else "local"})
+
+
+@app.route("/api/suggestions", methods=['POST'])
+def get_suggestions():
+    """
+    Receives: {
+        "query": "what the user has typed so far",
+        "context": [...], "product": ..., "version": ..., "history": [...],
+        "session_id": "...", "seq": 12,   # optional: newer seq supersedes older in-flight requests
+        "local_only": false,              # optional: only cheap local candidates, no LLM
+        "stream": false                   # optional: NDJSON, local candidates first then the LLM result
+    }
+    Returns: { "suggestions": [...], "source": "cache" | "prefix_cache" | "local" | "llm", "stale"?: true }
+    """
+    data = request.json
+    if not data.get("query", "").strip():
+        return jsonify({"suggestions": []})
+    suggestion_engine.begin(data.get("session_id"), data.get("seq"))
+
+    if data.get("stream"):
+        return Response(
+            stream_with_context(json.dumps(phase) + "\n" for phase in iter_flow(suggestion_phases_flow(data))),
+            mimetype="application/x-ndjson",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    result = None
+    for result in iter_flow(suggestion_phases_flow(data)):
+        pass
+    return jsonify(result)
+
+
+@app.route('/api/suggestion-stats', methods=['GET'])
+def suggestion_stats():
+    return jsonify(suggestion_engine.stats())
+
 
 @app.route('/api/test-docs', methods=['GET'])
 def test_docs():
     query = 'How i can create a script for the following: Any one asset in non EUR currency =< 10%?'
     query_embedding = embed_text(query)
-    conn = get_pg_connection()
-    cur = conn.cursor()
-    # Use a parameter for the collection name pattern
-    collection_pattern = 'temenos_transact_r21%'
-    cur.execute("""
-        SELECT c.name, e.collection_id, e.document
-        FROM langchain_pg_embedding e
-        JOIN langchain_pg_collection c ON e.collection_id = c.uuid
-        WHERE c.name LIKE %s
-        ORDER BY e.embedding <=> %s::vector
-        LIMIT 10
-    """, (collection_pattern, query_embedding))
-    results = cur.fetchall()
-    cur.close()
-    conn.close()
-    docs = [{"document": row[2], "collection_name": row[0]} for row in results]
+    # Resolve the collection name prefix to ids from the catalog
+    collection_ids = catalog.collection_ids_with_prefix('temenos_transact_r21')
+    with get_pg_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT e.collection_id::text, e.document
+            FROM langchain_pg_embedding e
+            WHERE e.collection_id = ANY(%s::uuid[])
+            ORDER BY e.embedding <=> %s::vector
+            LIMIT 10
+        """, (collection_ids, query_embedding))
+        results = cur.fetchall()
+        cur.close()
+    docs = [{"document": row[1], "collection_name": catalog.collection_name(row[0])} for row in results]
     return jsonify(docs)
 
 
 @app.route('/api/products', methods=['GET'])
 def list_products():
-    conn = get_pg_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT name FROM langchain_pg_collection")
-    names = [row[0] for row in cur.fetchall()]
-    cur.close()
-    conn.close()
-    products = {}
-    for name in names:
-        product, version = extract_product_and_version(name)
-        if product:
-            products.setdefault(product, set()).add(version)
-    # Convert sets to sorted lists
-    products = {k: sorted(list(v)) for k, v in products.items()}
-    return jsonify(products)
+    # Served from the in-memory catalog; clients revalidate with If-None-Match
+    snap = catalog.snapshot()
+    response = jsonify(snap.products)
+    response.set_etag(snap.etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
 
 @app.route('/api/context', methods=['POST'])
 def get_context_for_product_version():
@@ -316,21 +1228,186 @@ def get_context_for_product_version():
     if not product or not version:
         return jsonify({"error": "Product and version required"}), 400
     collection_name = f"temenos_{product}_{version}"
-    conn = get_pg_connection()
-    cur = conn.cursor()
-    cur.execute("""
-        SELECT c.name, e.collection_id, e.document
-        FROM langchain_pg_embedding e
-        JOIN langchain_pg_collection c ON e.collection_id = c.uuid
-        WHERE c.name LIKE %s
-        LIMIT 10
-    """, (collection_name,))
-    results = cur.fetchall()
-    cur.close()
-    conn.close()
+    collection_id = catalog.collection_id(collection_name)
+    if collection_id is None:
+        return jsonify([])
+    with get_pg_connection() as conn:
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT %s, e.collection_id, e.document
+            FROM langchain_pg_embedding e
+            WHERE e.collection_id = %s::uuid
+            LIMIT 10
+        """, (collection_name, collection_id))
+        results = cur.fetchall()
+        cur.close()
     context_files = [{"document": row[0], "collection_name": row[1]} for row in results]
     return jsonify(context_files)
 
+def cached_answer_flow(cache_scope, user_query):
+    # Returns (query embedding, cache hit or None). Same text
+    # search_candidates_flow embeds, so its lookup hits the embedding cache
+    query_embedding = yield Call("embed_text", replace_abbreviations(user_query))
+    return query_embedding, answer_cache.lookup(cache_scope, query_embedding)
+
+
+def retrieval_flow(data, user_query, history, product, version):
+    # The follow-up rewritten into a standalone query, then searched
+    retrieval_query = yield from standalone_query_flow(user_query, history, data.get('query_rewrite'))
+    hits = yield from search_candidates_flow(
+        retrieval_query, product, version, data.get('top_k', 20), data.get('search_profile'),
+        data.get('retrieval_mode'), data.get('rerank')
+    )
+    return retrieval_query, hits
+
+
+def with_history_flow(flow, history):
+    """
+    Returns (flow's result, compacted (history, stats)). Older turns that
+    still need an LLM summary are summarized concurrently with `flow`;
+    otherwise the history is fitted inline, without taking a fan-out worker.
+    """
+    if history_manager.needs_summary(history):
+        return (yield Gather(flow, compact_history_flow(history)))
+    compacted = yield from compact_history_flow(history)
+    return (yield from flow), compacted
+
+
+def chat_context_flow(data, user_query, history, model, product, version):
+    """
+    Search context (semantic + filtered) and pack it into the token budget.
+    Returns (retrieval_query, context_blocks, context_stats, full_prompt).
+    """
+    (retrieval_query, hits), (history, history_stats) = yield from with_history_flow(
+        retrieval_flow(data, user_query, history, product, version), history
+    )
+    context_blocks, context_stats, full_prompt = pack_chat_prompt(
+        user_query, history, hits, product, version, model,
+        data.get('system_instructions'), data.get('max_context_tokens', CONTEXT_MAX_TOKENS)
+    )
+    context_stats["history"] = history_stats
+    return retrieval_query, context_blocks, context_stats, full_prompt
+
+
+def chat_stream_flow(data, user_query, history, model, product, version):
+    """
+    NDJSON events for a streamed /api/chat, one JSON object per line:
+      {"type": "context", "context_files": [...], "llm_prompt": "..."}
+      {"type": "delta", "content": "..."}            (repeated)
+      {"type": "done", "usage": {...}, "ttft_ms": ..., "latency_ms": ..., "cache": "..."}
+      {"type": "error", "error": "..."}              (instead of done, on failure)
+    An answer cache hit is sent as one delta, with "cache_match" on the done event.
+    """
+    started = time.time()
+    cache_scope = answer_cache_scope(data, history, model, product, version)
+    if cache_scope is not None:
+        query_embedding, cached = yield from cached_answer_flow(cache_scope, user_query)
+        if cached is not None:
+            payload, matched_query, similarity = cached
+            yield Emit(json.dumps({
+                "type": "context",
+                "context_files": payload["context_files"],
+                "context_stats": payload["context_stats"],
+                "llm_prompt": payload["llm_prompt"],
+                "retrieval_ms": 0.0,
+            }) + "\n")
+            yield Emit(json.dumps({"type": "delta", "content": payload["response"]}) + "\n")
+            yield Emit(json.dumps({
+                "type": "done",
+                "model": model,
+                "usage": None,
+                "ttft_ms": None,
+                "latency_ms": round((time.time() - started) * 1000, 1),
+                **cache_hit_fields(matched_query, similarity),
+            }) + "\n")
+            return
+
+    retrieval_query, context_blocks, context_stats, full_prompt = yield from chat_context_flow(
+        data, user_query, history, model, product, version
+    )
+    yield Emit(json.dumps({
+        "type": "context",
+        "context_files": context_blocks,
+        "context_stats": context_stats,
+        "llm_prompt": full_prompt,
+        "retrieval_query": retrieval_query,
+        "retrieval_ms": round((time.time() - started) * 1000, 1),
+    }) + "\n")
+
+    llm_started = time.time()
+    ttft_ms = None
+    usage = None
+    parts = []
+    try:
+        stream = yield Stream("stream_chat_api", full_prompt, model)
+        while True:
+            event = yield Next(stream)
+            if event is END:
+                break
+            kind, value = event
+            if kind == "delta":
+                if ttft_ms is None:
+                    ttft_ms = round((time.time() - llm_started) * 1000, 1)
+                parts.append(value)
+                yield Emit(json.dumps({"type": "delta", "content": value}) + "\n")
+            else:
+                usage = value
+    except Exception as e:
+        yield Emit(json.dumps({"type": "error", "error": f"[API Error] {str(e)}"}) + "\n")
+        return
+    finally:
+        metrics.observe("llm_call_duration_seconds", time.time() - llm_started, model=model)
+    record_usage(model, usage)
+
+    if cache_scope is not None and parts:
+        answer_cache.store(cache_scope, user_query, query_embedding, {
+            "response": "".join(parts),
+            "context_files": context_blocks,
+            "context_stats": context_stats,
+            "llm_prompt": full_prompt,
+        })
+    yield Emit(json.dumps({
+        "type": "done",
+        "model": model,
+        "usage": usage,
+        "ttft_ms": ttft_ms,
+        "latency_ms": round((time.time() - started) * 1000, 1),
+        "cache": "miss" if cache_scope is not None else "bypass",
+    }) + "\n")
+
+
+def chat_flow(data, user_query, history, model, product, version):
+    # The /api/chat response body when not streaming
+    cache_scope = answer_cache_scope(data, history, model, product, version)
+    if cache_scope is not None:
+        query_embedding, cached = yield from cached_answer_flow(cache_scope, user_query)
+        if cached is not None:
+            payload, matched_query, similarity = cached
+            result = {**payload, **cache_hit_fields(matched_query, similarity)}
+            if data.get('timings'):
+                result["timings"] = current_timings().to_dict()
+            return result
+
+    retrieval_query, context_blocks, context_stats, full_prompt = yield from chat_context_flow(
+        data, user_query, history, model, product, version
+    )
+    answer = yield Call("call_chat_api", full_prompt, model=model)
+
+    result = {
+        "response": answer,
+        "context_files": context_blocks,
+        "context_stats": context_stats,
+        "llm_prompt": full_prompt,
+        "retrieval_query": retrieval_query,
+    }
+    if cache_scope is not None and not answer.startswith("[API Error]"):
+        answer_cache.store(cache_scope, user_query, query_embedding, dict(result))
+    result["cache"] = "miss" if cache_scope is not None else "bypass"
+    if data.get('timings'):
+        result["timings"] = current_timings().to_dict()
+    return result
+
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     data = request.json
@@ -340,67 +1417,361 @@ def chat():
     product = data.get('product')
     version = data.get('version')
 
-    # Format conversation history
-    history_str = ""
-    for turn in history:
-        if turn["role"] == "user":
-            history_str += f"User: {turn['content']}\n"
-        else:
-            history_str += f"Bot: {turn['content']}\n"
+    # Past questions feed the local suggestion candidates
+    suggestion_engine.record_query(product, version, user_query)
 
-    # Search context (semantic + filtered)
-    context_blocks = search_postgres(user_query, product, version, history)
-    context_str = "\n\n".join(
-        f"Collection: {block['collection_name']}\nDocument:\n{block['document']}"
-        for block in context_blocks
+    if data.get('stream'):
+        return Response(
+            stream_with_context(iter_flow(chat_stream_flow(data, user_query, history, model, product, version))),
+            mimetype="application/x-ndjson",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    return jsonify(run_flow(chat_flow(data, user_query, history, model, product, version)))
+
+
+def fanout_retrieval_flow(data, user_query, history, product, versions, top_k):
+    """
+    The standalone query embedded once and searched in every version.
+    Returns (retrieval_query, {version: hits}).
+    """
+    retrieval_query = yield from standalone_query_flow(user_query, history, data.get('query_rewrite'))
+    hybrid, rerank = retrieval_options(data.get('retrieval_mode'), data.get('rerank'))
+    expanded_query = replace_abbreviations(retrieval_query)
+    query_embedding = yield Call("embed_text", expanded_query)
+    lexical_texts = (retrieval_query, expanded_query) if hybrid else None
+
+    def rerank_one(hits):
+        return (yield Call("rerank_hits", expanded_query, hits, rerank))
+
+    def search_one(version):
+        hits = yield Call(
+            "search_by_embedding", query_embedding, product, version, top_k, data.get('search_profile'),
+            lexical_texts
+        )
+        return (yield from rerank_one(hits))
+
+    if len(versions) > 1 and not hybrid:
+        # One statement for every version instead of one search (and connection) each
+        hits_by_version = yield Call(
+            "search_versions", query_embedding, product, versions, top_k, data.get('search_profile')
+        )
+        contexts = yield Gather(*(rerank_one(hits_by_version[v]) for v in versions))
+    else:
+        contexts = yield Gather(*(search_one(v) for v in versions))
+    return retrieval_query, dict(zip(versions, contexts))
+
+
+def fanout_answer_flow(prompt, model):
+    """
+    One model's answer in a fan-out as (answer, error): a deployment that is
+    at its rate limit or whose breaker is open fails its own result, not the
+    whole request.
+    """
+    try:
+        return (yield Call("call_chat_api", prompt, model=model)), None
+    except (Overloaded, CircuitOpenError) as e:
+        return None, str(e)
+
+
+def chat_fanout_flow(data):
+    # The /api/chat/fanout response body
+    user_query = data.get('prompt', '')
+    history = data.get('history', [])
+    product = data.get('product')
+    models = data.get('models') or [data.get('model', 'azure/gpt-4.1-mini')]
+    versions = data.get('versions') or (
+        compare_versions_for(data.get('version'), int(data['compare_previous']) + 1)
+        if data.get('compare_previous') else [data.get('version')]
     )
+    system_instructions = data.get('system_instructions')
+    top_k = data.get('top_k', 20)
+    max_context_tokens = data.get('max_context_tokens', CONTEXT_MAX_TOKENS)
+    started = time.time()
+
+    distinct_versions = list(dict.fromkeys(versions))
+    (retrieval_query, context_by_version), (history, history_stats) = yield from with_history_flow(
+        fanout_retrieval_flow(data, user_query, history, product, distinct_versions, top_k), history
+    )
+    shared_context, _ = split_shared_chunks(context_by_version)
+
+    def run_combined(model):
+        t0 = time.time()
+        shared_blocks, blocks_by_version, context_stats, full_prompt = pack_versions_prompt(
+            user_query, history, context_by_version, product, distinct_versions, model,
+            system_instructions, max_context_tokens
+        )
+        answer, error = yield from fanout_answer_flow(full_prompt, model)
+        answers = split_version_answers(answer, distinct_versions) if error is None else {}
+        latency_ms = round((time.time() - t0) * 1000, 1)
+        return [{
+            "model": model,
+            "version": version,
+            "response": answers.get(version),
+            "context_files": [b for b in shared_blocks if version in b["versions"]] + blocks_by_version[version],
+            "context_stats": context_stats,
+            "llm_prompt": full_prompt,
+            "latency_ms": latency_ms,
+            **({"error": error} if error is not None else {}),
+        } for version in distinct_versions]
+
+    def run_one(model, version):
+        t0 = time.time()
+        context_blocks, context_stats, full_prompt = pack_chat_prompt(
+            user_query, history, context_by_version[version], product, version, model,
+            system_instructions, max_context_tokens
+        )
+        answer, error = yield from fanout_answer_flow(full_prompt, model)
+        return {
+            "model": model,
+            "version": version,
+            "response": answer,
+            "context_files": context_blocks,
+            "context_stats": context_stats,
+            "llm_prompt": full_prompt,
+            "latency_ms": round((time.time() - t0) * 1000, 1),
+            **({"error": error} if error is not None else {}),
+        }
 
-    # System prompt
-    default_system_instructions = f"""You are a highly knowledgeable assistant for Temenos banking products.
+    if data.get('share_identical') and len(distinct_versions) > 1:
+        combined = yield Gather(*(run_combined(m) for m in models))
+        results = [r for per_model in combined for r in per_model]
+    else:
+        results = yield Gather(*(run_one(m, v) for v in versions for m in models))
 
-You will be given:
-- A conversation history between the user and assistant, which may contain follow-up questions, references, or pronouns.
-- Context blocks from official documentation. Each block contains section headers marked as h1:, h2:, etc., followed by the content from that section.
+    payload = {
+        "results": results,
+        "shared_context": shared_context,
+        "retrieval_query": retrieval_query,
+        "history_stats": history_stats,
+    }
+    answered = [r for r in results if "error" not in r]
+    if data.get('judge') and len(answered) > 1:
+        if len(versions) > 1 and len(models) == 1:
+            labels, answers_from = [r["version"] for r in answered], "different product versions"
+        else:
+            labels, answers_from = [f"{r['model']} ({r['version']})" for r in answered], "different AI models"
+        prompt = build_judge_prompt(user_query, labels, [r["response"] for r in answered], answers_from)
+        payload["best"], judge_error = yield from fanout_answer_flow(prompt, "azure/gpt-4.1-mini")
+        if judge_error is not None:
+            payload["judge_error"] = judge_error
+    payload["elapsed_ms"] = round((time.time() - started) * 1000, 1)
+    return payload
 
-Instructions:
-- Carefully read the h1:, h2:, and other header markers to understand the topic and subtopic of each context block.
-- Use the information under these headers to answer the user's question as accurately as possible.
-- If the answer requires information from multiple sections, synthesize a complete answer using all relevant blocks.
-- When possible, cite the h1:/h2: section titles in your answer to help the user understand where the information comes from.
-- Look for the following abbreviations in the context:
-    -"COB" for "Close of Business"
-    -"AA" for "Arrangement Architecture"
-    -"MM" for "Money Market"
-    -"FX" for "Foreign Exchange"
-    -"SW" for "SWAP"
-    -"LC" for "Letter of Credit"
-    -"MD" for "Miscellaneous Deals"
-- If there are typos in the query provided to you try to provide the correct word and ask them for clarification before answering.
-- If the context does not contain enough information, reply: "Not enough context provided."
-- Do not speculate or use external information.
-- Provide clear, structured answers, using examples, pseudocode, or markdown if applicable.
 
-Always base your answer on the provided context.
-You are currently helping with product: {product} and version: {version}.
-Mention the product and version in your answer."""
+@app.route('/api/chat/fanout', methods=['POST'])
+def chat_fanout():
+    """
+    Receives: {
+        "prompt": "user question",
+        "history": [...],
+        "product": "transact",
+        "models": [model1, model2, ...],      # optional, defaults to ["azure/gpt-4.1-mini"]
+        "versions": [version1, version2, ...], # optional, defaults to ["version"]
+        "version": "r24",
+        "compare_previous": 2,                 # optional, versions = version + 2 predecessors
+        "share_identical": true,               # optional, one LLM call per model for all versions
+        "system_instructions": "...",          # optional
+        "judge": true                          # optional, pick a best answer
+    }
+    Runs one chat per (model, version) pair. The query is embedded once, all
+    versions are searched in a single query and the LLM calls run concurrently.
+    With share_identical, chunks identical across versions go into one
+    combined prompt once instead of into every version's prompt.
+    A model whose deployment is unavailable gets an "error" on its results
+    (and response null) instead of failing the request.
+    Returns: { "results": [{model, version, response, context_files, context_stats, llm_prompt, latency_ms, error?}],
+               "shared_context": [{document, collection_name, similarity, versions}],
+               "retrieval_query": "...", "history_stats": {...}, "best": ... }
+    """
+    return jsonify(run_flow(chat_fanout_flow(request.json)))
 
-    # Override if user sent edited system_instructions
-    system_instructions = data.get('system_instructions', default_system_instructions)
- 
-    full_prompt = (
-        f"{system_instructions}\n\n"
-        f"--- CONVERSATION HISTORY ---\n{history_str}\n"
-        f"--- CONTEXT ---\n{context_str}\n\n"
-        f"--- QUESTION ---\n{user_query}"
+JUDGE_MODEL = "azure/gpt-4.1-mini"
+
+
+def compare_best(payload):
+    # Let the LLM choose the best of three models' answers
+    prompt = build_compare_prompt(payload.get('question', ''), payload.get('models', []), payload.get('answers', []))
+    return call_chat_api(prompt, model=JUDGE_MODEL)
+
+
+def judge_best(payload):
+    prompt = build_judge_prompt(
+        payload.get('question', ''), payload.get('labels', []), payload.get('answers', []),
+        payload.get('answers_from', "different product versions")
     )
+    return call_chat_api(prompt, model=JUDGE_MODEL)
 
-    answer = call_chat_api(full_prompt, model=model)
 
-    return jsonify({
-        "response": answer,
-        "context_files": context_blocks,
-        "llm_prompt": full_prompt
-    })
+def version_judge_payload(data):
+    # /api/compare-version's request as a judge job payload
+    return {
+        "question": data.get('question', ''),
+        "labels": data.get('versions', []),
+        "answers": data.get('answers', []),
+        "answers_from": "different product versions",
+    }
+
+
+SIMILARITY_THRESHOLD = 0.90
+
+
+def diff_error(versions, answers):
+    if not versions or not answers:
+        return "Missing 'versions' or 'answers' in request"
+    if len(versions) != len(answers):
+        return "Version and answer lengths mismatch"
+    return None
+
+
+def semantic_diff(versions, answers):
+    # Steps 1-2: Split each answer into chunks and flatten them for batch embedding
+    flattened_chunks, chunk_map = chunk_answers(answers)
+
+    # Step 3: Get embeddings for all chunks (batched and de-duplicated; DIFF_EMBEDDING_BACKEND)
+    embeddings = embed_texts(flattened_chunks, "diff")  # returns list of vectors
+
+    # Steps 4-5: Find chunks with no close match in any other version
+    return diff_highlights(versions, chunk_map, embeddings, SIMILARITY_THRESHOLD)
+
+
+def _llm_job(fn):
+    # A job whose LLM call failed is an error, so resubmitting it runs it again
+    def run(payload):
+        best = fn(payload)
+        if best.startswith("[API Error]"):
+            raise RuntimeError(best)
+        return {"best": best}
+    return run
+
+
+def _diff_job(payload):
+    versions, answers = payload.get('versions', []), payload.get('answers', [])
+    error = diff_error(versions, answers)
+    if error:
+        raise ValueError(error)
+    return {"highlights": semantic_diff(versions, answers)}
+
+
+# Comparison, judge and diff work off the web workers (POST /api/jobs, or "async": true)
+job_queue = JobQueue(
+    workers=int(os.environ.get("JOB_WORKERS", 8)),
+    limits=parse_limits(os.environ.get("JOB_CONCURRENCY", "")),
+    default_limit=int(os.environ.get("JOB_DEFAULT_CONCURRENCY", 4)),
+    ttl=float(os.environ.get("JOB_RESULT_TTL", 3600)),
+)
+job_queue.register("compare", _llm_job(compare_best), lambda payload: JUDGE_MODEL)
+job_queue.register("judge", _llm_job(judge_best), lambda payload: JUDGE_MODEL)
+job_queue.register("diff", _diff_job, lambda payload: f"embeddings:{EMBEDDING_BACKENDS['diff']}")
+JOB_MAX_WAIT = float(os.environ.get("JOB_MAX_WAIT", 30))
+
+
+def _ingest_job(payload):
+    chunks = []
+    for doc in payload["documents"]:
+        text = doc.get("content", "")
+        if doc.get("format") == "html":
+            text = html_to_markdown(text)
+        chunks.extend(chunk_document(text, doc.get("source", ""), payload.get("max_tokens", 800)))
+    with get_pg_connection() as conn:
+        stats = ingest_collection(
+            conn, payload["collection"], chunks, embed_documents,
+            prune=payload.get("prune", False),
+            prune_foreign=payload.get("prune_foreign", False),
+            index_method=payload.get("index", DEFAULT_INDEX_METHOD) or None,
+            fts=payload.get("fts", False),
+            embedding_dim=int(EMBEDDING_DIM) if EMBEDDING_DIM else None,
+        )
+    if stats["created_collection"]:
+        catalog.invalidate()
+    if stats["inserted"] or stats["deleted"]:
+        # Cached answers were built from the old chunks
+        answer_cache.clear()
+    return stats
+
+
+job_queue.register("ingest", _ingest_job, lambda payload: f"embeddings:{EMBEDDING_BACKENDS['query']}")
+
+
+def submit_job(kind, payload):
+    job, deduped = job_queue.submit(kind, payload)
+    return {**job.to_dict(), "deduped": deduped}
+
+
+@app.route('/api/ingest', methods=['POST'])
+def ingest_documents():
+    """
+    Receives: {
+        "product": "transact", "version": "r24",   # or "collection": "temenos_transact_r24"
+        "documents": [{"source": "aa/overview.md", "content": "...", "format": "markdown" | "html"}],
+        "max_tokens": 800,      # optional, per chunk
+        "prune": false,         # optional, delete chunks loaded here that are no longer in `documents`
+        "prune_foreign": false, # optional, with prune also delete rows from other loaders (no content_hash)
+        "index": "hnsw",        # optional, "ivfflat" or null for none; built after the load.
+                                # hnsw/ivfflat need EMBEDDING_DIM, default is hnsw when it is set
+        "fts": false            # optional, also build the full-text index
+    }
+    Chunks, embeds and bulk-loads as an "ingest" job (see ingest.py);
+    unchanged chunks are skipped. Returns 202 {job_id, ...}; poll GET /api/jobs/<job_id>.
+    With prune, `documents` must be the whole release, not just the changed files.
+    Rows from the LangChain loader are kept unless prune_foreign is set.
+    """
+    data = request.json or {}
+    collection = data.get('collection')
+    if not collection:
+        if not data.get('product') or not data.get('version'):
+            return jsonify({"error": "Give collection or product and version"}), 400
+        collection = f"temenos_{data['product'].lower()}_{data['version'].lower()}"
+    if not data.get('documents'):
+        return jsonify({"error": "No documents"}), 400
+    index = data.get('index', DEFAULT_INDEX_METHOD)
+    if index not in (None,) + ANN_METHODS:
+        return jsonify({"error": "index must be hnsw, ivfflat or null"}), 400
+    if index and not EMBEDDING_DIM:
+        return jsonify({"error": f"A {index} index needs EMBEDDING_DIM; set it or send index null"}), 400
+    payload = {
+        "collection": collection,
+        "documents": data['documents'],
+        "max_tokens": int(data.get('max_tokens', 800)),
+        "prune": data.get('prune', False),
+        "prune_foreign": data.get('prune_foreign', False),
+        "index": index,
+        "fts": data.get('fts', False),
+    }
+    return jsonify(submit_job("ingest", payload)), 202
+
+
+@app.route('/api/jobs', methods=['POST'])
+def create_job():
+    """
+    Receives: { "kind": "compare" | "judge" | "diff" | "ingest", "payload": {...} }
+      compare: {question, answers, models}            -> result {best}
+      judge:   {question, labels, answers, answers_from} -> result {best}
+      diff:    {versions, answers}                    -> result {highlights}
+      ingest:  see /api/ingest                        -> result {inserted, unchanged, deleted, ...}
+    Returns 202: {job_id, kind, status, deduped}; poll GET /api/jobs/<job_id>.
+    An identical submission returns the existing job.
+    """
+    data = request.json
+    kind = data.get('kind')
+    if kind not in job_queue.kinds():
+        return jsonify({"error": f"Unknown job kind {kind!r}", "kinds": job_queue.kinds()}), 400
+    return jsonify(submit_job(kind, data.get('payload') or {})), 202
+
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    # ?wait=N long-polls up to N seconds (capped at JOB_MAX_WAIT) for the job to finish
+    wait = min(float(request.args.get('wait', 0)), JOB_MAX_WAIT)
+    job = job_queue.wait(job_id, wait)
+    if job is None:
+        return jsonify({"error": "Unknown or expired job"}), 404
+    return jsonify(job.to_dict())
+
+
+@app.route('/api/job-stats', methods=['GET'])
+def job_stats():
+    return jsonify(job_queue.stats())
+
 
 @app.route('/api/compare', methods=['POST'])
 def compare_answers():
@@ -408,35 +1779,15 @@ def compare_answers():
     Receives: {
         "question": "original question",
         "answers": [answer1, answer2, answer3],
-        "models": [model1, model2, model3]
+        "models": [model1, model2, model3],
+        "async": false                       # optional: queue it, returns 202 {job_id, ...}
     }
     Returns: { "best": "the best answer as chosen by the LLM" }
     """
     data = request.json
-    question = data.get('question', '')
-    answers = data.get('answers', [])
-    models = data.get('models', [])
-
-    # Compose a prompt to let the LLM choose the best answer
-    prompt = (
-        f"You are an impartial expert evaluator. Your task is to select the best answer to the following question, based solely on accuracy, completeness, and clarity.\n\n"
-        f"Question: \"{question}\"\n\n"
-        f"Here are three answers from different AI models:\n"
-        f"1. {models[0]}: {answers[0]}\n"
-        f"2. {models[1]}: {answers[1]}\n"
-        f"3. {models[2]}: {answers[2]}\n\n"
-        "Instructions:\n"
-        "- Do not be influenced by the model names or writing style.\n"
-        "- Compare the answers for semantic accuracy, factual correctness, and how well they address the question.\n"
-        "- Select the answer that is most accurate, complete, and helpful.\n"
-        "- Do not favor answers that simply repeat the question or are overly verbose.\n"
-        "- Do not provide any explanation or commentary—just output the best answer verbatim.\n\n"
-        "Best Answer:"
-    )
-    
-    # Use Azure model for comparison
-    best = call_chat_api(prompt, model="azure/gpt-4.1-mini")
-    return jsonify({'best': best})
+    if data.get('async'):
+        return jsonify(submit_job("compare", {k: v for k, v in data.items() if k != 'async'})), 202
+    return jsonify({'best': compare_best(data)})
 
 
 
@@ -445,106 +1796,30 @@ def send_versions():
     data = request.json
     product = data.get('product', '')
     version1 = data.get('version1', '')
-    version2 = previous_version(version1)
-    version3 = previous_version(version2)
-    versions = [version1, version2, version3] 
-
-    # Here you would typically process the versions, e.g., save to a database or perform some action
-    print(f"Received version: {version1}")
-    print(f"Sent versions: {versions}")
-    # For now, just return them back
-    return jsonify({"received_versions": versions})
+    # The selected version and the two before it
+    return jsonify({"received_versions": compare_versions_for(version1, 3)})
 
 @app.route('/api/compare-version', methods=['POST'])
 def compare_version_answers():
     data = request.json
-    question = data.get('question', '')
-    answers = data.get('answers', [])
-    versions = data.get('versions', [])
-
-    prompt = (
-        f"You are an impartial expert evaluator. Your task is to select the best answer to the following question, based solely on accuracy, completeness, and clarity.\n\n"
-        f"Question: \"{question}\"\n\n"
-        f"Here are answers for different product versions:\n"
-        + "\n".join([f"{i+1}. {versions[i]}: {answers[i]}" for i in range(len(answers))]) +
-        "\n\nInstructions:\n"
-        "- Compare the answers for semantic accuracy, factual correctness, and how well they address the question.\n"
-        "- Select the answer that is most accurate, complete, and helpful.\n"
-        "- Do not provide any explanation or commentary—just output the best answer verbatim.\n\n"
-        "Best Answer:"
-    )
-    best = call_chat_api(prompt, model="azure/gpt-4.1-mini")
-    return jsonify({'best': best})
+    if data.get('async'):
+        return jsonify(submit_job("judge", version_judge_payload(data))), 202
+    return jsonify({'best': judge_best(version_judge_payload(data))})
 
 
 @app.route('/api/semantic-llm-diff', methods=['POST'])
 def semantic_llm_diff():
     data = request.json
-    SIMILARITY_THRESHOLD = 0.90
     versions = data.get('versions', [])
     answers = data.get('answers', [])
-    if not versions or not answers:
-        return jsonify({"error": "Missing 'versions' or 'answers' in request"}), 400
-    if len(versions) != len(answers):
-        return jsonify({"error": "Version and answer lengths mismatch"}), 400
+    error = diff_error(versions, answers)
+    if error:
+        return jsonify({"error": error}), 400
+    if data.get('async'):
+        return jsonify(submit_job("diff", {"versions": versions, "answers": answers})), 202
 
     try:
-        # Step 1: Split each answer into chunks
-        all_versions_chunks = [split_into_chunks(ans) for ans in answers]
-
-        # Step 2: Embed all chunks of all answers
-        # We flatten for batch embedding, keeping track of indices
-        flattened_chunks = []
-        chunk_map = []  # list of (version_idx, chunk_text)
-        for v_idx, chunks in enumerate(all_versions_chunks):
-            for chunk in chunks:
-                normalized_chunk = normalize_text(chunk)
-                flattened_chunks.append(normalized_chunk)
-                chunk_map.append((v_idx, chunk))  # keep original text
-
-        # Step 3: Get embeddings for all chunks at once
-        # (Assuming embed_text supports batching, else batch call or loop)
-        embeddings = azure_openai_embed(flattened_chunks)  # returns list of vectors
-
-        # Step 4: Organize embeddings per version
-        per_version_embeddings = [[] for _ in versions]
-        per_version_chunks = [[] for _ in versions]
-
-        for i, (v_idx, chunk_text) in enumerate(chunk_map):
-            per_version_embeddings[v_idx].append(embeddings[i])
-            per_version_chunks[v_idx].append(chunk_text)
-
-        # Step 5: Compare each chunk embedding to chunks in *other* versions to find uniqueness
-        highlights = []
-        for v_idx, (chunks, embds) in enumerate(zip(per_version_chunks, per_version_embeddings)):
-            unique_chunks = []
-            for i, (chunk, emb) in enumerate(zip(chunks, embds)):
-                # Compare this chunk embedding against all chunks in other versions
-                similarities = []
-                for other_v_idx, other_embds in enumerate(per_version_embeddings):
-                    if other_v_idx == v_idx:
-                        continue
-                    # Compute cosine similarities against this chunk and all chunks in other version
-                    sims = [cosine_similarity(emb, o_emb) for o_emb in other_embds]
-                    similarities.extend(sims)
-
-                # Determine if this chunk is unique 
-                # (no other chunk in other versions is too similar, i.e. max similarity < threshold)
-                max_sim = max(similarities) if similarities else 0.0
-                is_unique = max_sim < SIMILARITY_THRESHOLD
-                if is_unique:
-                    unique_chunks.append({
-                        "text": chunk,
-                        "is_unique": True,
-                    })
-
-            highlights.append({
-                "version": versions[v_idx],
-                "chunks": unique_chunks,
-            })
-
-        return jsonify({"highlights": highlights})
-
+        return jsonify({"highlights": semantic_diff(versions, answers)})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
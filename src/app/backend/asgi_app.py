@@ -0,0 +1,612 @@
+"""
+Async (ASGI) serving mode for the backend.
+
+    hypercorn asgi_app:application --bind 127.0.0.1:5000
+
+The chat, suggestion, comparison and catalog routes are served natively
+with one shared keep-alive httpx.AsyncClient and an asyncpg pool, so a
+single process can hold hundreds of in-flight LLM calls instead of tying
+up one worker thread per call. Every other route falls through to the
+Flask app in app.py, so the routes and JSON contracts are the same in
+both modes.
+
+The chat and suggestion logic itself is app.py's *_flow functions (see
+flows.py); this module only supplies the async I/O they call:
+call_chat_api, stream_chat_api, embed_text, search_by_embedding,
+search_versions, rerank_hits and suggest_with_llm.
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+from contextlib import asynccontextmanager
+
+import asyncpg
+import httpx
+import numpy as np
+from asgiref.wsgi import WsgiToAsgi
+from pgvector.asyncpg import register_vector
+from quart import Quart, Response, g, jsonify, request
+from quart_cors import cors
+
+import app as sync_app
+from app import (
+    AZURE_CHAT_TIMEOUT,
+    AZURE_EMBED_TIMEOUT,
+    AZURE_MODEL_ENDPOINTS,
+    EMBED_BATCH_MAX_INPUTS,
+    EMBED_BATCH_MAX_TOKENS,
+    EMBED_CONCURRENCY,
+    EMBED_MAX_INPUT_TOKENS,
+    EMBEDDING_BACKENDS,
+    HYBRID_CANDIDATES,
+    JUDGE_MODEL,
+    LOCAL_EMBEDDING_CACHE_KEY,
+    RERANK_TOP_N,
+    azure,
+    azure_headers,
+    build_compare_prompt,
+    build_judge_prompt,
+    catalog,
+    chat_fanout_flow,
+    chat_flow,
+    chat_stream_flow,
+    chunk_answers,
+    diff_error,
+    diff_highlights,
+    embeddings_url,
+    hits_to_context_files,
+    local_embedder,
+    lookup_cached_embeddings,
+    merge_fresh_embeddings,
+    parse_stream_line,
+    parse_suggestions,
+    reranker,
+    reserve_chat,
+    submit_job,
+    suggestion_engine,
+    suggestion_phases_flow,
+    version_judge_payload,
+)
+from azure_client import RETRYABLE_STATUS, CircuitOpenError, backoff_delay, retry_after_seconds
+from db_pool import PoolTimeout
+from flows import iter_async, run_async
+from embedding_pipeline import make_batches, truncate_to_tokens
+from hybrid_search import RRF_K, hybrid_sql, lexical_tsquery, to_asyncpg
+from vector_index import embedding_expr, profile_settings
+from version_retrieval import cross_version_sql
+from rate_limiter import Overloaded
+from metrics import (
+    metrics,
+    record_azure_attempt,
+    record_retry,
+    record_usage,
+    stage,
+    start_request_timings,
+)
+
+quart_app = cors(Quart(__name__))
+
+http = None
+pg = None
+
+
+@quart_app.before_serving
+async def startup():
+    global http, pg
+    max_conns = int(os.environ.get("ASYNC_HTTP_MAX_CONNECTIONS", 200))
+    http = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=max_conns, max_keepalive_connections=max_conns),
+        timeout=httpx.Timeout(30.0, connect=10.0),
+    )
+    pg = await asyncpg.create_pool(
+        host=os.environ.get("POSTGRES_HOST"),
+        port=os.environ.get("POSTGRES_PORT"),
+        database=os.environ.get("POSTGRES_DB"),
+        user=os.environ.get("POSTGRES_USER"),
+        password=os.environ.get("POSTGRES_PASSWORD"),
+        min_size=int(os.environ.get("ASYNC_PG_POOL_MIN_SIZE", 1)),
+        max_size=int(os.environ.get("ASYNC_PG_POOL_MAX_SIZE", 20)),
+        max_inactive_connection_lifetime=float(os.environ.get("PG_POOL_MAX_LIFETIME", 1800)),
+        init=register_vector,
+    )
+
+
+@quart_app.after_serving
+async def shutdown():
+    await http.aclose()
+    await pg.close()
+
+
+@quart_app.before_request
+async def start_timing():
+    g.request_started = time.perf_counter()
+    start_request_timings()
+
+
+@quart_app.after_request
+async def record_request_duration(response):
+    started = g.get("request_started")
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe(
+            "http_request_duration_seconds", time.perf_counter() - started,
+            method=request.method, endpoint=endpoint, status=response.status_code,
+        )
+    return response
+
+
+@quart_app.errorhandler(PoolTimeout)
+async def handle_pool_timeout(e):
+    return jsonify({"error": str(e)}), 503
+
+
+@quart_app.errorhandler(CircuitOpenError)
+async def handle_circuit_open(e):
+    return jsonify({"error": str(e)}), 503
+
+
+@quart_app.errorhandler(Overloaded)
+async def handle_overloaded(e):
+    return jsonify({"error": str(e)}), 503, {"Retry-After": str(int(e.retry_after + 0.999))}
+
+
+@asynccontextmanager
+async def _pg_acquire():
+    checkout_timeout = float(os.environ.get("PG_POOL_CHECKOUT_TIMEOUT", 5))
+    with stage("db_connect"):
+        try:
+            conn = await pg.acquire(timeout=checkout_timeout)
+        except asyncio.TimeoutError:
+            # Only checkout timeouts are a 503 "pool exhausted"; other timeouts stay what they are
+            raise PoolTimeout(
+                f"No Postgres connection available after {checkout_timeout}s (max_size={pg.get_max_size()})"
+            ) from None
+    try:
+        yield conn
+    finally:
+        await pg.release(conn)
+
+
+def _httpx_timeout(timeout):
+    connect, read = timeout
+    return httpx.Timeout(read, connect=connect)
+
+
+### ---- Async Azure / Postgres calls (mirror the sync versions in app.py) ---- ###
+def run_flow(flow):
+    # app's request flows with their Calls awaited on this module's functions
+    return run_async(flow, sys.modules[__name__])
+
+
+def iter_flow(flow):
+    return iter_async(flow, sys.modules[__name__])
+
+
+async def azure_post(url, deployment, json, timeout, retries=3, on_retry=None):
+    # Same retry policy and circuit breakers as AzureClient.post
+    breaker = azure.breaker(deployment)
+    for attempt in range(retries):
+        if attempt:
+            record_retry(deployment)
+            if on_retry:
+                on_retry()
+        breaker.before_call()
+        retry_after = None
+        started = time.perf_counter()
+        try:
+            resp = await http.post(url, headers=azure_headers(), json=json, timeout=_httpx_timeout(timeout))
+        except httpx.TransportError:
+            record_azure_attempt(deployment, time.perf_counter() - started, "error")
+            breaker.record_failure()
+            if attempt == retries - 1:
+                raise
+        except Exception:
+            record_azure_attempt(deployment, time.perf_counter() - started, "error")
+            breaker.record_failure()
+            raise
+        else:
+            record_azure_attempt(deployment, time.perf_counter() - started, resp.status_code)
+            if resp.status_code not in RETRYABLE_STATUS:
+                breaker.record_success()
+                resp.raise_for_status()
+                return resp
+            breaker.record_failure()
+            if attempt == retries - 1:
+                resp.raise_for_status()
+            retry_after = retry_after_seconds(resp.headers)
+        await asyncio.sleep(backoff_delay(attempt, retry_after))
+
+
+async def azure_openai_embed(texts):
+    deployment = os.environ["AZURE_OPENAI_EMBEDDING_DEPLOYMENT"]
+    keys, results, missing = lookup_cached_embeddings(texts, deployment)
+    if missing:
+        texts_to_send = [truncate_to_tokens(t, EMBED_MAX_INPUT_TOKENS) for t in missing.values()]
+        semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+
+        async def embed_batch(batch):
+            async with semaphore:
+                resp = await azure_post(
+                    embeddings_url(deployment), deployment,
+                    {"input": [texts_to_send[i] for i in batch]}, AZURE_EMBED_TIMEOUT
+                )
+            body = resp.json()
+            record_usage(deployment, body.get("usage"))
+            return [item["embedding"] for item in body["data"]]
+
+        batches = make_batches(texts_to_send, EMBED_BATCH_MAX_TOKENS, EMBED_BATCH_MAX_INPUTS)
+        fresh = [None] * len(texts_to_send)
+        for batch, vectors in zip(batches, await asyncio.gather(*(embed_batch(b) for b in batches))):
+            for i, vec in zip(batch, vectors):
+                fresh[i] = vec
+        results = merge_fresh_embeddings(keys, results, missing, fresh)
+    return results
+
+
+async def local_embed(texts):
+    # Same cache as app.local_embed; the model runs on the embedder's own threads
+    keys, results, missing = lookup_cached_embeddings(texts, LOCAL_EMBEDDING_CACHE_KEY)
+    if missing:
+        fresh = await asyncio.wrap_future(local_embedder.submit(missing.values()))
+        results = merge_fresh_embeddings(keys, results, missing, fresh)
+    return results
+
+
+async def embed_texts(texts, use="query"):
+    if EMBEDDING_BACKENDS.get(use) == "local":
+        return await local_embed(texts)
+    return await azure_openai_embed(texts)
+
+
+async def embed_text(text, use="query"):
+    with stage("embed"):
+        return (await embed_texts([text], use))[0]
+
+
+async def admit_chat(model, prompt, optional=False):
+    # Same admission as app.admit_chat, waiting on the event loop
+    ticket = reserve_chat(model, prompt, optional)
+    try:
+        if ticket.delay:
+            with stage("llm_queue"):
+                await asyncio.sleep(ticket.delay)
+    finally:
+        ticket.done_waiting()
+    return ticket
+
+
+async def call_chat_api(prompt, model, retries=3, optional=False):
+    if model not in AZURE_MODEL_ENDPOINTS:
+        return "contact backend error"
+    try:
+        ticket = await admit_chat(model, prompt, optional)
+    except Overloaded as e:
+        if optional:
+            return f"[API Error] {str(e)}"
+        raise
+    model = ticket.deployment
+    url = AZURE_MODEL_ENDPOINTS[model]
+    data = {"messages": [{"role": "user", "content": prompt}]}
+    started = time.perf_counter()
+    try:
+        with stage("llm_call"):
+            resp = await azure_post(url, model, data, AZURE_CHAT_TIMEOUT, retries=retries, on_retry=ticket.retry)
+        body = resp.json()
+        record_usage(model, body.get("usage"))
+        ticket.settle(body.get("usage"))
+        return body["choices"][0]["message"]["content"]
+    except CircuitOpenError as e:
+        if optional:
+            return f"[API Error] {str(e)}"
+        raise
+    except Exception as e:
+        return f"[API Error] {str(e)}"
+    finally:
+        metrics.observe("llm_call_duration_seconds", time.perf_counter() - started, model=model)
+
+
+async def stream_chat_api(prompt, model):
+    if model not in AZURE_MODEL_ENDPOINTS:
+        yield "delta", "contact backend error"
+        return
+    ticket = await admit_chat(model, prompt)
+    model = ticket.deployment
+    data = {
+        "messages": [{"role": "user", "content": prompt}],
+        "stream": True,
+        "stream_options": {"include_usage": True},
+    }
+    breaker = azure.breaker(model)
+    breaker.before_call()
+    request = http.build_request(
+        "POST", AZURE_MODEL_ENDPOINTS[model], headers=azure_headers(), json=data,
+        timeout=_httpx_timeout(AZURE_CHAT_TIMEOUT)
+    )
+    try:
+        resp = await http.send(request, stream=True)
+    except BaseException:
+        # No response headers (refused, timed out, cancelled): settle a half-open trial
+        breaker.record_failure()
+        raise
+    try:
+        if resp.status_code in RETRYABLE_STATUS:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        resp.raise_for_status()
+        async for line in resp.aiter_lines():
+            events = parse_stream_line(line)
+            if events is None:
+                break
+            for kind, value in events:
+                if kind == "usage":
+                    ticket.settle(value)
+                yield kind, value
+    finally:
+        await resp.aclose()
+
+
+async def catalog_snapshot():
+    # The catalog reloads over the sync pool; keep that off the event loop
+    if catalog.is_stale():
+        return await asyncio.to_thread(catalog.snapshot)
+    return catalog.snapshot()
+
+
+async def resolve_collection_id(name):
+    # catalog.collection_id, with the refresh on a miss done on a thread
+    await catalog_snapshot()
+    found = catalog.collection_id(name, refresh=False)
+    if found is None:
+        found = await asyncio.to_thread(catalog.collection_id, name)
+    return found
+
+
+async def ensure_collection_names(collection_ids):
+    # Load the catalog on a thread if any hit's collection is unknown, so
+    # hits_to_context_files(..., refresh=False) can name them all
+    await catalog_snapshot()
+    if any(catalog.collection_name(c, refresh=False) is None for c in collection_ids):
+        await asyncio.to_thread(catalog.refresh, catalog.miss_refresh_interval)
+
+
+async def _fetch_with_profile(conn, profile, top_k, sql, *args):
+    # SET LOCAL only lasts inside a transaction
+    with stage("vector_query"):
+        async with conn.transaction():
+            for name, value in profile_settings(profile, top_k).items():
+                await conn.execute(f"SET LOCAL {name} = {int(value)}")
+            return await conn.fetch(sql, *args)
+
+
+async def search_by_embedding(query_embedding, product=None, version=None, top_k=20, profile=None,
+                              lexical_texts=None):
+    vec = np.asarray(query_embedding, dtype=np.float32)
+    emb = embedding_expr()
+    collection_id = None
+    if product and version:
+        collection_id = await resolve_collection_id(f"temenos_{product}_{version}")
+        if collection_id is None:
+            return []
+    tsquery = lexical_tsquery(*lexical_texts) if lexical_texts else None
+    async with _pg_acquire() as conn:
+        if tsquery:
+            sql, args = to_asyncpg(hybrid_sql(emb, collection_id is not None), {
+                "embedding": vec,
+                "tsquery": tsquery,
+                "candidates": max(top_k, HYBRID_CANDIDATES),
+                "rrf_k": RRF_K,
+                "top_k": top_k,
+                "collection_id": collection_id,
+            })
+            rows = await _fetch_with_profile(conn, profile, max(top_k, HYBRID_CANDIDATES), sql, *args)
+        elif collection_id:
+            rows = await _fetch_with_profile(conn, profile, top_k, f"""
+                SELECT e.document, e.collection_id::text, {emb} <=> $1 AS distance
+                FROM langchain_pg_embedding e
+                WHERE e.collection_id = $2::uuid
+                ORDER BY {emb} <=> $1
+                LIMIT $3
+            """, vec, collection_id, top_k)
+        else:
+            rows = await _fetch_with_profile(conn, profile, top_k, f"""
+                SELECT e.document, e.collection_id::text, {emb} <=> $1 AS distance
+                FROM langchain_pg_embedding e
+                ORDER BY {emb} <=> $1
+                LIMIT $2
+            """, vec, top_k)
+    await ensure_collection_names({row[1] for row in rows})
+    return hits_to_context_files(rows, refresh=False)
+
+
+async def search_versions(query_embedding, product, versions, top_k=20, profile=None):
+    # Same as app.search_versions: every version's top-k in one statement
+    collection_ids = {}
+    for version in dict.fromkeys(versions):
+        collection_id = await resolve_collection_id(f"temenos_{product}_{version}") if product and version else None
+        if collection_id:
+            collection_ids[version] = collection_id
+    hits = {version: [] for version in versions}
+    if not collection_ids:
+        return hits
+    sql, args = to_asyncpg(cross_version_sql(embedding_expr(), list(collection_ids.values())), {
+        "embedding": np.asarray(query_embedding, dtype=np.float32),
+        "top_k": top_k,
+    })
+    async with _pg_acquire() as conn:
+        rows = await _fetch_with_profile(conn, profile, top_k, sql, *args)
+    await ensure_collection_names({row[2] for row in rows})
+    arm_versions = list(collection_ids)
+    for arm, doc, collection_id, distance in rows:
+        hits[arm_versions[arm]].extend(hits_to_context_files([(doc, collection_id, distance)], refresh=False))
+    return hits
+
+
+async def rerank_hits(query, hits, rerank):
+    # The cross-encoder is CPU-bound; keep it off the event loop
+    if not rerank or not hits:
+        return hits
+    with stage("rerank"):
+        return await asyncio.to_thread(reranker.rerank, query, hits, RERANK_TOP_N)
+
+
+### ---- Routes ---- ###
+suggestion_inflight = {}
+
+
+async def _ask_suggestions(suggestion_prompt):
+    suggestions_text = await call_chat_api(suggestion_prompt, model="azure/gpt-4.1-nano", retries=1, optional=True)
+    return parse_suggestions(suggestions_text)
+
+
+async def suggest_with_llm(key, suggestion_prompt):
+    # Same as app.suggest_with_llm, coalescing on asyncio tasks instead of threads
+    task = suggestion_inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_ask_suggestions(suggestion_prompt))
+        suggestion_inflight[key] = task
+        task.add_done_callback(lambda _: suggestion_inflight.pop(key, None))
+    else:
+        suggestion_engine.stats_counters["coalesced"] += 1
+    return await asyncio.shield(task)
+
+
+@quart_app.route("/api/suggestions", methods=['POST'])
+async def get_suggestions():
+    data = await request.get_json()
+    if not data.get("query", "").strip():
+        return jsonify({"suggestions": []})
+    suggestion_engine.begin(data.get("session_id"), data.get("seq"))
+
+    if data.get("stream"):
+        async def events():
+            async for phase in iter_flow(suggestion_phases_flow(data)):
+                yield json.dumps(phase) + "\n"
+        return Response(
+            events(), mimetype="application/x-ndjson",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    result = None
+    async for result in iter_flow(suggestion_phases_flow(data)):
+        pass
+    return jsonify(result)
+
+
+@quart_app.route('/api/products', methods=['GET'])
+async def list_products():
+    snap = await catalog_snapshot()
+    response = jsonify(snap.products)
+    response.set_etag(snap.etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return await response.make_conditional(request)
+
+
+@quart_app.route('/api/context', methods=['POST'])
+async def get_context_for_product_version():
+    data = await request.get_json()
+    product = data.get('product')
+    version = data.get('version')
+    if not product or not version:
+        return jsonify({"error": "Product and version required"}), 400
+    collection_name = f"temenos_{product}_{version}"
+    collection_id = await resolve_collection_id(collection_name)
+    if collection_id is None:
+        return jsonify([])
+    async with _pg_acquire() as conn:
+        rows = await conn.fetch("""
+            SELECT e.collection_id::text, e.document
+            FROM langchain_pg_embedding e
+            WHERE e.collection_id = $1::uuid
+            LIMIT 10
+        """, collection_id)
+    # Same (quirky) field mapping as the Flask route
+    return jsonify([{"document": collection_name, "collection_name": row[0]} for row in rows])
+
+
+@quart_app.route('/api/chat', methods=['POST'])
+async def chat():
+    data = await request.get_json()
+    user_query = data.get('prompt', '')
+    history = data.get('history', [])
+    model = data.get('model', 'azure/gpt-4.1-mini')
+    product = data.get('product')
+    version = data.get('version')
+
+    suggestion_engine.record_query(product, version, user_query)
+
+    if data.get('stream'):
+        return Response(
+            iter_flow(chat_stream_flow(data, user_query, history, model, product, version)),
+            mimetype="application/x-ndjson",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+    return jsonify(await run_flow(chat_flow(data, user_query, history, model, product, version)))
+
+
+@quart_app.route('/api/chat/fanout', methods=['POST'])
+async def chat_fanout():
+    return jsonify(await run_flow(chat_fanout_flow(await request.get_json())))
+
+
+@quart_app.route('/api/compare', methods=['POST'])
+async def compare_answers():
+    data = await request.get_json()
+    if data.get('async'):
+        # Queued on app.job_queue's threads; polled through the Flask /api/jobs routes
+        return jsonify(submit_job("compare", {k: v for k, v in data.items() if k != 'async'})), 202
+    prompt = build_compare_prompt(
+        data.get('question', ''), data.get('models', []), data.get('answers', [])
+    )
+    best = await call_chat_api(prompt, model=JUDGE_MODEL)
+    return jsonify({'best': best})
+
+
+@quart_app.route('/api/compare-version', methods=['POST'])
+async def compare_version_answers():
+    data = await request.get_json()
+    payload = version_judge_payload(data)
+    if data.get('async'):
+        return jsonify(submit_job("judge", payload)), 202
+    prompt = build_judge_prompt(
+        payload["question"], payload["labels"], payload["answers"], payload["answers_from"]
+    )
+    best = await call_chat_api(prompt, model=JUDGE_MODEL)
+    return jsonify({'best': best})
+
+
+@quart_app.route('/api/semantic-llm-diff', methods=['POST'])
+async def semantic_llm_diff():
+    data = await request.get_json()
+    SIMILARITY_THRESHOLD = 0.90
+    versions = data.get('versions', [])
+    answers = data.get('answers', [])
+    error = diff_error(versions, answers)
+    if error:
+        return jsonify({"error": error}), 400
+    if data.get('async'):
+        return jsonify(submit_job("diff", {"versions": versions, "answers": answers})), 202
+
+    try:
+        flattened_chunks, chunk_map = chunk_answers(answers)
+        embeddings = await embed_texts(flattened_chunks, "diff")
+        # The similarity matrices are CPU work; keep them off the event loop
+        highlights = await asyncio.to_thread(
+            diff_highlights, versions, chunk_map, embeddings, SIMILARITY_THRESHOLD
+        )
+        return jsonify({"highlights": highlights})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+### ---- ASGI entry point ---- ###
+ASYNC_ROUTES = {rule.rule for rule in quart_app.url_map.iter_rules()}
+flask_asgi = WsgiToAsgi(sync_app.app)
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan" or scope.get("path") in ASYNC_ROUTES:
+        await quart_app(scope, receive, send)
+    else:
+        await flask_asgi(scope, receive, send)
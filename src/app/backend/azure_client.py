@@ -0,0 +1,193 @@
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import record_azure_attempt, record_retry
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+def retry_after_seconds(headers):
+    """Server-requested wait from `retry-after-ms` or `Retry-After` (seconds or HTTP date), else None."""
+    if not headers:
+        return None
+    ms = headers.get("retry-after-ms")
+    if ms:
+        try:
+            return float(ms) / 1000
+        except ValueError:
+            pass
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def backoff_delay(attempt, retry_after=None, base=0.5, cap=20.0):
+    """
+    Full-jitter exponential backoff: uniform(0, base * 2**attempt), capped.
+    A server-provided Retry-After wins when it is longer.
+    """
+    delay = random.uniform(0, min(cap, base * (2 ** attempt)))
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, cap))
+    return delay
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive retryable failures and
+    rejects calls for `cooldown` seconds. After that one trial call is let
+    through (half-open); success closes the breaker, failure re-opens it.
+    """
+
+    def __init__(self, name, failure_threshold=5, cooldown=30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state(time.monotonic())
+
+    def _state(self, now):
+        if self._opened_at is None:
+            return "closed"
+        if now - self._opened_at >= self.cooldown:
+            return "half_open"
+        return "open"
+
+    def before_call(self):
+        with self._lock:
+            state = self._state(time.monotonic())
+            if state == "open" or (state == "half_open" and self._trial_in_flight):
+                raise CircuitOpenError(f"Circuit open for deployment {self.name}")
+            if state == "half_open":
+                self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            return {"state": self._state(time.monotonic()), "consecutive_failures": self._failures}
+
+
+class AzureClient:
+    """
+    Shared HTTP layer for Azure OpenAI calls: one pooled keep-alive
+    requests.Session per endpoint host, per-request timeouts, retries on
+    429/5xx with jittered backoff that honours Retry-After, and a circuit
+    breaker per deployment.
+    """
+
+    def __init__(self, pool_maxsize=32, failure_threshold=5, cooldown=30.0):
+        self.pool_maxsize = pool_maxsize
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._sessions = {}
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def session(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            sess = self._sessions.get(host)
+            if sess is None:
+                sess = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_maxsize)
+                sess.mount("https://", adapter)
+                sess.mount("http://", adapter)
+                self._sessions[host] = sess
+            return sess
+
+    def breaker(self, deployment):
+        with self._lock:
+            br = self._breakers.get(deployment)
+            if br is None:
+                br = CircuitBreaker(deployment, self.failure_threshold, self.cooldown)
+                self._breakers[deployment] = br
+            return br
+
+    def post(self, url, deployment, json, headers=None, timeout=30, retries=3, stream=False, on_retry=None):
+        """
+        POST with retries; returns the successful response or raises the last
+        error (requests.HTTPError / RequestException / CircuitOpenError).
+        `retries` is the total number of attempts; on_retry() is called
+        before each attempt after the first (e.g. to charge a rate limiter).
+        """
+        breaker = self.breaker(deployment)
+        sess = self.session(url)
+        for attempt in range(retries):
+            if attempt:
+                record_retry(deployment)
+                if on_retry:
+                    on_retry()
+            breaker.before_call()
+            retry_after = None
+            started = time.perf_counter()
+            try:
+                resp = sess.post(url, headers=headers, json=json, timeout=timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout):
+                record_azure_attempt(deployment, time.perf_counter() - started, "error")
+                breaker.record_failure()
+                if attempt == retries - 1:
+                    raise
+            except Exception:
+                # Not worth retrying, but it still has to settle a half-open trial
+                record_azure_attempt(deployment, time.perf_counter() - started, "error")
+                breaker.record_failure()
+                raise
+            else:
+                # For streams this is the time to response headers, not the whole body
+                record_azure_attempt(deployment, time.perf_counter() - started, resp.status_code)
+                if resp.status_code not in RETRYABLE_STATUS:
+                    # Non-retryable 4xx are the caller's problem, not the deployment's
+                    breaker.record_success()
+                    resp.raise_for_status()
+                    return resp
+                breaker.record_failure()
+                if attempt == retries - 1:
+                    resp.raise_for_status()
+                retry_after = retry_after_seconds(resp.headers)
+                resp.close()
+            time.sleep(backoff_delay(attempt, retry_after))
+
+    def stats(self):
+        with self._lock:
+            breakers = dict(self._breakers)
+            hosts = list(self._sessions)
+        return {
+            "hosts": hosts,
+            "breakers": {name: br.stats() for name, br in breakers.items()},
+        }
@@ -0,0 +1,78 @@
+"""
+Benchmark the /api/semantic-llm-diff uniqueness step: the old per-pair
+Python loop vs. the batched matrix engine in chunk_similarity.py.
+
+Usage:
+    python benchmarks/bench_chunk_similarity.py [--dim 1536] [--versions 3]
+
+For large sizes the legacy loop is timed on a sample of rows and
+extrapolated (marked with ~), since running it in full takes minutes.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chunk_similarity import max_similarity_to_other_versions  # noqa: E402
+
+SIZES = [10, 50, 100, 250, 500, 1000, 2000]
+LEGACY_MAX_ROWS = 50
+
+
+def cosine_similarity(a, b):
+    # Copy of the original per-pair function from app.py
+    a = np.array(a)
+    b = np.array(b)
+    denom = np.linalg.norm(a) * np.linalg.norm(b)
+    return float(np.dot(a, b) / denom) if denom else 0.0
+
+
+def legacy_max_sims(per_version_embeddings, rows=None):
+    results = []
+    for v_idx, embds in enumerate(per_version_embeddings):
+        maxes = []
+        for emb in embds[:rows]:
+            similarities = []
+            for other_v_idx, other_embds in enumerate(per_version_embeddings):
+                if other_v_idx == v_idx:
+                    continue
+                similarities.extend(cosine_similarity(emb, o) for o in other_embds)
+            maxes.append(max(similarities) if similarities else 0.0)
+        results.append(maxes)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--versions", type=int, default=3)
+    parser.add_argument("--sizes", type=int, nargs="*", default=SIZES,
+                        help="chunks per version")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{'chunks/version':>15} {'legacy (s)':>12} {'batched (s)':>12} {'speedup':>9} {'max |diff|':>11}")
+    for n in args.sizes:
+        per_version = [rng.standard_normal((n, args.dim)).tolist() for _ in range(args.versions)]
+
+        rows = n if n <= LEGACY_MAX_ROWS else LEGACY_MAX_ROWS
+        t0 = time.perf_counter()
+        legacy = legacy_max_sims(per_version, rows)
+        legacy_s = (time.perf_counter() - t0) * (n / rows)
+
+        t0 = time.perf_counter()
+        batched = max_similarity_to_other_versions(per_version)
+        batched_s = time.perf_counter() - t0
+
+        diff = max(
+            float(np.max(np.abs(np.asarray(l) - b[:rows]))) for l, b in zip(legacy, batched)
+        )
+        marker = "~" if rows < n else " "
+        print(f"{n:>15} {marker}{legacy_s:>11.3f} {batched_s:>12.4f} {legacy_s / batched_s:>8.0f}x {diff:>11.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+Recall-vs-latency benchmark for pgvector ANN indexes, on synthetic data.
+
+Needs a local Postgres with the pgvector extension; nothing is read from or
+written to the langchain tables. A scratch table is created, filled with
+clustered random vectors (so neighbours are meaningful), and queried
+exactly (sequential scan) to get ground truth. Then each index type is
+built and swept over its search knob:
+
+    HNSW     hnsw.ef_search in --ef-search
+    IVFFlat  ivfflat.probes in --probes
+
+Usage:
+    python benchmarks/bench_vector_index.py --dsn postgresql://postgres@localhost/bench \\
+        [--rows 50000] [--dim 256] [--queries 100] [--top-k 20]
+
+Use the output to tune the profiles in vector_index.SEARCH_PROFILES.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from io import StringIO
+
+import numpy as np
+import psycopg2
+from pgvector.psycopg2 import register_vector
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vector_index import SEARCH_PROFILES  # noqa: E402
+
+TABLE = "bench_ann_vectors"
+
+
+def synthetic_vectors(rng, rows, dim, clusters=200):
+    centers = rng.standard_normal((clusters, dim)).astype(np.float32)
+    labels = rng.integers(0, clusters, rows)
+    data = centers[labels] + 0.35 * rng.standard_normal((rows, dim)).astype(np.float32)
+    return data / np.linalg.norm(data, axis=1, keepdims=True)
+
+
+def load(cur, data):
+    dim = data.shape[1]
+    cur.execute(f"DROP TABLE IF EXISTS {TABLE}")
+    cur.execute(f"CREATE TABLE {TABLE} (id int PRIMARY KEY, embedding vector({dim}))")
+    rows = "\n".join(
+        f"{i}\t[{','.join(f'{x:.6f}' for x in vec)}]" for i, vec in enumerate(data)
+    )
+    cur.copy_expert(f"COPY {TABLE} (id, embedding) FROM STDIN", StringIO(rows))
+    cur.execute(f"ANALYZE {TABLE}")
+
+
+def run_queries(cur, queries, top_k):
+    ids, latencies = [], []
+    for q in queries:
+        t0 = time.perf_counter()
+        cur.execute(
+            f"SELECT id FROM {TABLE} ORDER BY embedding <=> %s LIMIT %s", (q, top_k)
+        )
+        ids.append([row[0] for row in cur.fetchall()])
+        latencies.append((time.perf_counter() - t0) * 1000)
+    return ids, latencies
+
+
+def recall(found, truth):
+    return statistics.mean(len(set(f) & set(t)) / len(t) for f, t in zip(found, truth))
+
+
+def report(label, found, truth, latencies):
+    lat = sorted(latencies)
+    p50 = lat[len(lat) // 2]
+    p95 = lat[min(len(lat) - 1, int(len(lat) * 0.95))]
+    print(f"{label:<28} recall={recall(found, truth):.3f}  p50={p50:7.2f} ms  p95={p95:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dsn", default=os.environ.get("BENCH_DSN", "postgresql://postgres@localhost/postgres"))
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--top-k", type=int, default=20)
+    parser.add_argument("--ef-search", type=int, nargs="*", default=[10, 20, 40, 64, 100, 200, 400])
+    parser.add_argument("--probes", type=int, nargs="*", default=[1, 2, 5, 10, 20, 40, 80])
+    parser.add_argument("--keep", action="store_true", help="keep the scratch table")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    data = synthetic_vectors(rng, args.rows, args.dim)
+    queries = synthetic_vectors(rng, args.queries, args.dim)
+
+    conn = psycopg2.connect(args.dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    register_vector(conn)
+
+    print(f"Loading {args.rows} x {args.dim} vectors ...")
+    load(cur, data)
+
+    cur.execute("SET enable_indexscan = off")
+    truth, latencies = run_queries(cur, queries, args.top_k)
+    report("exact (seq scan)", truth, truth, latencies)
+    cur.execute("RESET enable_indexscan")
+
+    t0 = time.perf_counter()
+    cur.execute(f"CREATE INDEX {TABLE}_hnsw ON {TABLE} USING hnsw (embedding vector_cosine_ops)")
+    print(f"HNSW build: {time.perf_counter() - t0:.1f} s")
+    for ef in args.ef_search:
+        cur.execute(f"SET hnsw.ef_search = {int(ef)}")
+        found, latencies = run_queries(cur, queries, args.top_k)
+        report(f"hnsw ef_search={ef}", found, truth, latencies)
+    cur.execute(f"DROP INDEX {TABLE}_hnsw")
+
+    lists = max(1, int(args.rows ** 0.5))
+    t0 = time.perf_counter()
+    cur.execute(f"CREATE INDEX {TABLE}_ivf ON {TABLE} USING ivfflat (embedding vector_cosine_ops) WITH (lists = {lists})")
+    print(f"IVFFlat build (lists={lists}): {time.perf_counter() - t0:.1f} s")
+    for probes in args.probes:
+        cur.execute(f"SET ivfflat.probes = {int(probes)}")
+        found, latencies = run_queries(cur, queries, args.top_k)
+        report(f"ivfflat probes={probes}", found, truth, latencies)
+
+    print("\nProfiles in vector_index.SEARCH_PROFILES:")
+    for name, settings in SEARCH_PROFILES.items():
+        print(f"  {name:<9} {settings}")
+
+    if not args.keep:
+        cur.execute(f"DROP TABLE {TABLE}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+"""
+Load test for the backend's hot endpoints against local stand-ins.
+
+Setup (three terminals):
+    python benchmarks/mock_azure.py --port 8099
+    python benchmarks/seed_pgvector.py --dsn postgresql://postgres@localhost/bench
+    AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8099/ AZURE_CHAT_ENDPOINT=http://127.0.0.1:8099/ \\
+        AZURE_OPENAI_EMBEDDING_DEPLOYMENT=bench-embed POSTGRES_DB=bench ... python app.py
+
+Then:
+    python benchmarks/load_test.py [--base-url http://127.0.0.1:5000] \\
+        [--scenarios chat suggestions diff] [--concurrency 1 4 16] [--requests 100] \\
+        [--save-baseline benchmarks/baseline.json | --compare benchmarks/baseline.json]
+
+Each scenario runs at each concurrency level and reports p50/p95/p99
+latency, throughput and errors. --save-baseline writes the results as
+JSON; --compare flags p95 or throughput regressions beyond --tolerance
+against a saved baseline and exits non-zero if any are found.
+"""
+import argparse
+import itertools
+import json
+import random
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+QUESTIONS = [
+    "How is COB job scheduling configured?",
+    "What happens to online services during close of business?",
+    "How do I amend product conditions on an arrangement?",
+    "Explain interest properties in Arrangement Architecture",
+    "How does rollover processing work for money market deposits?",
+    "Which accrual basis is used for MM deposits?",
+    "How are FX forward contracts revalued?",
+    "What validation is done on a SEPA payment order?",
+    "How do I issue an import letter of credit?",
+    "Where are payment cut-off times defined?",
+]
+
+
+def chat_request(rng, args):
+    return "/api/chat", {
+        "prompt": rng.choice(QUESTIONS),
+        "product": args.product,
+        "version": args.version,
+        "history": [],
+        "cache": args.answer_cache,
+    }
+
+
+_suggestion_seq = itertools.count(1)
+
+
+def suggestions_request(rng, args):
+    # Simulates typing: a prefix of a question, with the session/seq the UI sends
+    question = rng.choice(QUESTIONS)
+    return "/api/suggestions", {
+        "query": question[:rng.randint(4, len(question))],
+        "product": args.product,
+        "version": args.version,
+        "context": [],
+        "session_id": f"bench-{rng.randrange(16)}",
+        "seq": next(_suggestion_seq),
+    }
+
+
+def diff_request(rng, args):
+    versions = ["r22", "r23", "r24"]
+    answers = []
+    for v in versions:
+        sentences = rng.sample(QUESTIONS, 6)
+        answers.append(f"Release {v}. " + " ".join(s.rstrip("?") + "." for s in sentences))
+    return "/api/semantic-llm-diff", {"versions": versions, "answers": answers}
+
+
+SCENARIOS = {
+    "chat": chat_request,
+    "suggestions": suggestions_request,
+    "diff": diff_request,
+}
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p))]
+
+
+def run_level(base_url, scenario, concurrency, total, args):
+    make_request = SCENARIOS[scenario]
+    rng = random.Random(f"{scenario}-{concurrency}")
+    payloads = [make_request(rng, args) for _ in range(total)]
+    local = threading.local()
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def one(payload):
+        path, body = payload
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        t0 = time.perf_counter()
+        try:
+            resp = local.session.post(base_url + path, json=body, timeout=args.timeout)
+            ok = resp.status_code == 200
+            error = None if ok else str(resp.status_code)
+        except requests.RequestException as e:
+            ok, error = False, type(e).__name__
+        elapsed = (time.perf_counter() - t0) * 1000
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors.append(error)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, payloads))
+    wall = time.perf_counter() - started
+
+    lat = sorted(latencies)
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": len(errors),
+        "error_kinds": sorted(set(errors)),
+        "throughput_rps": round(len(lat) / wall, 2) if wall else 0.0,
+        "p50_ms": round(percentile(lat, 0.50), 1) if lat else None,
+        "p95_ms": round(percentile(lat, 0.95), 1) if lat else None,
+        "p99_ms": round(percentile(lat, 0.99), 1) if lat else None,
+        "mean_ms": round(statistics.mean(lat), 1) if lat else None,
+    }
+
+
+def report(result):
+    print(f"{result['scenario']:<12} c={result['concurrency']:<4} n={result['requests']:<5} "
+          f"err={result['errors']:<4} {result['throughput_rps']:8.2f} req/s  "
+          f"p50={result['p50_ms']}  p95={result['p95_ms']}  p99={result['p99_ms']} ms")
+
+
+def compare(results, baseline, tolerance):
+    """Returns a list of regression messages (p95 up or throughput down by more than tolerance)."""
+    previous = {f"{r['scenario']}@{r['concurrency']}": r for r in baseline["results"]}
+    regressions = []
+    for r in results:
+        key = f"{r['scenario']}@{r['concurrency']}"
+        old = previous.get(key)
+        if old is None:
+            continue
+        if old["p95_ms"] and r["p95_ms"] and r["p95_ms"] > old["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{key}: p95 {old['p95_ms']} -> {r['p95_ms']} ms")
+        if old["throughput_rps"] and r["throughput_rps"] < old["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{key}: throughput {old['throughput_rps']} -> {r['throughput_rps']} req/s")
+        if r["errors"] > old["errors"]:
+            regressions.append(f"{key}: errors {old['errors']} -> {r['errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--base-url", default="http://127.0.0.1:5000")
+    parser.add_argument("--scenarios", nargs="*", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=100, help="requests per scenario and level")
+    parser.add_argument("--product", default="benchcore")
+    parser.add_argument("--version", default="r23")
+    parser.add_argument("--answer-cache", action="store_true",
+                        help="let /api/chat use the semantic answer cache (off by default)")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--warmup", type=int, default=5, help="untimed requests per scenario first")
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument("--compare", metavar="PATH")
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    args = parser.parse_args()
+    base_url = args.base_url.rstrip("/")
+
+    results = []
+    for scenario in args.scenarios:
+        if args.warmup:
+            run_level(base_url, scenario, 1, args.warmup, args)
+        for concurrency in args.concurrency:
+            result = run_level(base_url, scenario, concurrency, args.requests, args)
+            report(result)
+            results.append(result)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "base_url": base_url,
+                "requests": args.requests,
+                "results": results,
+            }, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("\nRegressions:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+
+if __name__ == "__main__":
+    main()
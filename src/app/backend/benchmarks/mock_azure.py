@@ -0,0 +1,192 @@
+"""
+Local stand-in for the Azure OpenAI embeddings and chat completions APIs,
+for load tests that shouldn't touch (or pay for) the real deployments.
+
+    python benchmarks/mock_azure.py --port 8099 [--embed-latency-ms 40] \\
+        [--chat-latency-ms 800] [--jitter 0.3] [--rate-429 0.05]
+
+Point the backend at it with
+    AZURE_OPENAI_ENDPOINT=http://127.0.0.1:8099/ AZURE_CHAT_ENDPOINT=http://127.0.0.1:8099/
+
+Embeddings are deterministic bag-of-words hashes, so identical texts get
+identical vectors and texts sharing words are similar; seed_pgvector.py
+uses the same function, so retrieval over the seeded data behaves sensibly.
+Chat requests (plain or streamed) get a canned answer after the configured
+latency. With --rate-429 a fraction of requests is rejected with 429 and a
+retry-after-ms header, like a throttled deployment.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+DEFAULT_DIM = 1536
+
+
+@lru_cache(maxsize=50000)
+def _word_vector(word, dim):
+    rng = np.random.default_rng(zlib.crc32(word.encode("utf-8")))
+    return rng.standard_normal(dim).astype(np.float32)
+
+
+def fake_embedding(text, dim=DEFAULT_DIM):
+    words = re.findall(r'\w+', text.lower()) or [""]
+    vec = np.sum([_word_vector(w, dim) for w in words], axis=0)
+    return (vec / (np.linalg.norm(vec) or 1.0)).tolist()
+
+
+def _tokens(text):
+    return max(1, len(text) // 4)
+
+
+class MockConfig:
+    def __init__(self, embed_latency_ms=40, chat_latency_ms=800, jitter=0.3, rate_429=0.0,
+                 retry_after_ms=200, answer_words=120, stream_chunk_ms=15, dim=DEFAULT_DIM):
+        self.embed_latency_ms = embed_latency_ms
+        self.chat_latency_ms = chat_latency_ms
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after_ms = retry_after_ms
+        self.answer_words = answer_words
+        self.stream_chunk_ms = stream_chunk_ms
+        self.dim = dim
+        self.counts = {"embeddings": 0, "chat": 0, "throttled": 0}
+        self.lock = threading.Lock()
+
+    def delay(self, base_ms):
+        spread = base_ms * self.jitter
+        time.sleep(max(0.0, base_ms + random.uniform(-spread, spread)) / 1000)
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+
+def _answer(prompt, words):
+    question = prompt.rsplit("--- QUESTION ---", 1)[-1].strip()[:200]
+    filler = ("The configuration is maintained in the product parameter table and "
+              "applies from the next close of business run. ").split()
+    body = [filler[i % len(filler)] for i in range(words)]
+    return f"Regarding \"{question}\": " + " ".join(body)
+
+
+class MockAzureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    config = None  # set by make_server
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        # Counters, handy to check how much traffic a run produced
+        self._send_json(200, self.config.counts)
+
+    def do_POST(self):
+        cfg = self.config
+        length = int(self.headers.get("Content-Length", 0))
+        payload = json.loads(self.rfile.read(length) or b"{}")
+
+        if random.random() < cfg.rate_429:
+            cfg.count("throttled")
+            self._send_json(429, {"error": {"code": "429", "message": "Rate limit (mock)"}},
+                            {"retry-after-ms": str(cfg.retry_after_ms)})
+            return
+
+        if "/embeddings" in self.path:
+            cfg.count("embeddings")
+            cfg.delay(cfg.embed_latency_ms)
+            texts = payload.get("input", [])
+            if isinstance(texts, str):
+                texts = [texts]
+            self._send_json(200, {
+                "data": [{"index": i, "embedding": fake_embedding(t, cfg.dim)} for i, t in enumerate(texts)],
+                "usage": {"prompt_tokens": sum(_tokens(t) for t in texts)},
+            })
+        elif "/chat/completions" in self.path:
+            cfg.count("chat")
+            prompt = payload["messages"][-1]["content"]
+            answer = _answer(prompt, cfg.answer_words)
+            usage = {"prompt_tokens": _tokens(prompt), "completion_tokens": _tokens(answer)}
+            if payload.get("stream"):
+                self._stream(answer, usage)
+                return
+            cfg.delay(cfg.chat_latency_ms)
+            self._send_json(200, {
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": answer}}],
+                "usage": usage,
+            })
+        else:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+
+    def _stream(self, answer, usage):
+        # Time to first token is the configured chat latency; the rest trickles in
+        cfg = self.config
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        cfg.delay(cfg.chat_latency_ms)
+        words = answer.split(" ")
+        for i in range(0, len(words), 5):
+            chunk = {"choices": [{"index": 0, "delta": {"content": " ".join(words[i:i + 5]) + " "}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(cfg.stream_chunk_ms / 1000)
+        self.wfile.write(f"data: {json.dumps({'choices': [], 'usage': usage})}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def make_server(host="127.0.0.1", port=8099, **config):
+    handler = type("Handler", (MockAzureHandler,), {"config": MockConfig(**config)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--embed-latency-ms", type=float, default=40)
+    parser.add_argument("--chat-latency-ms", type=float, default=800)
+    parser.add_argument("--jitter", type=float, default=0.3, help="+/- fraction of the latency")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of requests throttled")
+    parser.add_argument("--retry-after-ms", type=int, default=200)
+    parser.add_argument("--answer-words", type=int, default=120)
+    parser.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    args = parser.parse_args()
+
+    server = make_server(
+        args.host, args.port,
+        embed_latency_ms=args.embed_latency_ms, chat_latency_ms=args.chat_latency_ms,
+        jitter=args.jitter, rate_429=args.rate_429, retry_after_ms=args.retry_after_ms,
+        answer_words=args.answer_words, dim=args.dim,
+    )
+    print(f"Mock Azure OpenAI on http://{args.host}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Seed a local pgvector database with synthetic langchain collections for
+load tests (benchmarks/load_test.py).
+
+Creates langchain_pg_collection / langchain_pg_embedding if they don't
+exist, then (re)creates collections named temenos_bench<product>_<version>
+filled with h1:/h2: sectioned documents. Only collections with the
+temenos_bench prefix are dropped, so it is safe on a dev database that
+also holds real collections.
+
+    python benchmarks/seed_pgvector.py --dsn postgresql://postgres@localhost/bench \\
+        [--products core loans] [--versions r22 r23 r24] [--docs 2000] [--dim 1536] [--index hnsw]
+
+Vectors come from mock_azure.fake_embedding, so the mock server's query
+embeddings land near the documents that share their words. Run the backend
+with EMBEDDING_DIM set to --dim when using --index.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import uuid
+from io import StringIO
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mock_azure import DEFAULT_DIM, fake_embedding  # noqa: E402
+
+PREFIX = "temenos_bench"
+
+TOPICS = {
+    "Close of Business": ["COB job scheduling", "Batch stages", "Online services during COB"],
+    "Arrangement Architecture": ["Product conditions", "Arrangement activities", "Interest properties"],
+    "Money Market": ["Deposit placement", "Rollover processing", "Accrual basis"],
+    "Foreign Exchange": ["Spot deals", "Forward contracts", "Revaluation"],
+    "Letter of Credit": ["Import LC issuance", "Amendments", "Document presentation"],
+    "Payments": ["SEPA credit transfer", "Payment order validation", "Cut-off times"],
+}
+SENTENCES = [
+    "The {sub} settings are defined in the parameter table for the company.",
+    "Users with the correct SMS permissions can amend {sub} records online.",
+    "{sub} is validated during input and again at authorisation.",
+    "Changes to {sub} take effect from the next {h1} cycle.",
+    "Reports for {sub} are available from the enquiry menu.",
+    "When {sub} fails, the error is logged and the record is put on hold.",
+]
+
+
+def make_document(rng, version):
+    h1 = rng.choice(list(TOPICS))
+    sub = rng.choice(TOPICS[h1])
+    sentences = [rng.choice(SENTENCES).format(sub=sub, h1=h1) for _ in range(rng.randint(3, 8))]
+    return f"h1: {h1}\nh2: {sub}\n" + " ".join(sentences) + f" (Release {version.upper()}.)"
+
+
+def ensure_tables(cur):
+    cur.execute("CREATE EXTENSION IF NOT EXISTS vector")
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS langchain_pg_collection (
+            uuid uuid PRIMARY KEY,
+            name varchar NOT NULL UNIQUE,
+            cmetadata json
+        )
+    """)
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS langchain_pg_embedding (
+            id varchar PRIMARY KEY,
+            collection_id uuid REFERENCES langchain_pg_collection (uuid) ON DELETE CASCADE,
+            embedding vector,
+            document varchar,
+            cmetadata jsonb
+        )
+    """)
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS ix_langchain_pg_embedding_collection_id "
+        "ON langchain_pg_embedding (collection_id)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dsn", default=os.environ.get("BENCH_DSN", "postgresql://postgres@localhost/postgres"))
+    parser.add_argument("--products", nargs="*", default=["core", "loans"])
+    parser.add_argument("--versions", nargs="*", default=["r22", "r23", "r24"])
+    parser.add_argument("--docs", type=int, default=2000, help="documents per collection")
+    parser.add_argument("--dim", type=int, default=DEFAULT_DIM)
+    parser.add_argument("--index", choices=["hnsw", "ivfflat"], help="build partial ANN indexes after loading")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    conn = psycopg2.connect(args.dsn)
+    cur = conn.cursor()
+    ensure_tables(cur)
+    cur.execute("DELETE FROM langchain_pg_embedding WHERE collection_id IN "
+                "(SELECT uuid FROM langchain_pg_collection WHERE name LIKE %s)", (PREFIX + "%",))
+    cur.execute("DELETE FROM langchain_pg_collection WHERE name LIKE %s", (PREFIX + "%",))
+
+    collection_ids = []
+    for product in args.products:
+        for version in args.versions:
+            name = f"{PREFIX}{product}_{version}"
+            collection_id = str(uuid.UUID(int=rng.getrandbits(128)))
+            collection_ids.append(collection_id)
+            cur.execute(
+                "INSERT INTO langchain_pg_collection (uuid, name, cmetadata) VALUES (%s, %s, %s)",
+                (collection_id, name, json.dumps({"bench": True})),
+            )
+            rows = StringIO()
+            for i in range(args.docs):
+                doc = make_document(rng, version)
+                vec = ",".join(f"{x:.6f}" for x in fake_embedding(doc, args.dim))
+                escaped = doc.replace("\\", "\\\\").replace("\n", "\\n").replace("\t", "\\t")
+                rows.write(f"{collection_id}-{i}\t{collection_id}\t[{vec}]\t{escaped}\t{{}}\n")
+            rows.seek(0)
+            cur.copy_expert(
+                "COPY langchain_pg_embedding (id, collection_id, embedding, document, cmetadata) FROM STDIN",
+                rows,
+            )
+            print(f"{name}: {args.docs} documents")
+    cur.execute("ANALYZE langchain_pg_embedding")
+    conn.commit()
+
+    if args.index:
+        os.environ.setdefault("EMBEDDING_DIM", str(args.dim))
+        from vector_index import ensure_indexes
+        created = ensure_indexes(conn, args.index, collection_ids)
+        print(f"Indexes created: {', '.join(created) or 'none'}")
+    conn.close()
+    print(f"Run the backend with EMBEDDING_DIM={args.dim} and query product/version "
+          f"e.g. bench{args.products[0]}/{args.versions[0]}.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+import hashlib
+import json
+import select
+import threading
+import time
+
+NOTIFY_TRIGGER_SQL = """
+CREATE OR REPLACE FUNCTION notify_langchain_collection_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('{channel}', TG_OP);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS langchain_collection_change ON langchain_pg_collection;
+CREATE TRIGGER langchain_collection_change
+AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON langchain_pg_collection
+FOR EACH STATEMENT EXECUTE FUNCTION notify_langchain_collection_change();
+"""
+
+
+def install_notify_trigger(conn, channel):
+    # So LISTEN-based refresh sees collection changes; idempotent
+    cur = conn.cursor()
+    cur.execute(NOTIFY_TRIGGER_SQL.format(channel=channel))
+    conn.commit()
+    cur.close()
+
+
+class CatalogSnapshot:
+    def __init__(self, rows, parse_name):
+        """rows: (collection name, collection uuid as text) pairs."""
+        self.by_name = {}
+        self.names_by_id = {}
+        self.collections = {}  # product -> version -> [uuid, ...]
+        for name, uuid in rows:
+            self.by_name[name] = uuid
+            self.names_by_id[uuid] = name
+            product, version = parse_name(name)
+            if product:
+                self.collections.setdefault(product, {}).setdefault(version, []).append(uuid)
+        self.products = {p: sorted(vs) for p, vs in sorted(self.collections.items())}
+        body = json.dumps(self.products, sort_keys=True).encode("utf-8")
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.loaded_at = time.monotonic()
+
+
+class CollectionCatalog:
+    """
+    In-process cache of langchain_pg_collection: product -> version ->
+    collection UUIDs, plus name <-> UUID lookups.
+
+    Reloaded when older than `ttl` seconds, or sooner after invalidate()
+    (called by the LISTEN/NOTIFY listener). A lookup miss forces a reload
+    at most once every `miss_refresh_interval` seconds so new collections
+    show up without hammering the database for names that don't exist.
+    Lookups with refresh=False never load: callers that mustn't block (the
+    event loop in asgi_app) do the reload on a thread themselves.
+    """
+
+    def __init__(self, load_rows, parse_name, ttl=300, miss_refresh_interval=5):
+        self._load_rows = load_rows
+        self._parse_name = parse_name
+        self.ttl = ttl
+        self.miss_refresh_interval = miss_refresh_interval
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self.refreshes = 0
+
+    def is_stale(self):
+        snap = self._snapshot
+        return snap is None or time.monotonic() - snap.loaded_at > self.ttl
+
+    def refresh(self, max_age=0):
+        """Reload unless another thread already did within the last `max_age` seconds."""
+        with self._lock:
+            snap = self._snapshot
+            if snap is not None and time.monotonic() - snap.loaded_at < max_age:
+                return snap
+            snap = CatalogSnapshot(self._load_rows(), self._parse_name)
+            self._snapshot = snap
+            self.refreshes += 1
+            return snap
+
+    def invalidate(self):
+        self._snapshot = None
+
+    def snapshot(self):
+        snap = self._snapshot
+        if snap is None or time.monotonic() - snap.loaded_at > self.ttl:
+            return self.refresh(max_age=self.ttl)
+        return snap
+
+    def _resolve(self, lookup, refresh=True):
+        snap = self.snapshot() if refresh else self._snapshot
+        found = lookup(snap) if snap is not None else None
+        if found is None and refresh:
+            found = lookup(self.refresh(max_age=self.miss_refresh_interval))
+        return found
+
+    def collection_id(self, name, refresh=True):
+        return self._resolve(lambda snap: snap.by_name.get(name), refresh)
+
+    def collection_name(self, uuid, refresh=True):
+        return self._resolve(lambda snap: snap.names_by_id.get(uuid), refresh)
+
+    def collection_ids_with_prefix(self, prefix):
+        snap = self.snapshot()
+        return [uuid for name, uuid in snap.by_name.items() if name.startswith(prefix)]
+
+    def stats(self):
+        snap = self._snapshot
+        return {
+            "collections": len(snap.by_name) if snap else 0,
+            "products": len(snap.products) if snap else 0,
+            "age_s": round(time.monotonic() - snap.loaded_at, 1) if snap else None,
+            "ttl_s": self.ttl,
+            "refreshes": self.refreshes,
+        }
+
+
+def start_notify_listener(catalog, connect, channel, reconnect_delay=5, install_trigger=True):
+    """
+    Background thread that LISTENs on `channel` with its own connection and
+    invalidates the catalog on every notification. With install_trigger, the
+    NOTIFY trigger on langchain_pg_collection is (re)installed on the first
+    connection; if that fails (e.g. no privilege), it is logged and the
+    trigger must be created by hand from NOTIFY_TRIGGER_SQL, otherwise
+    nothing is ever notified and the catalog only refreshes on its TTL.
+    """
+    def run():
+        installed = not install_trigger
+        while True:
+            conn = None
+            try:
+                conn = connect()
+                conn.autocommit = True
+                if not installed:
+                    installed = True
+                    try:
+                        install_notify_trigger(conn, channel)
+                    except Exception as e:
+                        print(f"Catalog notify trigger not installed, create it by hand (NOTIFY_TRIGGER_SQL): {e}")
+                cur = conn.cursor()
+                cur.execute(f'LISTEN "{channel}"')
+                # Anything may have changed while we weren't listening
+                catalog.invalidate()
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        catalog.invalidate()
+            except Exception as e:
+                print(f"Catalog listener error: {e}")
+                time.sleep(reconnect_delay)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+    thread = threading.Thread(target=run, name="catalog-listener", daemon=True)
+    thread.start()
+    return thread
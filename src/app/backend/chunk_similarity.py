@@ -0,0 +1,52 @@
+import numpy as np
+
+
+def normalize_rows(embeddings):
+    """
+    Stack a list of vectors into one float32 matrix with unit-length rows.
+    Zero vectors stay zero, so they score 0.0 against everything (same as
+    cosine_similarity in app.py).
+    """
+    if len(embeddings) == 0:
+        return np.zeros((0, 0), dtype=np.float32)
+    m = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(m, axis=1, keepdims=True)
+    np.divide(m, norms, out=m, where=norms > 0)
+    return m
+
+
+def max_similarity(a, b, block_size=1024):
+    """
+    For each row of `a`, the highest cosine similarity to any row of `b`.
+    Both must already be row-normalized. Work is tiled into
+    block_size x block_size products to bound peak memory.
+    """
+    out = np.full(a.shape[0], -np.inf, dtype=np.float32)
+    if a.shape[0] == 0 or b.shape[0] == 0:
+        return out
+    for i in range(0, a.shape[0], block_size):
+        a_blk = a[i:i + block_size]
+        best = out[i:i + block_size]
+        for j in range(0, b.shape[0], block_size):
+            sims = a_blk @ b[j:j + block_size].T
+            np.maximum(best, sims.max(axis=1), out=best)
+    return out
+
+
+def max_similarity_to_other_versions(per_version_embeddings, block_size=1024):
+    """
+    per_version_embeddings: one list of vectors per version.
+    Returns one float32 array per version holding, for each chunk, the max
+    similarity to any chunk of any *other* version (0.0 if there are none).
+    """
+    matrices = [normalize_rows(embs) for embs in per_version_embeddings]
+    results = []
+    for v_idx, m in enumerate(matrices):
+        best = np.full(m.shape[0], -np.inf, dtype=np.float32)
+        for o_idx, other in enumerate(matrices):
+            if o_idx == v_idx:
+                continue
+            np.maximum(best, max_similarity(m, other, block_size), out=best)
+        best[np.isneginf(best)] = 0.0
+        results.append(best)
+    return results
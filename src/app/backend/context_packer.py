@@ -0,0 +1,75 @@
+import re
+
+from embedding_pipeline import estimate_tokens
+
+# Context windows (tokens) of the deployments in AZURE_MODEL_ENDPOINTS
+MODEL_CONTEXT_WINDOWS = {
+    "azure/gpt-4.1-mini": 1047576,
+    "azure/gpt-4o-mini": 128000,
+    "azure/gpt-4.1-nano": 1047576,
+}
+DEFAULT_CONTEXT_WINDOW = 128000
+# Room left for the model's answer
+COMPLETION_RESERVE_TOKENS = 4096
+# "Collection: ...\nDocument:\n" header plus separators around each block
+BLOCK_OVERHEAD_TOKENS = 8
+
+
+def block_tokens(block):
+    return estimate_tokens(block["document"]) + estimate_tokens(block["collection_name"]) + BLOCK_OVERHEAD_TOKENS
+
+
+def context_budget(model, prompt_overhead_tokens, max_tokens):
+    """Tokens available for context: the requested budget, capped so the whole prompt fits the model window."""
+    window = MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+    return max(0, min(max_tokens, window - COMPLETION_RESERVE_TOKENS - prompt_overhead_tokens))
+
+
+def _shingles(text, n=3):
+    words = re.findall(r'\w+', text.lower())
+    if len(words) < n:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + n]) for i in range(len(words) - n + 1)}
+
+
+def _jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def pack_context(blocks, max_tokens, duplicate_threshold=0.9):
+    """
+    Choose which retrieved blocks go into the prompt.
+
+    Blocks are taken in descending rank_score (set by hybrid retrieval or the
+    re-ranker) or, failing that, similarity. A block is dropped if it is a
+    near-duplicate (word-trigram Jaccard >= duplicate_threshold) of one
+    already packed, or if it doesn't fit in what is left of max_tokens.
+    Returns (packed_blocks, stats).
+    """
+    packed, kept_shingles = [], []
+    used = dropped_tokens = duplicates = over_budget = 0
+    for block in sorted(blocks, key=lambda b: b.get("rank_score", b.get("similarity", 0)), reverse=True):
+        tokens = block_tokens(block)
+        shingles = _shingles(block["document"])
+        if any(_jaccard(shingles, s) >= duplicate_threshold for s in kept_shingles):
+            duplicates += 1
+            dropped_tokens += tokens
+            continue
+        if used + tokens > max_tokens:
+            over_budget += 1
+            dropped_tokens += tokens
+            continue
+        packed.append(block)
+        kept_shingles.append(shingles)
+        used += tokens
+    stats = {
+        "budget_tokens": max_tokens,
+        "packed_tokens": used,
+        "packed_blocks": len(packed),
+        "dropped_tokens": dropped_tokens,
+        "dropped_duplicates": duplicates,
+        "dropped_over_budget": over_budget,
+    }
+    return packed, stats
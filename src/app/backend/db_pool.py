@@ -0,0 +1,179 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class PgConnectionPool:
+    """
+    Bounded, thread-safe pool of Postgres connections.
+
+    - At most `max_size` connections are open at once; callers wait up to
+      `checkout_timeout` seconds for one to free up, then get PoolTimeout.
+    - Connections older than `max_lifetime` seconds are closed and replaced.
+    - Connections idle for longer than `health_check_after` seconds are
+      pinged with `SELECT 1` before being handed out.
+    - `checkout_timer()`, if given, returns a context manager wrapped around
+      each checkout in connection(), e.g. to time it as a request stage.
+    """
+
+    def __init__(self, connect, max_size=10, max_lifetime=1800,
+                 health_check_after=30, checkout_timeout=5.0, checkout_timer=None):
+        self._connect = connect
+        self._checkout_timer = checkout_timer or nullcontext
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+        self.checkout_timeout = checkout_timeout
+
+        self._idle = deque()  # (conn, created_at, last_used)
+        self._created = {}  # id(conn) -> created_at for checked-out connections
+        self._open = 0
+        self._cond = threading.Condition()
+
+        self._in_use = 0
+        self._checkouts = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+        self._recycled = 0
+        self._failed_health_checks = 0
+
+    def _expired(self, created_at, now):
+        return self.max_lifetime and now - created_at > self.max_lifetime
+
+    def _healthy(self, conn):
+        if conn.closed:
+            return False
+        try:
+            cur = conn.cursor()
+            cur.execute("SELECT 1")
+            cur.fetchone()
+            cur.close()
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _discard(self, conn):
+        self._close(conn)
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    def getconn(self):
+        start = time.monotonic()
+        deadline = start + self.checkout_timeout
+        waited = False
+        while True:
+            with self._cond:
+                while not self._idle and self._open >= self.max_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"No Postgres connection available after {self.checkout_timeout}s "
+                            f"(max_size={self.max_size})"
+                        )
+                    waited = True
+                    self._cond.wait(remaining)
+
+                if self._idle:
+                    conn, created_at, last_used = self._idle.pop()
+                else:
+                    conn, created_at, last_used = None, None, None
+                    self._open += 1
+
+            now = time.monotonic()
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._cond:
+                        self._open -= 1
+                        self._cond.notify()
+                    raise
+                created_at = now
+            elif self._expired(created_at, now):
+                with self._cond:
+                    self._recycled += 1
+                self._discard(conn)
+                continue
+            elif now - last_used > self.health_check_after and not self._healthy(conn):
+                with self._cond:
+                    self._failed_health_checks += 1
+                self._discard(conn)
+                continue
+
+            with self._cond:
+                self._created[id(conn)] = created_at
+                self._in_use += 1
+                self._checkouts += 1
+                if waited:
+                    self._waits += 1
+                    self._wait_time += now - start
+            return conn
+
+    def putconn(self, conn, discard=False):
+        with self._cond:
+            self._in_use -= 1
+            created_at = self._created.pop(id(conn), time.monotonic())
+        if not discard and not conn.closed:
+            try:
+                # End any open transaction so the next borrower starts clean
+                conn.rollback()
+            except Exception:
+                discard = True
+        if discard or conn.closed or self._expired(created_at, time.monotonic()):
+            self._discard(conn)
+            return
+        with self._cond:
+            self._idle.append((conn, created_at, time.monotonic()))
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        with self._checkout_timer():
+            conn = self.getconn()
+        try:
+            yield conn
+        except Exception:
+            self.putconn(conn, discard=conn.closed != 0)
+            raise
+        else:
+            self.putconn(conn)
+
+    def closeall(self):
+        with self._cond:
+            idle = list(self._idle)
+            self._idle.clear()
+            self._open -= len(idle)
+            self._cond.notify_all()
+        for conn, _, _ in idle:
+            self._close(conn)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "max_size": self.max_size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "checkouts": self._checkouts,
+                "waits": self._waits,
+                "wait_time_total_s": round(self._wait_time, 4),
+                "wait_time_avg_ms": round(1000 * self._wait_time / self._waits, 2) if self._waits else 0.0,
+                "timeouts": self._timeouts,
+                "recycled": self._recycled,
+                "failed_health_checks": self._failed_health_checks,
+            }
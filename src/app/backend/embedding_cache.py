@@ -0,0 +1,148 @@
+import hashlib
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def cache_key(text, deployment):
+    # Whitespace-normalized so trivially different spacing shares an entry
+    normalized = re.sub(r'\s+', ' ', text.strip())
+    return hashlib.sha256(f"{deployment}\x00{normalized}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-tier cache for embedding vectors.
+
+    Memory tier: LRU with a per-entry TTL and a byte cap on the stored vectors.
+    Disk tier (optional): SQLite file keyed the same way, so warm entries
+    survive a restart. Disk hits are promoted back into memory. Every
+    `prune_every` writes (and on open) expired rows are deleted and the
+    oldest rows beyond `max_disk_rows` are evicted.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=24 * 3600, sqlite_path=None, max_disk_rows=200_000,
+                 prune_every=1000):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (vector float32, stored_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+        self.max_disk_rows = max_disk_rows
+        self.prune_every = prune_every
+        self._disk_puts = 0
+        self._db = None
+        if sqlite_path:
+            self._db = sqlite3.connect(sqlite_path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY, vector BLOB NOT NULL, stored_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_stored_at ON embeddings (stored_at)")
+            self._db.commit()
+            self._db_lock = threading.Lock()
+            with self._db_lock:
+                self._prune_disk(time.time())
+
+    def _expired(self, stored_at, now):
+        return self.ttl and now - stored_at > self.ttl
+
+    def _put_memory(self, key, vec, stored_at):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[0].nbytes
+        self._entries[key] = (vec, stored_at)
+        self._bytes += vec.nbytes
+        while self._bytes > self.max_bytes and self._entries:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+            self.evictions += 1
+
+    def _prune_disk(self, now):
+        # Called with the db lock held
+        deleted = 0
+        if self.ttl:
+            deleted += self._db.execute("DELETE FROM embeddings WHERE stored_at < ?", (now - self.ttl,)).rowcount
+        excess = self._db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0] - self.max_disk_rows
+        if excess > 0:
+            deleted += self._db.execute(
+                "DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY stored_at LIMIT ?)",
+                (excess,),
+            ).rowcount
+        self._db.commit()
+        self.disk_evictions += deleted
+
+    def _get_disk(self, key, now):
+        if self._db is None:
+            return None
+        with self._db_lock:
+            row = self._db.execute(
+                "SELECT vector, stored_at FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or self._expired(row[1], now):
+            return None
+        return np.frombuffer(row[0], dtype=np.float32), row[1]
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[1], now):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0].tolist()
+                self._bytes -= entry[0].nbytes
+                del self._entries[key]
+
+        disk = self._get_disk(key, now)
+        with self._lock:
+            if disk is not None:
+                self._put_memory(key, disk[0], disk[1])
+                self.disk_hits += 1
+                return disk[0].tolist()
+            self.misses += 1
+        return None
+
+    def put(self, key, vector):
+        vec = np.asarray(vector, dtype=np.float32)
+        now = time.time()
+        with self._lock:
+            self._put_memory(key, vec, now)
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, stored_at) VALUES (?, ?, ?)",
+                    (key, vec.tobytes(), now),
+                )
+                self._db.commit()
+                self._disk_puts += 1
+                if self._disk_puts % self.prune_every == 0:
+                    self._prune_disk(now)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_evictions": self.disk_evictions,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+                "disk_tier": self._db is not None,
+            }
@@ -0,0 +1,53 @@
+import contextvars
+import math
+
+
+def estimate_tokens(text):
+    # ~4 characters per token for English prose; close enough for budgeting
+    return max(1, math.ceil(len(text) / 4))
+
+
+def truncate_to_tokens(text, max_tokens):
+    return text if estimate_tokens(text) <= max_tokens else text[:max_tokens * 4]
+
+
+def make_batches(texts, max_batch_tokens=8000, max_batch_inputs=256):
+    """
+    Group texts into consecutive batches that stay under both the token
+    budget and the input-count limit of one embeddings request.
+    Returns a list of lists of indices into `texts`.
+    """
+    batches = []
+    current, current_tokens = [], 0
+    for i, text in enumerate(texts):
+        tokens = estimate_tokens(text)
+        if current and (current_tokens + tokens > max_batch_tokens or len(current) >= max_batch_inputs):
+            batches.append(current)
+            current, current_tokens = [], 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
+
+
+def embed_in_batches(texts, embed_batch, executor, max_batch_tokens=8000,
+                     max_batch_inputs=256, max_input_tokens=8000):
+    """
+    Embed `texts` (already de-duplicated) with `embed_batch(list_of_texts)`,
+    one request per token-budgeted batch, run concurrently on `executor`.
+    Results come back in input order.
+    """
+    texts = [truncate_to_tokens(t, max_input_tokens) for t in texts]
+    batches = make_batches(texts, max_batch_tokens, max_batch_inputs)
+    if len(batches) == 1:
+        return embed_batch(texts)
+    futures = [
+        executor.submit(contextvars.copy_context().run, embed_batch, [texts[i] for i in batch])
+        for batch in batches
+    ]
+    results = [None] * len(texts)
+    for batch, future in zip(batches, futures):
+        for i, vec in zip(batch, future.result()):
+            results[i] = vec
+    return results
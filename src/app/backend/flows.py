@@ -0,0 +1,187 @@
+"""
+Request logic written once for both serving modes.
+
+A flow is a generator that yields the I/O it needs instead of doing it,
+and is sent the result (or has the exception thrown in):
+
+    answer = yield Call("call_chat_api", prompt, model=model)
+
+The drivers perform each Call with the same-named function of an `io`
+object: app.py's module for the Flask app (run_sync / iter_sync, blocking,
+fan-out on a thread pool) and asgi_app's module for the async mode
+(run_async / iter_async, awaiting on the event loop). Everything between
+the yields is shared; only the functions behind the names differ.
+"""
+import asyncio
+import contextvars
+import inspect
+from contextlib import aclosing, closing
+
+
+class Call:
+    """io.<name>(*args, **kwargs); the flow is sent its result (awaited in async mode)."""
+
+    def __init__(self, name, *args, **kwargs):
+        self.name = name
+        self.args = args
+        self.kwargs = kwargs
+
+
+class Stream(Call):
+    """A Call returning an iterator (async iterator in async mode); read it with Next. Closed when the flow ends."""
+
+
+class Next:
+    """The stream's next item, or END once it is exhausted."""
+
+    def __init__(self, stream):
+        self.stream = stream
+
+
+class Gather:
+    """
+    Run sub-flows concurrently; the flow is sent their results in order. In
+    sync mode the first runs on the calling thread and the rest on the
+    executor, so a sub-flow that gathers again should go first.
+    """
+
+    def __init__(self, *flows):
+        self.flows = flows
+
+
+class Emit:
+    """Hand `event` to the response (iter_sync / iter_async); run_sync / run_async drop it."""
+
+    def __init__(self, event):
+        self.event = event
+
+
+END = object()
+
+
+class _Done:
+    def __init__(self, value):
+        self.value = value
+
+
+def _send(flow, value, error):
+    # The flow's next operation, or _Done with its return value
+    try:
+        return flow.throw(error) if error is not None else flow.send(value)
+    except StopIteration as stop:
+        return _Done(stop.value)
+
+
+### ---- Sync driver ---- ###
+def _perform_sync(op, io, executor, streams):
+    if isinstance(op, Call):
+        result = getattr(io, op.name)(*op.args, **op.kwargs)
+        if isinstance(op, Stream):
+            streams.append(result)
+        return result
+    if isinstance(op, Next):
+        return next(op.stream, END)
+    if isinstance(op, Gather):
+        first, *rest = op.flows
+        # Copy the context so stages and tokens land in the request's timings
+        futures = [executor.submit(contextvars.copy_context().run, run_sync, f, io, executor) for f in rest]
+        results = [run_sync(first, io, executor)]
+        return results + [f.result() for f in futures]
+    raise TypeError(f"Unknown flow operation: {op!r}")
+
+
+def _steps_sync(flow, io, executor):
+    streams = []
+    value = error = None
+    try:
+        while True:
+            op = _send(flow, value, error)
+            value = error = None
+            if isinstance(op, (_Done, Emit)):
+                yield op
+                if isinstance(op, _Done):
+                    return
+                continue
+            try:
+                value = _perform_sync(op, io, executor, streams)
+            except Exception as e:
+                error = e
+    finally:
+        flow.close()
+        for stream in streams:
+            if hasattr(stream, "close"):
+                stream.close()
+
+
+def run_sync(flow, io, executor):
+    """The flow's return value."""
+    with closing(_steps_sync(flow, io, executor)) as steps:
+        for step in steps:
+            if isinstance(step, _Done):
+                return step.value
+
+
+def iter_sync(flow, io, executor):
+    """The flow's emitted events, as a generator (e.g. a streamed response body)."""
+    with closing(_steps_sync(flow, io, executor)) as steps:
+        for step in steps:
+            if isinstance(step, Emit):
+                yield step.event
+
+
+### ---- Async driver ---- ###
+async def _perform_async(op, io, streams):
+    if isinstance(op, Call):
+        result = getattr(io, op.name)(*op.args, **op.kwargs)
+        if inspect.isawaitable(result):
+            result = await result
+        if isinstance(op, Stream):
+            streams.append(result)
+        return result
+    if isinstance(op, Next):
+        try:
+            return await op.stream.__anext__()
+        except StopAsyncIteration:
+            return END
+    if isinstance(op, Gather):
+        return list(await asyncio.gather(*(run_async(f, io) for f in op.flows)))
+    raise TypeError(f"Unknown flow operation: {op!r}")
+
+
+async def _steps_async(flow, io):
+    streams = []
+    value = error = None
+    try:
+        while True:
+            op = _send(flow, value, error)
+            value = error = None
+            if isinstance(op, (_Done, Emit)):
+                yield op
+                if isinstance(op, _Done):
+                    return
+                continue
+            try:
+                value = await _perform_async(op, io, streams)
+            except Exception as e:
+                error = e
+    finally:
+        flow.close()
+        for stream in streams:
+            if hasattr(stream, "aclose"):
+                await stream.aclose()
+
+
+async def run_async(flow, io):
+    """The flow's return value."""
+    async with aclosing(_steps_async(flow, io)) as steps:
+        async for step in steps:
+            if isinstance(step, _Done):
+                return step.value
+
+
+async def iter_async(flow, io):
+    """The flow's emitted events, as an async generator."""
+    async with aclosing(_steps_async(flow, io)) as steps:
+        async for step in steps:
+            if isinstance(step, Emit):
+                yield step.event
@@ -0,0 +1,189 @@
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+
+from embedding_pipeline import estimate_tokens, truncate_to_tokens
+
+# Words that usually point back at an earlier turn ("how do I amend it?",
+# "what about r23?"); queries without them are searched as typed
+_FOLLOW_UP_RE = re.compile(
+    r"\b(it|its|this|that|these|those|they|them|their|there|above|previous|same|also|else|former|latter)\b"
+    r"|^\s*(and|or|but|so|then|what about|how about)\b",
+    re.IGNORECASE,
+)
+
+
+def looks_like_follow_up(query):
+    return len(query.split()) <= 3 or bool(_FOLLOW_UP_RE.search(query))
+
+
+def format_turn(turn):
+    label = {"user": "User", "summary": "Summary of earlier conversation"}.get(turn["role"], "Bot")
+    return f"{label}: {turn['content']}\n"
+
+
+def format_turns(turns):
+    return "".join(format_turn(t) for t in turns)
+
+
+def contextual_query(query, history):
+    """
+    LLM-free standalone query for latency-sensitive callers: a follow-up is
+    searched together with the previous user question.
+    """
+    if not history or not looks_like_follow_up(query):
+        return query
+    previous = next((t["content"] for t in reversed(history) if t["role"] == "user"), None)
+    return f"{previous} {query}" if previous else query
+
+
+def _turn_bytes(turn):
+    return json.dumps([turn.get("role"), turn.get("content")]).encode("utf-8")
+
+
+class HistoryManager:
+    """
+    Keeps the history section of chat prompts bounded.
+
+    The last `keep_turns` turns are kept verbatim; older turns are replaced
+    by a rolling summary. Summaries are cached by a hash of the turns they
+    cover, so as a conversation grows only the turns that have just aged out
+    are summarized, on top of the cached summary of the prefix before them.
+    No conversation id is needed: every request resends the full history.
+    fit() then enforces `max_tokens` over summary plus verbatim turns by
+    dropping the oldest turns first. Standalone query rewrites are cached the
+    same way. The LLM calls themselves are made by the caller.
+    """
+
+    def __init__(self, keep_turns=6, max_tokens=1500, summary_tokens=400, max_entries=2000):
+        self.keep_turns = keep_turns
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # ("summary" | "rewrite", hash) -> text
+        self._lock = threading.Lock()
+
+        self.summary_hits = 0
+        self.summaries = 0
+        self.rewrite_hits = 0
+        self.rewrites = 0
+
+    def split(self, history):
+        """Returns (older, recent): the turns to summarize and the ones kept verbatim."""
+        if len(history) <= self.keep_turns:
+            return [], list(history)
+        cut = len(history) - self.keep_turns
+        return list(history[:cut]), list(history[cut:])
+
+    @staticmethod
+    def _prefix_keys(turns):
+        # Hash of every prefix in one pass: keys[n - 1] covers turns[:n]
+        digest, keys = hashlib.sha1(), []
+        for turn in turns:
+            digest.update(_turn_bytes(turn))
+            keys.append(digest.hexdigest())
+        return keys
+
+    def _get(self, key):
+        with self._lock:
+            text = self._entries.get(key)
+            if text is not None:
+                self._entries.move_to_end(key)
+            return text
+
+    def _put(self, key, text):
+        with self._lock:
+            self._entries[key] = text
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def cached_summary(self, older):
+        """Returns (summary, covered): the summary of the longest cached prefix of `older` and its length."""
+        keys = self._prefix_keys(older)
+        for n in range(len(keys), 0, -1):
+            summary = self._get(("summary", keys[n - 1]))
+            if summary is not None:
+                with self._lock:
+                    if n == len(older):
+                        self.summary_hits += 1
+                return summary, n
+        return None, 0
+
+    def needs_summary(self, history):
+        """Whether compacting `history` calls the LLM: there are older turns and their summary isn't cached."""
+        older, _ = self.split(history)
+        if not older:
+            return False
+        key = ("summary", self._prefix_keys(older)[-1])
+        with self._lock:
+            return key not in self._entries
+
+    def store_summary(self, older, summary):
+        with self._lock:
+            self.summaries += 1
+        self._put(("summary", self._prefix_keys(older)[-1]), truncate_to_tokens(summary, self.summary_tokens))
+
+    def _rewrite_key(self, query, recent):
+        return ("rewrite", hashlib.sha1(b"".join(map(_turn_bytes, recent)) + query.encode("utf-8")).hexdigest())
+
+    def cached_rewrite(self, query, recent):
+        rewrite = self._get(self._rewrite_key(query, recent))
+        if rewrite is not None:
+            with self._lock:
+                self.rewrite_hits += 1
+        return rewrite
+
+    def store_rewrite(self, query, recent, rewrite):
+        with self._lock:
+            self.rewrites += 1
+        self._put(self._rewrite_key(query, recent), rewrite)
+
+    def fit(self, summary, turns, turns_in=None):
+        """
+        Prompt-ready history: an optional {"role": "summary"} turn followed by
+        as many of `turns` (newest kept first) as fit in max_tokens. The
+        newest turn is always kept, truncated if it alone is over budget.
+        Returns (history, stats).
+        """
+        budget = self.max_tokens
+        compacted = []
+        if summary:
+            summary_turn = {"role": "summary", "content": truncate_to_tokens(summary, self.summary_tokens)}
+            budget -= estimate_tokens(format_turn(summary_turn))
+            compacted.append(summary_turn)
+        kept = []
+        for turn in reversed(turns):
+            tokens = estimate_tokens(format_turn(turn))
+            if tokens > budget:
+                if not kept:
+                    room = budget - estimate_tokens(format_turn({**turn, "content": ""}))
+                    kept.append({**turn, "content": truncate_to_tokens(turn["content"], max(1, room))})
+                break
+            kept.append(turn)
+            budget -= tokens
+        compacted.extend(reversed(kept))
+        turns_in = len(turns) if turns_in is None else turns_in
+        return compacted, {
+            "turns": turns_in,
+            "verbatim_turns": len(kept),
+            "summarized": bool(summary),
+            "dropped_turns": len(turns) - len(kept),
+            "history_tokens": estimate_tokens(format_turns(compacted)) if compacted else 0,
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "keep_turns": self.keep_turns,
+                "max_tokens": self.max_tokens,
+                "summary_tokens": self.summary_tokens,
+                "summaries": self.summaries,
+                "summary_hits": self.summary_hits,
+                "rewrites": self.rewrites,
+                "rewrite_hits": self.rewrite_hits,
+            }
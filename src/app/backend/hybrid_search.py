@@ -0,0 +1,112 @@
+import re
+import threading
+
+# Reciprocal rank fusion constant; 60 is the usual choice and damps the
+# difference between rank 1 and rank 5 within each list
+RRF_K = 60
+
+# Parser config for to_tsvector/to_tsquery; must match the GIN index
+# created by vector_index.create_index_sql("fts")
+TEXT_SEARCH_CONFIG = "english"
+
+
+def lexical_tsquery(*texts):
+    """
+    OR-query over the words of the given texts (e.g. the raw query and its
+    abbreviation-expanded form), for to_tsquery. Dotted identifiers like
+    AA.ARRANGEMENT.ACTIVITY are kept whole. Returns None if nothing is left.
+    """
+    terms = []
+    for text in texts:
+        for token in re.findall(r'[A-Za-z0-9_]+(?:\.[A-Za-z0-9_]+)*', text or ""):
+            token = token.lower()
+            if len(token) >= 2 and token not in terms:
+                terms.append(token)
+    return " | ".join(terms) if terms else None
+
+
+def hybrid_sql(emb, filter_collection):
+    """
+    One statement that runs the vector and full-text top-N queries and fuses
+    them with RRF. Named parameters: embedding, tsquery, candidates, rrf_k,
+    top_k, and collection_id when filter_collection.
+    Rows: (document, collection uuid as text, cosine distance, rrf score,
+    whether the full-text side matched).
+    """
+    where = "e.collection_id = %(collection_id)s::uuid" if filter_collection else "TRUE"
+    tsvector = f"to_tsvector('{TEXT_SEARCH_CONFIG}', e.document)"
+    return f"""
+        WITH vec AS (
+            SELECT document, collection_id, distance, row_number() OVER (ORDER BY distance) AS rnk,
+                   FALSE AS lexical
+            FROM (
+                SELECT e.document, e.collection_id, {emb} <=> %(embedding)s::vector AS distance
+                FROM langchain_pg_embedding e
+                WHERE {where}
+                ORDER BY {emb} <=> %(embedding)s::vector
+                LIMIT %(candidates)s
+            ) v
+        ),
+        lex AS (
+            SELECT document, collection_id, distance, row_number() OVER (ORDER BY score DESC) AS rnk,
+                   TRUE AS lexical
+            FROM (
+                SELECT e.document, e.collection_id, {emb} <=> %(embedding)s::vector AS distance,
+                       ts_rank_cd({tsvector}, q) AS score
+                FROM langchain_pg_embedding e, to_tsquery('{TEXT_SEARCH_CONFIG}', %(tsquery)s) q
+                WHERE {where} AND {tsvector} @@ q
+                ORDER BY score DESC
+                LIMIT %(candidates)s
+            ) l
+        )
+        SELECT min(document), collection_id::text, min(distance), sum(1.0 / (%(rrf_k)s + rnk)) AS rrf,
+               bool_or(lexical)
+        FROM (SELECT * FROM vec UNION ALL SELECT * FROM lex) hits
+        GROUP BY md5(document), collection_id
+        ORDER BY rrf DESC
+        LIMIT %(top_k)s
+    """
+
+
+def to_asyncpg(sql, params):
+    """Rewrite %(name)s placeholders to $n for asyncpg; returns (sql, args)."""
+    order = []
+
+    def placeholder(match):
+        name = match.group(1)
+        if name not in order:
+            order.append(name)
+        return f"${order.index(name) + 1}"
+
+    return re.sub(r'%\((\w+)\)s', placeholder, sql), [params[name] for name in order]
+
+
+class Reranker:
+    """
+    Cross-encoder re-ranking of retrieved hits (sentence_transformers
+    CrossEncoder, loaded on first use). Scores each (query, document) pair
+    and keeps the best `top_n`.
+    """
+
+    def __init__(self, model_name, max_length=512):
+        self.model_name = model_name
+        self.max_length = max_length
+        self._model = None
+        self._lock = threading.Lock()
+
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import CrossEncoder
+                    self._model = CrossEncoder(self.model_name, max_length=self.max_length)
+        return self._model
+
+    def rerank(self, query, hits, top_n):
+        if len(hits) <= 1:
+            return hits
+        scores = self.model().predict([(query, h["document"]) for h in hits])
+        for hit, score in zip(hits, scores):
+            hit["rerank_score"] = round(float(score), 4)
+            hit["rank_score"] = hit["rerank_score"]
+        return sorted(hits, key=lambda h: h["rank_score"], reverse=True)[:top_n]
@@ -0,0 +1,349 @@
+"""
+Bulk ingestion of release documentation into langchain_pg_embedding.
+
+    python ingest.py --product transact --version r24 docs/r24/ \\
+        [--max-tokens 800] [--keep-stale] [--prune-foreign] [--index hnsw|ivfflat|none] [--fts] [--dry-run]
+
+Markdown (.md) and HTML (.html/.htm) files are read one at a time and
+split into chunks on h1/h2 headings. Each chunk starts with the
+"h1: ..." / "h2: ..." lines the chat prompt tells the model to look for.
+Chunks whose content hash is already in the collection are skipped, so
+re-ingesting a release only embeds and loads what changed; chunks loaded
+here that are no longer in the docs are deleted unless --keep-stale (rows
+from other loaders, which have no content hash, only with --prune-foreign).
+New rows are embedded in concurrent token-budgeted batches
+(QUERY_EMBEDDING_BACKEND, so they match query vectors) and loaded with
+COPY. The collection's partial ANN index (HNSW by default when
+EMBEDDING_DIM is set, otherwise none) is built after the load, and dropped
+first when the load is large compared to what is already there.
+
+The same pipeline backs POST /api/ingest in app.py.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sys
+import uuid
+from html.parser import HTMLParser
+from io import StringIO
+
+from embedding_pipeline import estimate_tokens
+from vector_index import EMBEDDING_DIM, drop_indexes, ensure_indexes
+
+DOC_EXTENSIONS = {".md": "markdown", ".markdown": "markdown", ".html": "html", ".htm": "html"}
+# Rows embedded and COPYed per round, so a large release isn't held in memory at once
+LOAD_BATCH_ROWS = 500
+# Rebuild (drop, load, create) the collection's ANN index when the load adds
+# more than this fraction of the rows already in it
+INDEX_REBUILD_FRACTION = 0.5
+# HNSW/IVFFlat need the column's dimension (see vector_index.EMBEDDING_DIM);
+# without it the default is to load without an ANN index
+DEFAULT_INDEX_METHOD = "hnsw" if EMBEDDING_DIM else None
+ANN_METHODS = ("hnsw", "ivfflat")
+
+_HEADING_RE = re.compile(r'^(#{1,6})\s+(.*?)\s*#*\s*$')
+
+
+class _HtmlToMarkdown(HTMLParser):
+    # Just enough structure for chunking: headings become "#" lines, block
+    # elements become line breaks, scripts and styles are dropped
+    BLOCKS = {"p", "div", "section", "article", "li", "tr", "br", "pre", "table", "ul", "ol", "blockquote"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skip += 1
+        elif re.fullmatch(r'h[1-6]', tag):
+            self.parts.append("\n\n" + "#" * int(tag[1]) + " ")
+        elif tag in self.BLOCKS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style"):
+            self._skip = max(0, self._skip - 1)
+        elif re.fullmatch(r'h[1-6]', tag) or tag in self.BLOCKS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+
+def html_to_markdown(html):
+    parser = _HtmlToMarkdown()
+    parser.feed(html)
+    parser.close()
+    text = "".join(parser.parts)
+    # Headings may span several text nodes; keep each on one line
+    text = re.sub(r'^(#{1,6} )[ \t]*\n?[ \t]*', r'\1', text, flags=re.MULTILINE)
+    return re.sub(r'\n{3,}', "\n\n", text)
+
+
+def iter_documents(paths):
+    """Yields (source, markdown text) for every supported file under `paths`, one file at a time."""
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(
+                os.path.join(root, name)
+                for root, _, names in os.walk(path) for name in names
+            )
+        else:
+            files = [path]
+        for file_path in files:
+            kind = DOC_EXTENSIONS.get(os.path.splitext(file_path)[1].lower())
+            if kind is None:
+                continue
+            with open(file_path, encoding="utf-8", errors="replace") as f:
+                text = f.read()
+            yield file_path, html_to_markdown(text) if kind == "html" else text
+
+
+def _hard_split(sentence, max_chars):
+    # Cut at the last whitespace before the limit so words stay whole; only a
+    # single "word" longer than the limit is cut mid-way
+    parts = []
+    while len(sentence) > max_chars:
+        gaps = [m.start() for m in re.finditer(r'\s', sentence[1:max_chars + 1])]
+        cut = gaps[-1] + 1 if gaps else max_chars
+        parts.append(sentence[:cut].rstrip())
+        sentence = sentence[cut:].lstrip()
+    if sentence:
+        parts.append(sentence)
+    return parts
+
+
+def _split_body(paragraphs, max_tokens):
+    # Pack paragraphs into pieces of at most max_tokens; an oversized
+    # paragraph is split on sentence boundaries, then at whitespace
+    pieces, current, current_tokens = [], [], 0
+    for para in paragraphs:
+        units = [para] if estimate_tokens(para) <= max_tokens else [
+            s for sentence in re.split(r'(?<=[.!?])\s+', para)
+            for s in ([sentence] if estimate_tokens(sentence) <= max_tokens
+                      else _hard_split(sentence, max_tokens * 4))
+        ]
+        for unit in units:
+            tokens = estimate_tokens(unit)
+            if current and current_tokens + tokens > max_tokens:
+                pieces.append("\n\n".join(current))
+                current, current_tokens = [], 0
+            current.append(unit)
+            current_tokens += tokens
+    if current:
+        pieces.append("\n\n".join(current))
+    return pieces
+
+
+def content_hash(text):
+    return hashlib.sha256(re.sub(r'\s+', ' ', text.strip()).encode("utf-8")).hexdigest()
+
+
+def chunk_document(text, source, max_tokens=800):
+    """
+    Split a markdown document into chunks under its h1/h2 headings. Deeper
+    headings stay in the body as "h3: ..." lines. Each chunk is
+    {document, source, h1, h2, content_hash}, with the document starting
+    "h1: <title>\\nh2: <title>\\n" and fitting in max_tokens.
+    """
+    chunks = []
+    h1 = h2 = None
+    body = []
+
+    def flush():
+        paragraphs = [p.strip() for p in "\n".join(body).split("\n\n") if p.strip()]
+        if not paragraphs:
+            return
+        header = (f"h1: {h1}\n" if h1 else "") + (f"h2: {h2}\n" if h2 else "")
+        for piece in _split_body(paragraphs, max(50, max_tokens - estimate_tokens(header))):
+            document = header + piece
+            chunks.append({
+                "document": document,
+                "source": source,
+                "h1": h1,
+                "h2": h2,
+                "content_hash": content_hash(document),
+            })
+
+    for line in text.splitlines():
+        match = _HEADING_RE.match(line)
+        if match and len(match.group(1)) <= 2:
+            flush()
+            body = []
+            if len(match.group(1)) == 1:
+                h1, h2 = match.group(2), None
+            else:
+                h2 = match.group(2)
+        elif match:
+            body.append(f"h{len(match.group(1))}: {match.group(2)}")
+        else:
+            body.append(line)
+    flush()
+    return chunks
+
+
+def _copy_value(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace("\r", "\\r").replace("\t", "\\t")
+
+
+def ensure_collection(cur, name):
+    """Returns (collection uuid, created)."""
+    cur.execute("SELECT uuid::text FROM langchain_pg_collection WHERE name = %s", (name,))
+    row = cur.fetchone()
+    if row:
+        return row[0], False
+    collection_id = str(uuid.uuid4())
+    cur.execute(
+        "INSERT INTO langchain_pg_collection (uuid, name, cmetadata) VALUES (%s, %s, %s)",
+        (collection_id, name, json.dumps({"ingested_by": "ingest.py"})),
+    )
+    return collection_id, True
+
+
+def ingest_collection(conn, collection_name, chunks, embed, prune=True, index_method=DEFAULT_INDEX_METHOD,
+                      fts=False, embedding_dim=None, log=None, prune_foreign=False):
+    """
+    Load `chunks` (from chunk_document) into one collection. `embed(texts)`
+    returns one vector per text. Returns a stats dict. Raises ValueError,
+    before anything is written, when an ANN index is asked for without
+    embedding_dim.
+
+    prune deletes rows this pipeline loaded (they carry a content_hash) whose
+    chunk is no longer in `chunks`; rows from other loaders (the LangChain
+    loader writes none) are only deleted with prune_foreign too.
+    """
+    if index_method in ANN_METHODS and not embedding_dim:
+        raise ValueError(f"A {index_method} index needs EMBEDDING_DIM; ingest with index none or set it")
+    log = log or (lambda message: None)
+    cur = conn.cursor()
+    collection_id, created = ensure_collection(cur, collection_name)
+    cur.execute(
+        "SELECT id, cmetadata->>'content_hash' FROM langchain_pg_embedding WHERE collection_id = %s::uuid",
+        (collection_id,),
+    )
+    existing = {}
+    for row_id, digest in cur.fetchall():
+        existing.setdefault(digest, []).append(row_id)
+
+    wanted, fresh = set(), []
+    for chunk in chunks:
+        if chunk["content_hash"] in wanted:
+            continue
+        wanted.add(chunk["content_hash"])
+        if chunk["content_hash"] not in existing:
+            fresh.append(chunk)
+    # Rows from other loaders have no content hash (key None)
+    stale = [
+        row_id for digest, ids in existing.items()
+        if digest not in wanted and (digest is not None or prune_foreign) for row_id in ids
+    ] if prune else []
+    stats = {
+        "collection": collection_name,
+        "collection_id": collection_id,
+        "created_collection": created,
+        "chunks": len(wanted),
+        "unchanged": len(wanted) - len(fresh),
+        "inserted": 0,
+        "deleted": 0,
+        "indexes_dropped": [],
+        "indexes_created": [],
+    }
+
+    rebuild = bool(index_method) and len(fresh) > INDEX_REBUILD_FRACTION * sum(map(len, existing.values()))
+    if rebuild and not created:
+        stats["indexes_dropped"] = drop_indexes(conn, index_method, [collection_id])
+
+    if stale:
+        cur.execute("DELETE FROM langchain_pg_embedding WHERE id = ANY(%s)", (stale,))
+        stats["deleted"] = cur.rowcount
+    for start in range(0, len(fresh), LOAD_BATCH_ROWS):
+        batch = fresh[start:start + LOAD_BATCH_ROWS]
+        vectors = embed([c["document"] for c in batch])
+        rows = StringIO()
+        for chunk, vec in zip(batch, vectors):
+            if embedding_dim and len(vec) != embedding_dim:
+                raise ValueError(f"Embedding has {len(vec)} dimensions, EMBEDDING_DIM is {embedding_dim}")
+            metadata = {k: chunk[k] for k in ("source", "h1", "h2", "content_hash")}
+            row_id = str(uuid.uuid5(uuid.UUID(collection_id), chunk["content_hash"]))
+            rows.write("\t".join([
+                row_id, collection_id, "[" + ",".join(repr(float(x)) for x in vec) + "]",
+                _copy_value(chunk["document"]), _copy_value(json.dumps(metadata)),
+            ]) + "\n")
+        rows.seek(0)
+        cur.copy_expert(
+            "COPY langchain_pg_embedding (id, collection_id, embedding, document, cmetadata) FROM STDIN",
+            rows,
+        )
+        stats["inserted"] += len(batch)
+        log(f"{collection_name}: {stats['inserted']}/{len(fresh)} new chunks loaded")
+    conn.commit()
+    if fresh or stale:
+        cur.execute("ANALYZE langchain_pg_embedding")
+        conn.commit()
+    cur.close()
+
+    # Indexes go on after the rows are in: one build instead of per-row updates.
+    # Also checked when nothing changed, so an index lost to an earlier failed
+    # run is rebuilt (ensure_indexes skips valid ones)
+    if index_method:
+        stats["indexes_created"] += ensure_indexes(conn, index_method, [collection_id])
+    if fts and fresh:
+        stats["indexes_created"] += ensure_indexes(conn, "fts")
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("paths", nargs="+", help="files or directories of .md/.html docs")
+    parser.add_argument("--product", help="collection is temenos_<product>_<version>")
+    parser.add_argument("--version")
+    parser.add_argument("--collection", help="explicit collection name instead of --product/--version")
+    parser.add_argument("--max-tokens", type=int, default=800, help="max tokens per chunk")
+    parser.add_argument("--keep-stale", action="store_true", help="keep chunks that are no longer in the docs")
+    parser.add_argument("--prune-foreign", action="store_true",
+                        help="also delete rows loaded by other tools (no content_hash), e.g. the LangChain loader")
+    parser.add_argument("--index", choices=["hnsw", "ivfflat", "none"], default=DEFAULT_INDEX_METHOD or "none",
+                        help="ANN index to build; hnsw/ivfflat need EMBEDDING_DIM (default hnsw when it is set)")
+    parser.add_argument("--fts", action="store_true", help="also build the full-text index for hybrid retrieval")
+    parser.add_argument("--dry-run", action="store_true", help="only chunk and report, no embedding or loading")
+    args = parser.parse_args()
+    if not args.collection and not (args.product and args.version):
+        parser.error("give --collection or both --product and --version")
+    if args.index in ANN_METHODS and not EMBEDDING_DIM:
+        parser.error(f"--index {args.index} needs EMBEDDING_DIM; set it or use --index none")
+    collection_name = args.collection or f"temenos_{args.product.lower()}_{args.version.lower()}"
+
+    chunks = []
+    for source, text in iter_documents(args.paths):
+        doc_chunks = chunk_document(text, source, args.max_tokens)
+        chunks.extend(doc_chunks)
+        print(f"{source}: {len(doc_chunks)} chunks")
+    print(f"{len(chunks)} chunks for {collection_name}")
+    if args.dry_run or not chunks:
+        return
+
+    # Embedding backend, batching and Postgres settings come from the backend's config
+    from app import _connect_pg, embed_documents
+    conn = _connect_pg()
+    try:
+        stats = ingest_collection(
+            conn, collection_name, chunks, embed_documents,
+            prune=not args.keep_stale,
+            prune_foreign=args.prune_foreign,
+            index_method=None if args.index == "none" else args.index,
+            fts=args.fts,
+            embedding_dim=int(EMBEDDING_DIM) if EMBEDDING_DIM else None,
+            log=print,
+        )
+    finally:
+        conn.close()
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+import hashlib
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def job_key(kind, payload):
+    return hashlib.sha256(json.dumps([kind, payload], sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class Job:
+    def __init__(self, kind, payload, resource, key):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.payload = payload
+        self.resource = resource
+        self.key = key
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.done = threading.Event()
+
+    def to_dict(self):
+        out = {"job_id": self.id, "kind": self.kind, "status": self.status}
+        if self.started:
+            out["queue_ms"] = round((self.started - self.created) * 1000, 1)
+        if self.finished:
+            out["run_ms"] = round((self.finished - self.started) * 1000, 1)
+        if self.status == "done":
+            out["result"] = self.result
+        elif self.status == "error":
+            out["error"] = self.error
+        return out
+
+
+class JobQueue:
+    """
+    In-process queue for slow, non-interactive work (answer comparison,
+    judging, semantic diffs) so it runs on its own threads instead of a
+    web worker.
+
+    Handlers are registered per kind as (fn(payload) -> result,
+    resource(payload) -> name). Jobs start in submission order on a pool of
+    `workers` threads, except that at most limits.get(resource,
+    default_limit) jobs per resource (an LLM deployment, the embeddings
+    backend) run at once; a job waiting on a busy resource doesn't hold a
+    thread or block jobs behind it that need another one. Submitting the
+    same kind and payload as a queued, running or finished job returns that
+    job. Finished jobs are kept for `ttl` seconds, at most `max_jobs` overall,
+    without their payload (dedupe goes by its hash).
+    """
+
+    def __init__(self, workers=8, limits=None, default_limit=4, ttl=3600, max_jobs=1000):
+        self.workers = workers
+        self.limits = limits or {}
+        self.default_limit = default_limit
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self._handlers = {}
+        self._jobs = OrderedDict()  # job id -> Job, oldest first
+        self._by_key = {}  # job key -> job id
+        self._pending = deque()
+        self._running = {}  # resource -> running jobs
+        self._active = 0
+        self._lock = threading.Lock()
+
+        self.submitted = 0
+        self.deduped = 0
+        self.completed = 0
+        self.failed = 0
+
+    def register(self, kind, fn, resource):
+        self._handlers[kind] = (fn, resource)
+
+    def kinds(self):
+        return list(self._handlers)
+
+    def limit(self, resource):
+        return self.limits.get(resource, self.default_limit)
+
+    def _expire(self, now):
+        # Oldest first; queued and running jobs are skipped, never dropped,
+        # so a long job doesn't hold back cleanup of the ones after it
+        excess = len(self._jobs) - self.max_jobs
+        for job in list(self._jobs.values()):
+            if job.finished is None:
+                continue
+            if excess <= 0 and now - job.finished <= self.ttl:
+                continue
+            del self._jobs[job.id]
+            excess -= 1
+            if self._by_key.get(job.key) == job.id:
+                del self._by_key[job.key]
+
+    def submit(self, kind, payload):
+        """Returns (job, deduped). Raises KeyError for an unknown kind."""
+        fn, resource = self._handlers[kind]
+        key = job_key(kind, payload)
+        with self._lock:
+            self._expire(time.time())
+            existing = self._jobs.get(self._by_key.get(key))
+            if existing is not None and existing.status != "error":
+                self.deduped += 1
+                return existing, True
+            job = Job(kind, payload, resource(payload), key)
+            self._jobs[job.id] = job
+            self._by_key[key] = job.id
+            self._pending.append(job)
+            self.submitted += 1
+            self._dispatch()
+        return job, False
+
+    def _dispatch(self):
+        # Called with the lock held: start every pending job that has a free
+        # thread and a free slot for its resource, oldest first
+        for job in list(self._pending):
+            if self._active >= self.workers:
+                break
+            if self._running.get(job.resource, 0) >= self.limit(job.resource):
+                continue
+            self._pending.remove(job)
+            self._running[job.resource] = self._running.get(job.resource, 0) + 1
+            self._active += 1
+            job.status = "running"
+            job.started = time.time()
+            self.executor.submit(self._run, job)
+
+    def _run(self, job):
+        fn, _ = self._handlers[job.kind]
+        try:
+            result, error = fn(job.payload), None
+        except Exception as e:
+            result, error = None, str(e)
+        with self._lock:
+            job.finished = time.time()
+            job.result, job.error = result, error
+            # Dedupe only needs job.key; don't hold e.g. a whole release's documents until expiry
+            job.payload = None
+            job.status = "error" if error is not None else "done"
+            if error is not None:
+                self.failed += 1
+            else:
+                self.completed += 1
+            self._running[job.resource] -= 1
+            self._active -= 1
+            self._dispatch()
+        job.done.set()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def wait(self, job_id, timeout):
+        """The job after it finishes or `timeout` seconds pass, whichever is first; None if unknown."""
+        job = self.get(job_id)
+        if job is not None and timeout > 0:
+            job.done.wait(timeout)
+        return job
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "active": self._active,
+                "queued": len(self._pending),
+                "running": {r: n for r, n in self._running.items() if n},
+                "limits": {**{r: self.limit(r) for r in self._running}, **self.limits},
+                "default_limit": self.default_limit,
+                "jobs": len(self._jobs),
+                "submitted": self.submitted,
+                "deduped": self.deduped,
+                "completed": self.completed,
+                "failed": self.failed,
+            }
@@ -0,0 +1,72 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class LocalEmbedder:
+    """
+    CPU sentence_transformers model as an alternative to the Azure
+    embeddings API.
+
+    The model is loaded on first use (or by warm_up()). Calls run on a small
+    dedicated thread pool so concurrent requests don't oversubscribe the CPU,
+    and each call encodes its texts in batches of `batch_size`. Vectors are
+    L2-normalized, so cosine similarity is a dot product.
+    """
+
+    def __init__(self, model_name, batch_size=32, max_workers=2, device="cpu"):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.device = device
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="local-embed")
+        self._model = None
+        self._lock = threading.Lock()
+        self.load_seconds = None
+        self.calls = 0
+        self.texts = 0
+        self.encode_seconds = 0.0
+
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    from sentence_transformers import SentenceTransformer
+                    started = time.perf_counter()
+                    self._model = SentenceTransformer(self.model_name, device=self.device)
+                    self.load_seconds = round(time.perf_counter() - started, 2)
+        return self._model
+
+    def _encode(self, texts):
+        started = time.perf_counter()
+        vectors = self.model().encode(
+            texts, batch_size=self.batch_size, normalize_embeddings=True,
+            convert_to_numpy=True, show_progress_bar=False,
+        )
+        with self._lock:
+            self.calls += 1
+            self.texts += len(texts)
+            self.encode_seconds += time.perf_counter() - started
+        return vectors.tolist()
+
+    def submit(self, texts):
+        """Encode on the embedder's pool; returns a concurrent.futures.Future."""
+        return self.executor.submit(self._encode, list(texts))
+
+    def embed(self, texts):
+        return self.submit(texts).result()
+
+    def warm_up(self):
+        # Load the weights and run one encode so the first request doesn't pay for it
+        self.embed(["warm up"])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "model": self.model_name,
+                "device": self.device,
+                "loaded": self._model is not None,
+                "load_s": self.load_seconds,
+                "calls": self.calls,
+                "texts": self.texts,
+                "encode_s": round(self.encode_seconds, 3),
+            }
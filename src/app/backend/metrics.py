@@ -0,0 +1,153 @@
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds; covers cache hits (ms) up to slow completions (tens of seconds)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+METRIC_HELP = {
+    "http_request_duration_seconds": ("histogram", "HTTP request latency by endpoint"),
+    "stage_duration_seconds": ("histogram", "Time spent in each request stage"),
+    "llm_call_duration_seconds": ("histogram", "Chat completion latency by model, retries included"),
+    "azure_request_duration_seconds": ("histogram", "Single Azure HTTP attempt latency by deployment"),
+    "azure_retries_total": ("counter", "Azure calls retried, by deployment"),
+    "llm_tokens_total": ("counter", "Tokens reported by Azure usage, by model and kind"),
+    "llm_admissions_total": ("counter", "Chat calls by admission outcome (admitted, queued, overflow, shed), by deployment"),
+}
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_str(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class MetricsRegistry:
+    """Process-wide counters and histograms, rendered in the Prometheus text format."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._counters = {}  # (name, labels) -> value
+        self._histograms = {}  # (name, labels) -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    hist[0][i] += 1
+            hist[1] += value
+            hist[2] += 1
+
+    def render(self):
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._histograms.items())
+        lines, described = [], set()
+
+        def describe(name, default_type):
+            if name not in described:
+                kind, text = METRIC_HELP.get(name, (default_type, name))
+                lines.append(f"# HELP {name} {text}")
+                lines.append(f"# TYPE {name} {kind}")
+                described.add(name)
+
+        for (name, labels), value in counters:
+            describe(name, "counter")
+            lines.append(f"{name}{_label_str(labels)} {value}")
+        for (name, labels), (bucket_counts, total, count) in histograms:
+            describe(name, "histogram")
+            for bound, n in zip(self.buckets, bucket_counts):
+                lines.append(f"{name}_bucket{_label_str(labels + (('le', bound),))} {n}")
+            lines.append(f"{name}_bucket{_label_str(labels + (('le', '+Inf'),))} {count}")
+            lines.append(f"{name}_sum{_label_str(labels)} {total:.6f}")
+            lines.append(f"{name}_count{_label_str(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+class RequestTimings:
+    """Per-request breakdown returned as the `timings` object of a response."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}  # stage -> seconds, summed over repeats
+        self.tokens = {}  # model -> {"prompt_tokens": n, "completion_tokens": n}
+        self.retries = 0
+
+    def to_dict(self):
+        return {
+            "stages_ms": {k: round(v * 1000, 1) for k, v in self.stages.items()},
+            "tokens": self.tokens,
+            "retries": self.retries,
+            "total_ms": round((time.perf_counter() - self.started) * 1000, 1),
+        }
+
+
+_current = contextvars.ContextVar("request_timings", default=None)
+
+
+def start_request_timings():
+    timings = RequestTimings()
+    _current.set(timings)
+    return timings
+
+
+def current_timings():
+    return _current.get()
+
+
+@contextmanager
+def stage(name):
+    """Time a block into stage_duration_seconds and the current request's timings."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        metrics.observe("stage_duration_seconds", elapsed, stage=name)
+        timings = _current.get()
+        if timings is not None:
+            timings.stages[name] = timings.stages.get(name, 0.0) + elapsed
+
+
+def record_azure_attempt(deployment, seconds, outcome):
+    # outcome: an HTTP status code, or "error" for connection failures/timeouts
+    metrics.observe("azure_request_duration_seconds", seconds, deployment=deployment, outcome=outcome)
+
+
+def record_retry(deployment):
+    metrics.inc("azure_retries_total", deployment=deployment)
+    timings = _current.get()
+    if timings is not None:
+        timings.retries += 1
+
+
+def record_usage(model, usage):
+    if not usage:
+        return
+    timings = _current.get()
+    for kind in ("prompt_tokens", "completion_tokens"):
+        n = usage.get(kind)
+        if not n:
+            continue
+        metrics.inc("llm_tokens_total", n, model=model, kind=kind)
+        if timings is not None:
+            per_model = timings.tokens.setdefault(model, {})
+            per_model[kind] = per_model.get(kind, 0) + n
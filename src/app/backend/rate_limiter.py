@@ -0,0 +1,197 @@
+import threading
+import time
+
+
+class Overloaded(Exception):
+    """A deployment (and its overflow) can't take the request before its deadline."""
+
+    def __init__(self, deployment, retry_after):
+        super().__init__(f"Deployment {deployment} is at its rate limit; retry in {retry_after:.0f}s")
+        self.deployment = deployment
+        self.retry_after = retry_after
+
+
+def parse_limits(spec):
+    # "azure/gpt-4.1-mini=4,embeddings=2" -> {"azure/gpt-4.1-mini": 4, "embeddings": 2}
+    limits = {}
+    for item in (spec or "").split(","):
+        name, _, value = item.strip().rpartition("=")
+        if name and value.isdigit():
+            limits[name] = int(value)
+    return limits
+
+
+def parse_overflow(spec):
+    # "azure/gpt-4.1-mini=azure/gpt-4o-mini,..." -> {"azure/gpt-4.1-mini": "azure/gpt-4o-mini"}
+    routes = {}
+    for item in (spec or "").split(","):
+        source, _, target = item.strip().partition("=")
+        if source and target:
+            routes[source] = target
+    return routes
+
+
+class TokenBucket:
+    """
+    Refills at `per_minute` / 60 per second up to `per_minute`. take() may
+    drive the level negative: that debt is the queue ahead of the next
+    caller, which delay_for() turns into a wait.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay_for(self, amount, now):
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= min(amount, self.capacity)
+
+
+class Ticket:
+    """An admitted request: call `deployment` after sleeping `delay` seconds, then settle() with real usage."""
+
+    def __init__(self, limiter, deployment, tokens, delay, overflow):
+        self.limiter = limiter
+        self.deployment = deployment
+        self.tokens = tokens
+        self.delay = delay
+        self.overflow = overflow
+        self._waiting = delay > 0
+
+    def done_waiting(self):
+        if self._waiting:
+            self._waiting = False
+            self.limiter.done_waiting(self.deployment)
+
+    def retry(self):
+        # A retried call is another request against the same limits
+        self.limiter.charge(self.deployment, self.tokens)
+
+    def settle(self, usage):
+        # Correct the token estimate with what the service reported
+        self.done_waiting()
+        if usage and usage.get("total_tokens"):
+            self.limiter.adjust(self.deployment, usage["total_tokens"] - self.tokens)
+
+
+class RateLimiter:
+    """
+    Admission control for Azure chat deployments: an RPM and a TPM token
+    bucket per deployment (requests and estimated prompt + completion
+    tokens). A request that would exceed either is queued, i.e. told how
+    long to wait, as long as that wait is within `max_wait` seconds and
+    fewer than `max_queue` requests are already waiting; otherwise it is
+    routed to the deployment's overflow target if that one can take it
+    sooner, or rejected with Overloaded. Retries are charged to the
+    buckets again (Ticket.retry). Deployments without limits are always
+    admitted. Waiting is left to the caller (time.sleep or
+    asyncio.sleep), so the same limiter serves both serving modes.
+    """
+
+    def __init__(self, rpm=None, tpm=None, overflow=None, max_wait=10.0, max_queue=50):
+        self.rpm = rpm or {}
+        self.tpm = tpm or {}
+        self.overflow = overflow or {}
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self._buckets = {}  # deployment -> (rpm bucket or None, tpm bucket or None)
+        self._waiting = {}
+        self._counts = {}  # deployment -> {"admitted": n, "queued": n, "overflow": n, "shed": n, "retries": n}
+        self._lock = threading.Lock()
+
+    def _deployment_buckets(self, deployment):
+        buckets = self._buckets.get(deployment)
+        if buckets is None:
+            rpm, tpm = self.rpm.get(deployment), self.tpm.get(deployment)
+            buckets = (TokenBucket(rpm) if rpm else None, TokenBucket(tpm) if tpm else None)
+            self._buckets[deployment] = buckets
+        return buckets
+
+    def _delay(self, deployment, tokens, now):
+        rpm, tpm = self._deployment_buckets(deployment)
+        return max(rpm.delay_for(1, now) if rpm else 0.0, tpm.delay_for(tokens, now) if tpm else 0.0)
+
+    def _count(self, deployment, outcome):
+        counts = self._counts.setdefault(
+            deployment, {"admitted": 0, "queued": 0, "overflow": 0, "shed": 0, "retries": 0}
+        )
+        counts[outcome] += 1
+
+    def _reserve(self, deployment, tokens, delay):
+        rpm, tpm = self._deployment_buckets(deployment)
+        if rpm:
+            rpm.take(1)
+        if tpm:
+            tpm.take(tokens)
+        if delay > 0:
+            self._waiting[deployment] = self._waiting.get(deployment, 0) + 1
+
+    def _acceptable(self, deployment, delay, deadline):
+        return delay == 0 or (delay <= deadline and self._waiting.get(deployment, 0) < self.max_queue)
+
+    def admit(self, deployment, tokens, max_wait=None, allow_overflow=True):
+        """Returns a Ticket, possibly for the overflow deployment; raises Overloaded."""
+        deadline = self.max_wait if max_wait is None else max_wait
+        with self._lock:
+            now = time.monotonic()
+            delay = self._delay(deployment, tokens, now)
+            target = self.overflow.get(deployment) if allow_overflow else None
+            if delay > 0 and target:
+                # Overflow only when the other deployment can start sooner
+                target_delay = self._delay(target, tokens, now)
+                if target_delay < delay and self._acceptable(target, target_delay, deadline):
+                    self._reserve(target, tokens, target_delay)
+                    self._count(deployment, "overflow")
+                    return Ticket(self, target, tokens, target_delay, overflow=True)
+            if not self._acceptable(deployment, delay, deadline):
+                self._count(deployment, "shed")
+                raise Overloaded(deployment, max(1.0, delay))
+            self._reserve(deployment, tokens, delay)
+            self._count(deployment, "queued" if delay > 0 else "admitted")
+            return Ticket(self, deployment, tokens, delay, overflow=False)
+
+    def charge(self, deployment, tokens):
+        """Take a request and `tokens` from the buckets without admission, e.g. for a retry."""
+        with self._lock:
+            self._reserve(deployment, tokens, 0)
+            self._count(deployment, "retries")
+
+    def done_waiting(self, deployment):
+        with self._lock:
+            self._waiting[deployment] -= 1
+
+    def adjust(self, deployment, extra_tokens):
+        with self._lock:
+            tpm = self._deployment_buckets(deployment)[1]
+            if tpm:
+                tpm.level -= extra_tokens
+
+    def stats(self):
+        with self._lock:
+            now = time.monotonic()
+            out = {}
+            for deployment in set(self.rpm) | set(self.tpm) | set(self._counts):
+                rpm, tpm = self._deployment_buckets(deployment)
+                for bucket in (rpm, tpm):
+                    if bucket:
+                        bucket._refill(now)
+                out[deployment] = {
+                    "rpm_limit": self.rpm.get(deployment),
+                    "tpm_limit": self.tpm.get(deployment),
+                    "requests_available": round(rpm.level, 1) if rpm else None,
+                    "tokens_available": round(tpm.level) if tpm else None,
+                    "waiting": self._waiting.get(deployment, 0),
+                    "overflow_to": self.overflow.get(deployment),
+                    **self._counts.get(deployment, {}),
+                }
+            return {"max_wait_s": self.max_wait, "max_queue": self.max_queue, "deployments": out}
@@ -0,0 +1,206 @@
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future
+
+
+def normalize_query(q):
+    return re.sub(r'\s+', ' ', q.strip().lower())
+
+
+def _words(text):
+    return re.findall(r'\w+', text.lower())
+
+
+def _fits_typed_text(suggestion, typed):
+    """
+    True if a suggestion made for an earlier prefix still fits what has
+    been typed since: every finished word appears in it, and the word being
+    typed is the start of one of its words.
+    """
+    typed_words = _words(typed)
+    if not typed_words:
+        return True
+    words = _words(suggestion)
+    finished, partial = typed_words[:-1], typed_words[-1]
+    if typed.endswith(" "):
+        finished, partial = typed_words, ""
+    if not all(w in words for w in finished):
+        return False
+    return not partial or any(w.startswith(partial) for w in words)
+
+
+class _LRU:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, stored_at = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._data[key] = (value, time.monotonic())
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+
+class SuggestionEngine:
+    """
+    Keeps /api/suggestions cheap while the user types.
+
+    - Retrieval results are reused when the new query extends a recent
+      query by at most `max_retrieval_extension` characters.
+    - LLM suggestions are reused for the exact query, or for a recent prefix
+      if enough of them still fit what has been typed since.
+    - Each session's latest `seq` is tracked so superseded requests can
+      skip the LLM call, and identical in-flight LLM calls are coalesced.
+    - Local candidates come from past chat queries and from h1:/h2:
+      section headers in the retrieved docs, with no LLM call.
+    """
+
+    def __init__(self, max_entries=2000, ttl=600, max_retrieval_extension=16,
+                 max_suggestion_extension=12, past_queries_per_scope=500):
+        self.max_retrieval_extension = max_retrieval_extension
+        self.max_suggestion_extension = max_suggestion_extension
+        self._retrieval = _LRU(max_entries, ttl)
+        self._suggestions = _LRU(max_entries, ttl)
+        self._sessions = _LRU(max_entries, ttl)
+        self._past_queries = {}  # (product, version) -> deque of queries
+        self._past_queries_per_scope = past_queries_per_scope
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.stats_counters = Counter()
+
+    # -- sessions / staleness --
+    def begin(self, session_id, seq):
+        if session_id is None or seq is None:
+            return
+        with self._lock:
+            latest = self._sessions.get(session_id)
+            if latest is None or seq > latest:
+                self._sessions.put(session_id, seq)
+
+    def is_stale(self, session_id, seq):
+        if session_id is None or seq is None:
+            return False
+        with self._lock:
+            latest = self._sessions.get(session_id)
+        stale = latest is not None and seq < latest
+        if stale:
+            self.stats_counters["stale_skipped"] += 1
+        return stale
+
+    # -- prefix lookups --
+    def _prefix_lookup(self, cache, scope, query, max_extension):
+        q = normalize_query(query)
+        with self._lock:
+            for cut in range(len(q), max(0, len(q) - max_extension) - 1, -1):
+                value = cache.get((scope, q[:cut]))
+                if value is not None:
+                    return q[:cut], value
+        return None, None
+
+    def cached_retrieval(self, product, version, query):
+        prefix, docs = self._prefix_lookup(
+            self._retrieval, (product, version), query, self.max_retrieval_extension
+        )
+        self.stats_counters["retrieval_hits" if docs is not None else "retrieval_misses"] += 1
+        return docs
+
+    def store_retrieval(self, product, version, query, docs):
+        with self._lock:
+            self._retrieval.put(((product, version), normalize_query(query)), docs)
+
+    def cached_suggestions(self, product, version, query, min_matches=2):
+        """Returns (suggestions, source) with source 'cache' or 'prefix_cache', or (None, None)."""
+        prefix, cached = self._prefix_lookup(
+            self._suggestions, (product, version), query, self.max_suggestion_extension
+        )
+        if cached is None:
+            self.stats_counters["suggestion_misses"] += 1
+            return None, None
+        if prefix == normalize_query(query):
+            self.stats_counters["suggestion_hits"] += 1
+            return cached, "cache"
+        fitting = [s for s in cached if _fits_typed_text(s, query)]
+        if len(fitting) >= min_matches:
+            self.stats_counters["suggestion_prefix_hits"] += 1
+            return fitting, "prefix_cache"
+        self.stats_counters["suggestion_misses"] += 1
+        return None, None
+
+    def store_suggestions(self, product, version, query, suggestions):
+        if not suggestions:
+            return
+        with self._lock:
+            self._suggestions.put(((product, version), normalize_query(query)), suggestions)
+
+    # -- local candidates --
+    def record_query(self, product, version, query):
+        query = query.strip()
+        if not query:
+            return
+        with self._lock:
+            for scope in {(product, version), (None, None)}:
+                past = self._past_queries.setdefault(scope, deque(maxlen=self._past_queries_per_scope))
+                past.append(query)
+
+    def local_candidates(self, product, version, query, docs=(), limit=5):
+        typed = normalize_query(query)
+        if not typed:
+            return []
+        with self._lock:
+            past = list(self._past_queries.get((product, version), ()))
+            if (product, version) != (None, None):
+                past += list(self._past_queries.get((None, None), ()))
+        # Past queries that start with what's typed, most frequent first
+        counts = Counter(q for q in past if normalize_query(q).startswith(typed) and normalize_query(q) != typed)
+        candidates = [q for q, _ in counts.most_common(limit)]
+
+        # Section headers from the retrieved docs that share a word with the query
+        query_words = {w for w in _words(query) if len(w) >= 3}
+        for doc in docs:
+            for header in re.findall(r'^\s*h[12]:\s*(.+)$', doc.get("document", ""), re.MULTILINE):
+                header = header.strip()
+                if header and header not in candidates and query_words & set(_words(header)):
+                    candidates.append(header)
+                if len(candidates) >= limit:
+                    return candidates
+        return candidates[:limit]
+
+    # -- coalescing --
+    def coalesce(self, key, compute):
+        """Run compute() once per key at a time; concurrent callers share its result."""
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._inflight[key] = future
+        if not owner:
+            self.stats_counters["coalesced"] += 1
+            return future.result()
+        try:
+            result = compute()
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def stats(self):
+        return dict(self.stats_counters)
@@ -0,0 +1,143 @@
+import os
+
+from hybrid_search import TEXT_SEARCH_CONFIG
+
+# Session settings per latency/recall trade-off. hnsw.ef_search is raised to
+# at least top_k at query time, otherwise HNSW returns fewer rows than asked.
+SEARCH_PROFILES = {
+    "fast": {"hnsw.ef_search": 20, "ivfflat.probes": 1},
+    "balanced": {"hnsw.ef_search": 64, "ivfflat.probes": 10},
+    "accurate": {"hnsw.ef_search": 200, "ivfflat.probes": 40},
+}
+DEFAULT_SEARCH_PROFILE = os.environ.get("VECTOR_SEARCH_PROFILE", "balanced")
+
+# langchain creates `embedding` as an untyped `vector` column, and HNSW/IVFFlat
+# need a fixed dimension. With EMBEDDING_DIM set, indexes are built on
+# embedding::vector(dim) and queries order by the same expression so the
+# planner can use them.
+EMBEDDING_DIM = os.environ.get("EMBEDDING_DIM")
+
+
+def embedding_expr(alias="e"):
+    column = f"{alias}.embedding" if alias else "embedding"
+    return f"({column}::vector({int(EMBEDDING_DIM)}))" if EMBEDDING_DIM else column
+
+
+def profile_settings(profile, top_k):
+    settings = dict(SEARCH_PROFILES.get(profile or DEFAULT_SEARCH_PROFILE, SEARCH_PROFILES["balanced"]))
+    settings["hnsw.ef_search"] = max(settings["hnsw.ef_search"], top_k)
+    return settings
+
+
+def apply_search_profile(cur, profile, top_k):
+    """SET LOCAL the profile's GUCs; they last until the transaction ends (i.e. the pool checkin)."""
+    for name, value in profile_settings(profile, top_k).items():
+        cur.execute(f"SET LOCAL {name} = {int(value)}")
+
+
+def index_name(method, collection_id=None):
+    suffix = f"_{collection_id.replace('-', '')[:12]}" if collection_id else ""
+    return f"langchain_pg_embedding_{method}{suffix}"
+
+
+def create_index_sql(method="hnsw", collection_id=None, m=16, ef_construction=64, lists=100):
+    if method == "hnsw":
+        using = f"hnsw ({embedding_expr(None)} vector_cosine_ops) WITH (m = {int(m)}, ef_construction = {int(ef_construction)})"
+    elif method == "ivfflat":
+        using = f"ivfflat ({embedding_expr(None)} vector_cosine_ops) WITH (lists = {int(lists)})"
+    elif method == "fts":
+        # Full-text side of hybrid retrieval; expression must match hybrid_search.hybrid_sql
+        using = f"gin (to_tsvector('{TEXT_SEARCH_CONFIG}', document))"
+    else:
+        raise ValueError(f"Unknown index method: {method}")
+    where = f" WHERE collection_id = '{collection_id}'::uuid" if collection_id else ""
+    return (
+        f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name(method, collection_id)} "
+        f"ON langchain_pg_embedding USING {using}{where}"
+    )
+
+
+def list_indexes(cur):
+    cur.execute("""
+        SELECT i.indexname, i.indexdef, x.indisvalid
+        FROM pg_indexes i
+        JOIN pg_class c ON c.relname = i.indexname
+        JOIN pg_index x ON x.indexrelid = c.oid
+        WHERE i.tablename = 'langchain_pg_embedding'
+    """)
+    indexes = []
+    for name, definition, valid in cur.fetchall():
+        lowered = definition.lower()
+        if "using hnsw" in lowered:
+            method = "hnsw"
+        elif "using ivfflat" in lowered:
+            method = "ivfflat"
+        elif "using gin" in lowered and "to_tsvector" in lowered:
+            method = "fts"
+        else:
+            method = "other"
+        indexes.append({
+            "name": name,
+            "method": method,
+            "partial": " where " in lowered,
+            "valid": valid,
+            "definition": definition,
+        })
+    return indexes
+
+
+def ensure_indexes(conn, method="hnsw", collection_ids=None, **params):
+    """
+    Create the ANN index if missing: one global index, or one partial index
+    per collection id when collection_ids is given. Built CONCURRENTLY so
+    searches keep running; invalid leftovers from a failed build are dropped
+    and rebuilt. Returns the names of indexes created. Raises ValueError for
+    an hnsw/ivfflat index without EMBEDDING_DIM (the untyped column can't
+    be indexed).
+    """
+    if method in ("hnsw", "ivfflat") and not EMBEDDING_DIM:
+        raise ValueError(f"A {method} index needs EMBEDDING_DIM to be set")
+    targets = collection_ids or [None]
+    previous_autocommit = conn.autocommit
+    conn.rollback()
+    conn.autocommit = True  # CREATE INDEX CONCURRENTLY can't run in a transaction
+    created = []
+    try:
+        cur = conn.cursor()
+        existing = {ix["name"]: ix for ix in list_indexes(cur)}
+        for collection_id in targets:
+            name = index_name(method, collection_id)
+            if name in existing and existing[name]["valid"]:
+                continue
+            if name in existing:
+                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+            cur.execute(create_index_sql(method, collection_id, **params))
+            created.append(name)
+        cur.close()
+    finally:
+        conn.autocommit = previous_autocommit
+    return created
+
+
+def drop_indexes(conn, method, collection_ids):
+    """
+    Drop the partial `method` index of each collection (CONCURRENTLY, so
+    searches on other collections aren't blocked), e.g. before a bulk load
+    that would otherwise update it row by row. Returns the names dropped.
+    """
+    previous_autocommit = conn.autocommit
+    conn.commit()
+    conn.autocommit = True
+    dropped = []
+    try:
+        cur = conn.cursor()
+        existing = {ix["name"] for ix in list_indexes(cur)}
+        for collection_id in collection_ids:
+            name = index_name(method, collection_id)
+            if name in existing:
+                cur.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+                dropped.append(name)
+        cur.close()
+    finally:
+        conn.autocommit = previous_autocommit
+    return dropped
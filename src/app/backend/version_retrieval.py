@@ -0,0 +1,61 @@
+import hashlib
+import re
+import uuid
+
+
+def cross_version_sql(emb, collection_ids):
+    """
+    Per-collection top-k for several collections in one statement: a UNION
+    ALL of one ordered, limited arm per collection. The collection ids are
+    inlined as literals, written the way create_index_sql writes the
+    partial index predicates, so the planner can match each arm to its
+    collection's ANN index (a parameter or an outer reference can't be
+    matched). Named parameters: embedding, top_k. Rows: (arm, document,
+    collection uuid as text, distance), where arm indexes `collection_ids`.
+    """
+    arms = [
+        f"""(
+            SELECT {arm} AS arm, e.document, e.collection_id::text, {emb} <=> %(embedding)s::vector AS distance
+            FROM langchain_pg_embedding e
+            WHERE e.collection_id = '{uuid.UUID(str(collection_id))}'::uuid
+            ORDER BY {emb} <=> %(embedding)s::vector
+            LIMIT %(top_k)s
+        )"""
+        for arm, collection_id in enumerate(collection_ids)
+    ]
+    return "\n        UNION ALL\n        ".join(arms) + "\n        ORDER BY arm, distance"
+
+
+def _chunk_key(document):
+    return hashlib.sha1(re.sub(r'\s+', ' ', document.strip()).encode("utf-8")).hexdigest()
+
+
+def split_shared_chunks(hits_by_version):
+    """
+    Separate chunks whose text is identical (up to whitespace) in more than
+    one version from the version-specific ones.
+
+    Returns (shared, unique_by_version): shared blocks carry the versions they
+    appear in and their best similarity; unique_by_version keeps each version's
+    remaining hits in their original order.
+    """
+    seen = {}
+    for version, hits in hits_by_version.items():
+        for hit in hits:
+            seen.setdefault(_chunk_key(hit["document"]), []).append((version, hit))
+
+    shared, shared_keys = [], set()
+    for key, occurrences in seen.items():
+        versions = list(dict.fromkeys(v for v, _ in occurrences))
+        if len(versions) < 2:
+            continue
+        best = max((h for _, h in occurrences), key=lambda h: h.get("similarity", 0))
+        shared.append({**best, "versions": versions})
+        shared_keys.add(key)
+
+    unique_by_version = {
+        version: [h for h in hits if _chunk_key(h["document"]) not in shared_keys]
+        for version, hits in hits_by_version.items()
+    }
+    shared.sort(key=lambda h: h.get("similarity", 0), reverse=True)
+    return shared, unique_by_version
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 
 interface ChatInputProps {
   onSend: (msg: string) => void;
@@ -12,6 +12,12 @@ const ChatInput: React.FC<ChatInputProps> = ({ onSend, loading, context = [] })
   const [activeSuggestion, setActiveSuggestion] = useState<number>(-1);
 
 const [isFocused, setIsFocused] = useState(false);
+  // Lets the backend skip the LLM call for requests superseded by newer keystrokes
+  const sessionId = useRef(Math.random().toString(36).slice(2));
+  const seq = useRef(0);
+  // Read through a ref so a new context array from the parent doesn't refetch
+  const contextRef = useRef(context);
+  contextRef.current = context;
 
 
   // Fetch suggestions
@@ -21,6 +27,7 @@ const [isFocused, setIsFocused] = useState(false);
       return;
     }
 
+    const controller = new AbortController();
     const fetchSuggestions = async () => {
       try {
         const res = await fetch('http://127.0.0.1:5000/api/suggestions', {
@@ -28,19 +35,27 @@ const [isFocused, setIsFocused] = useState(false);
           headers: { 'Content-Type': 'application/json' },
           body: JSON.stringify({
             query: input,
-            context,
+            context: contextRef.current,
+            session_id: sessionId.current,
+            seq: ++seq.current,
           }),
+          signal: controller.signal,
         });
         const data = await res.json();
         setSuggestions(Array.isArray(data.suggestions) ? data.suggestions : []);
       } catch (err) {
-        console.error('Failed to fetch suggestions', err);
+        if ((err as Error).name !== 'AbortError') {
+          console.error('Failed to fetch suggestions', err);
+        }
       }
     };
 
     const delayDebounce = setTimeout(fetchSuggestions, 150);
-    return () => clearTimeout(delayDebounce);
-  }, [input, context]);
+    return () => {
+      clearTimeout(delayDebounce);
+      controller.abort();
+    };
+  }, [input]);
 
   const handleSend = () => {
     if (input.trim() && !loading) {